@@ -0,0 +1,166 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import exists, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from . import db
+from .models import PDF, Blob, Video
+from .storage import get_storage, parts_folder
+from .uploads import expire_uploads
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+GC_BATCH_SIZE = 100
+
+_gc_lock = threading.Lock()
+_gc_started = False
+
+
+def blob_key(digest):
+    # Sharded two levels deep so no directory grows past a few thousand entries
+    return f"blobs/{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+def temp_path(spool_folder):
+    directory = os.path.join(spool_folder, 'tmp')
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, uuid.uuid4().hex)
+
+
+def store_stream(spool_folder, stream):
+    # Spools an upload to a local temp file while hashing it; returns (temp path, size, sha256)
+    path = temp_path(spool_folder)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(path, 'wb') as target:
+            while True:
+                chunk = stream.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                target.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, size, digest.hexdigest()
+
+
+def reserve_blob(digest, size):
+    # Records the blob unreferenced in its own, immediately committed transaction, before the file
+    # is placed. If the caller's transaction later rolls back, this row is what lets the GC find
+    # and reclaim the file once the grace period is over. An existing unreferenced row gets a
+    # fresh released_at so the GC leaves it alone while the caller takes its reference.
+    now = datetime.utcnow()
+    with db.engine.begin() as connection:
+        connection.execute(
+            insert(Blob).values(hash=digest, size=size, ref_count=0, released_at=now).on_conflict_do_update(
+                index_elements=[Blob.hash], set_={'released_at': now}, where=Blob.ref_count <= 0
+            )
+        )
+
+
+def commit_blob(storage, spooled_path, size, digest):
+    # Takes a reference before placing the file. The upsert locks the blob row, so it waits for
+    # (or is skipped by) a concurrent GC pass and the file can't be removed underneath us.
+    # Returns the storage key recorded in PDF/Video.file_path.
+    reserve_blob(digest, size)
+    db.session.execute(
+        insert(Blob).values(hash=digest, size=size, ref_count=1).on_conflict_do_update(
+            index_elements=[Blob.hash], set_={'ref_count': Blob.ref_count + 1}
+        )
+    )
+    key = blob_key(digest)
+    if storage.exists(key):
+        # Duplicate content, keep the stored copy
+        os.remove(spooled_path)
+    else:
+        storage.save(key, spooled_path)
+    return key
+
+
+def release_subscription_blobs(subscription_id):
+    # Drops the references held by a subscription's files; the GC reclaims the bytes later
+    counts = {}
+    for model in (PDF, Video):
+        rows = db.session.query(model.blob_hash, func.count(model.id)).filter(
+            model.subscription_id == subscription_id, model.blob_hash.isnot(None)
+        ).group_by(model.blob_hash)
+        for digest, count in rows:
+            counts[digest] = counts.get(digest, 0) + count
+
+    now = datetime.utcnow()
+    for digest, count in counts.items():
+        db.session.execute(
+            update(Blob).where(Blob.hash == digest).values(ref_count=Blob.ref_count - count, released_at=now)
+        )
+    maybe_start_in_process_gc(current_app._get_current_object())
+
+
+def collect_garbage(storage, grace_seconds, batch_size=GC_BATCH_SIZE):
+    # Deletes one batch of unreferenced blobs; returns how many were reclaimed
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    candidates = db.session.execute(
+        select(Blob.hash).where(
+            Blob.ref_count <= 0,
+            Blob.released_at < cutoff,
+            ~exists().where(PDF.blob_hash == Blob.hash),
+            ~exists().where(Video.blob_hash == Blob.hash)
+        ).limit(batch_size).with_for_update(skip_locked=True)
+    ).scalars().all()
+
+    # Files go first while the rows are still locked, so an upload re-using the content waits for us
+    for digest in candidates:
+        storage.delete(blob_key(digest))
+    if candidates:
+        db.session.execute(Blob.__table__.delete().where(Blob.hash.in_(candidates)))
+    db.session.commit()
+    return len(candidates)
+
+
+def run_gc(app, interval=None, stop=None):
+    # Each pass reclaims unreferenced blobs and expires abandoned resumable uploads
+    grace = app.config['BLOB_GC_GRACE_SECONDS']
+    max_upload_age = app.config['UPLOAD_SESSION_MAX_AGE_SECONDS']
+    with app.app_context():
+        try:
+            while True:
+                try:
+                    while collect_garbage(get_storage(app), grace) == GC_BATCH_SIZE:
+                        pass
+                    while expire_uploads(parts_folder(app), max_upload_age) == GC_BATCH_SIZE:
+                        pass
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"Blob GC error: {e}")
+                if not interval or (stop is not None and stop.is_set()):
+                    break
+                time.sleep(interval)
+        finally:
+            db.session.remove()
+
+
+def maybe_start_in_process_gc(app):
+    # Single-node deployments can run the collector in the web process instead of `flask blob-gc`
+    global _gc_started
+    if not app.config['BLOB_GC_IN_PROCESS'] or _gc_started:
+        return
+    with _gc_lock:
+        if not _gc_started:
+            interval = app.config['BLOB_GC_INTERVAL_SECONDS']
+            threading.Thread(target=run_gc, args=(app, interval), name='blob-gc', daemon=True).start()
+            _gc_started = True
+
+
+@click.command('blob-gc')
+@click.option('--interval', default=0, show_default=True, help='Seconds between passes; 0 runs once.')
+def blob_gc_command(interval):
+    """Reclaim unreferenced upload blobs and expire abandoned resumable uploads."""
+    run_gc(current_app._get_current_object(), interval)
@@ -0,0 +1,122 @@
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import false, func, literal, select, tuple_, union_all, update
+
+from . import db
+from .models import Broadcast, Notification, Subscription, User
+
+def fanout_mode():
+    return current_app.config['NOTIFICATION_FANOUT_MODE']
+
+
+def publish_broadcast(subscription, message):
+    # O(1) write regardless of audience size; the caller commits. Flushed so the id can be read
+    # before the commit expires it, which would cost a reload.
+    broadcast = Broadcast(subscription_id=subscription.id, notification_type=subscription.title, message=message)
+    db.session.add(broadcast)
+    db.session.flush()
+    return broadcast
+
+
+def latest_broadcast_id(subscription_id):
+    # Scalar subquery for the plan's newest broadcast id, 0 when it has none
+    return select(func.coalesce(func.max(Broadcast.id), 0)).where(
+        Broadcast.subscription_id == subscription_id
+    ).scalar_subquery()
+
+
+def start_watermark(user, subscription_id):
+    # Called whenever a user is put on a plan: its earlier broadcasts count as read, the
+    # same as in write mode, where a new subscriber never gets the notifications sent before.
+    # Assigned as an expression, so it rides along in the user's UPDATE without a query.
+    user.broadcast_read_id = latest_broadcast_id(subscription_id)
+
+
+def inbox_page(user, limit, before=None):
+    # Direct notifications and the user's plan broadcasts merged newest first.
+    # `before` is the (created_at, kind, id) of the last row of the previous page.
+    direct = select(
+        Notification.id,
+        literal('direct').label('kind'),
+        Notification.message,
+        func.coalesce(Notification.is_read, false()).label('is_read'),
+        func.coalesce(Subscription.title, 'No subscription').label('subscription'),
+        Notification.created_at
+    ).outerjoin(Subscription, Notification.subscription_id == Subscription.id).where(
+        Notification.user_id == user.id
+    )
+    if before is not None:
+        before = tuple_(*[literal(value) for value in before])
+        direct = direct.where(tuple_(Notification.created_at, literal('direct'), Notification.id) < before)
+    branches = [direct]
+
+    if user.subscription_id:
+        broadcasts = select(
+            Broadcast.id,
+            literal('broadcast').label('kind'),
+            Broadcast.message,
+            (Broadcast.id <= user.broadcast_read_id).label('is_read'),
+            Subscription.title.label('subscription'),
+            Broadcast.created_at
+        ).join(Subscription, Broadcast.subscription_id == Subscription.id).where(
+            Broadcast.subscription_id == user.subscription_id
+        )
+        if before is not None:
+            broadcasts = broadcasts.where(tuple_(Broadcast.created_at, literal('broadcast'), Broadcast.id) < before)
+        branches.append(broadcasts)
+
+    # Each branch is ordered and limited on its own index before the merge
+    branches = [branch.order_by(branch.selected_columns.created_at.desc(), branch.selected_columns.id.desc())
+                .limit(limit + 1).subquery().select() for branch in branches]
+    inbox = union_all(*branches).subquery()
+    rows = db.session.execute(
+        select(inbox).order_by(inbox.c.created_at.desc(), inbox.c.kind.desc(), inbox.c.id.desc()).limit(limit + 1)
+    ).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = f"{last.created_at.isoformat()}|{last.kind}|{last.id}"
+    return rows, next_cursor
+
+
+def parse_inbox_cursor(value):
+    # Inverse of the next_cursor built by inbox_page; raises ValueError on malformed input
+    created_at, kind, row_id = value.split('|')
+    if kind not in ('direct', 'broadcast'):
+        raise ValueError(kind)
+    return datetime.fromisoformat(created_at), kind, int(row_id)
+
+
+def unread_count(user_id):
+    # Served from the partial unread index and the broadcast watermark, message bodies are never read
+    direct = select(func.count(Notification.id)).where(
+        Notification.user_id == user_id, Notification.is_read == false()
+    ).scalar_subquery()
+    broadcasts = select(func.count(Broadcast.id)).join(
+        User, Broadcast.subscription_id == User.subscription_id
+    ).where(User.id == user_id, Broadcast.id > User.broadcast_read_id).scalar_subquery()
+    return db.session.execute(select(direct + broadcasts)).scalar()
+
+
+def mark_notifications_read(user, ids=None):
+    # One UPDATE for the direct notifications; all of them when no ids are given
+    query = update(Notification).where(Notification.user_id == user.id, Notification.is_read.isnot(True))
+    if ids is not None:
+        query = query.where(Notification.id.in_(ids))
+    return db.session.execute(query.values(is_read=True)).rowcount
+
+
+def mark_broadcasts_read(user, up_to=None):
+    # Advance the user's watermark; it never moves backwards, nor past the plan's newest broadcast,
+    # so broadcasts published later still arrive unread
+    latest = latest_broadcast_id(user.subscription_id)
+    if up_to is not None:
+        latest = func.least(up_to, latest)
+    db.session.execute(
+        update(User)
+        .where(User.id == user.id, User.broadcast_read_id < latest)
+        .values(broadcast_read_id=latest)
+    )
@@ -0,0 +1,66 @@
+from flask import current_app, request
+
+from .metrics import current_request_stats
+
+
+class QueryBudgetExceeded(RuntimeError):
+    def __init__(self, endpoint, budget, statements, log_chars=None):
+        self.endpoint = endpoint
+        self.budget = budget
+        self.statements = statements
+        listing = '\n'.join(f"  {number}. {statement[:log_chars]}" for number, statement in enumerate(statements, 1))
+        super().__init__(f"{endpoint} issued {len(statements)} SQL statements, budget is {budget}:\n{listing}")
+
+
+def query_budget(max_queries, **per_method):
+    # Declares the most SQL statements one request to the view may issue, optionally per
+    # method (query_budget(1, PUT=2)). Place it under @main.route; wrappers built with
+    # functools.wraps (like @replica_reads) keep the attribute.
+    def decorator(view):
+        view.query_budget = {None: max_queries, **{method.upper(): limit for method, limit in per_method.items()}}
+        return view
+    return decorator
+
+
+def endpoint_budgets(app):
+    # endpoint -> {method or None: budget} for every view that declares one
+    return {endpoint: view.query_budget for endpoint, view in app.view_functions.items()
+            if getattr(view, 'query_budget', None) is not None}
+
+
+def _budget_for_request():
+    budgets = getattr(current_app.view_functions.get(request.endpoint), 'query_budget', None)
+    if budgets is None:
+        return None
+    return budgets.get(request.method, budgets[None])
+
+
+def _start_capture():
+    if current_app.config['QUERY_BUDGET_MODE'] == 'off' or _budget_for_request() is None:
+        return
+    # Counting rides on the metrics hooks; with METRICS_ENABLED off there is nothing to check
+    stats = current_request_stats()
+    if stats is not None:
+        stats.statements = []
+
+
+def _check(response):
+    stats = current_request_stats()
+    if stats is None or stats.statements is None:
+        return response
+    budget = _budget_for_request()
+    if stats.queries <= budget:
+        return response
+
+    error = QueryBudgetExceeded(request.endpoint, budget, list(stats.statements),
+                                current_app.config['QUERY_BUDGET_LOG_CHARS'])
+    if current_app.config['QUERY_BUDGET_MODE'] == 'raise':
+        raise error
+    current_app.logger.warning(str(error))
+    return response
+
+
+def init_blueprint(blueprint):
+    # Register after the metrics hooks, which create the per-request stats this reads
+    blueprint.before_request(_start_capture)
+    blueprint.after_request(_check)
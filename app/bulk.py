@@ -0,0 +1,142 @@
+from sqlalchemy import case, delete, insert, select, update
+
+from . import db
+from .conditional import COURSE_LINKS_CACHE_NAME, bump_cache_version
+from .counters import counter_state, record_user_changes
+from .models import CourseLink, Subscription, User
+
+
+class BulkInputError(ValueError):
+    pass
+
+
+def require_list(data, key, max_items):
+    items = (data or {}).get(key)
+    if not isinstance(items, list) or not items:
+        raise BulkInputError(f"'{key}' must be a non-empty list")
+    if len(items) > max_items:
+        raise BulkInputError(f"At most {max_items} items per request")
+    return items
+
+
+def _update_users(where, values):
+    # One UPDATE for the whole set. The CTE locks and captures the old values so the
+    # dashboard counters can be adjusted by exactly what changed, in the same transaction.
+    # Rows are locked in id order so overlapping batches can't deadlock.
+    old = select(User.id, User.role, User.transaction_id, User.subscription_id).where(where).order_by(
+        User.id
+    ).with_for_update().cte('old')
+    rows = db.session.execute(
+        update(User).where(User.id == old.c.id).values(**values).returning(
+            User.id, User.email, User.role, User.transaction_id, User.subscription_id,
+            old.c.role.label('old_role'), old.c.transaction_id.label('old_transaction_id'),
+            old.c.subscription_id.label('old_subscription_id')
+        ),
+        execution_options={'synchronize_session': False}
+    ).all()
+    record_user_changes([
+        (counter_state(row.old_role, row.old_transaction_id, row.old_subscription_id),
+         counter_state(row.role, row.transaction_id, row.subscription_id))
+        for row in rows
+    ])
+    return rows
+
+
+def approve_transactions(items):
+    # items: [{'email': ..., 'approved': bool}]. Approvals and rejections share one UPDATE, so the
+    # counters are adjusted once and all rows of the batch are locked together in id order.
+    decisions = {}
+    for item in items:
+        if not isinstance(item, dict) or not item.get('email') or 'approved' not in item:
+            raise BulkInputError("Each item needs 'email' and 'approved'")
+        decisions[item['email']] = bool(item['approved'])
+
+    approved = [email for email, decision in decisions.items() if decision]
+    if len(approved) == len(decisions):
+        values = {'role': 'premium'}
+    elif not approved:
+        values = {'role': 'user', 'subscription_id': None, 'transaction_id': None}
+    else:
+        # Rejected rows lose their plan and transaction, approved ones keep them
+        is_approved = User.email.in_(approved)
+        values = {
+            'role': case((is_approved, 'premium'), else_='user'),
+            'subscription_id': case((is_approved, User.subscription_id)),
+            'transaction_id': case((is_approved, User.transaction_id)),
+        }
+    found = {row.email for row in _update_users(User.email.in_(list(decisions)), values)}
+
+    return [{'email': item['email'], 'status': 'updated' if item['email'] in found else 'not_found'}
+            for item in items]
+
+
+def revoke_subscriptions(user_ids):
+    try:
+        user_ids = [int(user_id) for user_id in user_ids]
+    except (TypeError, ValueError):
+        raise BulkInputError("'user_ids' must be integers")
+
+    rows = _update_users(User.id.in_(user_ids), {'subscription_id': None, 'role': 'user'})
+    found = {row.id for row in rows}
+    return [{'user_id': user_id, 'status': 'revoked' if user_id in found else 'not_found'} for user_id in user_ids]
+
+
+def add_course_links(items):
+    # Validates every item, checks all referenced subscriptions in one query, then one multi-row INSERT
+    results = [None] * len(items)
+    subscription_ids = set()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get('subscription_id') or not item.get('name') or not item.get('url'):
+            results[index] = {'index': index, 'status': 'error',
+                              'message': 'All fields (subscription_id, name, url) are required!'}
+            continue
+        try:
+            subscription_ids.add(int(item['subscription_id']))
+        except (TypeError, ValueError):
+            results[index] = {'index': index, 'status': 'error', 'message': 'subscription_id must be an integer'}
+
+    existing = set(db.session.execute(
+        select(Subscription.id).where(Subscription.id.in_(subscription_ids))
+    ).scalars()) if subscription_ids else set()
+
+    rows, positions = [], []
+    for index, item in enumerate(items):
+        if results[index] is not None:
+            continue
+        if int(item['subscription_id']) not in existing:
+            results[index] = {'index': index, 'status': 'error', 'message': 'Subscription not found!'}
+            continue
+        rows.append({'subscription_id': int(item['subscription_id']), 'name': item['name'], 'url': item['url']})
+        positions.append(index)
+
+    if rows:
+        # Sent as multi-row INSERTs; sort_by_parameter_order pairs each returned id with its input row
+        ids = db.session.execute(
+            insert(CourseLink).returning(CourseLink.id, sort_by_parameter_order=True), rows
+        ).scalars().all()
+        for index, link_id in zip(positions, ids):
+            results[index] = {'index': index, 'status': 'created', 'id': link_id}
+        bump_cache_version(COURSE_LINKS_CACHE_NAME)
+    return results
+
+
+def delete_course_links(link_ids):
+    try:
+        link_ids = [int(link_id) for link_id in link_ids]
+    except (TypeError, ValueError):
+        raise BulkInputError("'ids' must be integers")
+
+    deleted = set(db.session.execute(
+        delete(CourseLink).where(CourseLink.id.in_(link_ids)).returning(CourseLink.id),
+        execution_options={'synchronize_session': False}
+    ).scalars())
+    if deleted:
+        bump_cache_version(COURSE_LINKS_CACHE_NAME)
+    return [{'id': link_id, 'status': 'deleted' if link_id in deleted else 'not_found'} for link_id in link_ids]
+
+
+def summarize(results):
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    return summary
@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import db
+from .compression import PrecompressedBody
+from .conditional import bump_cache_version
+from .models import CacheVersion, Subscription
+
+CATALOG_CACHE_NAME = 'subscriptions'
+
+SUBSCRIPTION_FIELDS = ('id', 'heading', 'title', 'validity', 'price', 'course_offered', 'type')
+
+# Read-only snapshot of a Subscription row; use the ORM model for writes
+CachedSubscription = namedtuple('CachedSubscription', SUBSCRIPTION_FIELDS)
+
+
+class SubscriptionCatalog:
+    # In-process copy of the subscription table, reloaded when the shared version row moves
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0
+        self._by_title = {}
+        self._body = None
+
+    def _current_version(self):
+        return db.session.query(CacheVersion.version).filter_by(name=CATALOG_CACHE_NAME).scalar() or 0
+
+    def _refresh(self):
+        check_every = current_app.config['CATALOG_VERSION_CHECK_SECONDS']
+        if self._version is not None and time.monotonic() - self._checked_at < check_every:
+            return
+        with self._lock:
+            if self._version is not None and time.monotonic() - self._checked_at < check_every:
+                return
+            # Version first: a change committed in between only causes one extra reload
+            version = self._current_version()
+            if version != self._version:
+                self._load(version)
+            self._checked_at = time.monotonic()
+
+    def _load(self, version):
+        rows = db.session.query(*[getattr(Subscription, field) for field in SUBSCRIPTION_FIELDS]).order_by(
+            Subscription.id
+        ).all()
+        subscriptions = [CachedSubscription(*row) for row in rows]
+        self._by_title = {subscription.title: subscription for subscription in subscriptions}
+        self._body = PrecompressedBody(
+            current_app.json.dumps([subscription._asdict() for subscription in subscriptions])
+        )
+        self._version = version
+
+    def get_by_title(self, title):
+        self._refresh()
+        return self._by_title.get(title)
+
+    def versioned_body(self):
+        # (version, PrecompressedBody) from the same snapshot; the version doubles as the ETag,
+        # and the gzip/brotli variants are built once per version
+        self._refresh()
+        with self._lock:
+            return self._version, self._body
+
+    def reset(self):
+        with self._lock:
+            self._version = None
+
+
+catalog = SubscriptionCatalog()
+
+
+def invalidate_catalog():
+    # Call in the same transaction as the subscription write; the bump commits with it and this
+    # worker's copy is dropped only then, so no request can reload the old rows in between
+    bump_cache_version(CATALOG_CACHE_NAME)
+    db.session.info['reset_catalog'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _reset_after_commit(session):
+    if session.info.pop('reset_catalog', False):
+        catalog.reset()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_reset(session, previous_transaction):
+    session.info.pop('reset_catalog', None)
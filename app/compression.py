@@ -0,0 +1,129 @@
+import gzip
+import threading
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MEDIA_ENDPOINTS = ('main.get_docs', 'main.get_video')
+MEDIA_MIMETYPES = ('application/pdf',)
+# Never buffered or encoded: proxies and browsers must see every event as it is sent
+UNCOMPRESSED_MIMETYPES = ('text/event-stream',)
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate_encoding():
+    # The client's preferred encoding we can produce, or None for identity
+    return request.accept_encodings.best_match(available_encodings())
+
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    # mtime=0 keeps the output, and anything hashed from it, stable
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _compress_stream(chunks, encoding, level):
+    # Each chunk is flushed on its own so streamed responses stay incremental
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+        return
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+class PrecompressedBody:
+    # A cached payload with its encoded variants, each built on first use and kept until the
+    # payload changes, so compression costs once per change instead of once per request.
+
+    def __init__(self, data):
+        self.data = data.encode() if isinstance(data, str) else data
+        self._lock = threading.Lock()
+        self._variants = {}
+
+    def variant(self, encoding):
+        if encoding is None:
+            return self.data
+        with self._lock:
+            if encoding not in self._variants:
+                self._variants[encoding] = compress(self.data, encoding, 11 if encoding == 'br' else 9)
+            return self._variants[encoding]
+
+
+def precompressed_response(body, mimetype):
+    # Serves the best cached variant; the after-request hook leaves encoded responses alone
+    encoding = negotiate_encoding() if len(body.data) >= current_app.config['COMPRESSION_MIN_SIZE'] else None
+    response = current_app.response_class(body.variant(encoding), mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _compressible(app, response):
+    if response.status_code < 200 or response.status_code in (204, 206, 304) or request.method == 'HEAD':
+        return False
+    if 'Content-Encoding' in response.headers or 'Content-Range' in response.headers:
+        return False
+    # Bodies served by nginx/Apache from disk are empty here
+    if 'X-Accel-Redirect' in response.headers or 'X-Sendfile' in response.headers:
+        return False
+    mimetype = response.mimetype
+    if mimetype in UNCOMPRESSED_MIMETYPES:
+        return False
+    if request.endpoint in MEDIA_ENDPOINTS:
+        return not app.config['COMPRESSION_SKIP_MEDIA'] and mimetype in MEDIA_MIMETYPES
+    return mimetype in app.config['COMPRESSION_MIMETYPES']
+
+
+def compress_response(response):
+    app = current_app._get_current_object()
+    if not app.config['COMPRESSION_ENABLED'] or not _compressible(app, response):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    level = app.config['COMPRESSION_BROTLI_QUALITY' if encoding == 'br' else 'COMPRESSION_GZIP_LEVEL']
+
+    if response.is_streamed or response.direct_passthrough:
+        # Exports, streamed lists and files: length unknown up front, encode chunk by chunk
+        original = response.response
+        response.response = _compress_stream(response.iter_encoded(), encoding, level)
+        if hasattr(original, 'close'):
+            response.call_on_close(original.close)
+        response.direct_passthrough = False
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config['COMPRESSION_MIN_SIZE']:
+            return response
+        compressed = compress(data, encoding, level)
+        if len(compressed) >= len(data):
+            return response
+        response.set_data(compressed)
+
+    response.headers['Content-Encoding'] = encoding
+    # Byte ranges no longer line up with the encoded body, and a strong validator would now be wrong
+    response.headers.pop('Accept-Ranges', None)
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
@@ -0,0 +1,58 @@
+import hashlib
+
+from flask import current_app, make_response, request
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from . import db
+from .models import CacheVersion
+
+COURSE_LINKS_CACHE_NAME = 'course_links'
+
+# Per endpoint; CACHE_CONTROL in config.py overrides single entries
+DEFAULT_CACHE_CONTROL = {
+    # Same for everyone and rarely edited; a minute of staleness saves mobile clients the round trip
+    'main.get_all_subscriptions': 'public, max-age=60',
+    # Per-user or admin data: always revalidate, a 304 is cheap
+    'main.user_detail': 'private, no-cache',
+    'main.get_course_links': 'private, no-cache',
+    'main.get_all_course_links': 'private, no-cache',
+}
+
+
+def bump_cache_version(name):
+    # Call in the same transaction as the write; the bump commits with it
+    db.session.execute(
+        insert(CacheVersion).values(name=name, version=1).on_conflict_do_update(
+            index_elements=[CacheVersion.name], set_={'version': CacheVersion.version + 1}
+        )
+    )
+
+
+def cache_version(name):
+    # Scalar subquery, so a validator query can carry versions along with its own columns
+    return select(CacheVersion.version).where(CacheVersion.name == name).scalar_subquery()
+
+
+def make_etag(*parts):
+    # Weak: the validator tracks the data, not the exact bytes (JSON settings, compression)
+    return hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+
+
+def cache_control_for(endpoint):
+    overrides = current_app.config['CACHE_CONTROL']
+    return overrides.get(endpoint, DEFAULT_CACHE_CONTROL.get(endpoint))
+
+
+def conditional_response(etag, build):
+    # Answers 304 before the body is built when the client already has this version;
+    # otherwise calls build() and tags whatever it returns.
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag, weak=True)
+    cache_control = cache_control_for(request.endpoint)
+    if cache_control:
+        response.headers['Cache-Control'] = cache_control
+    return response
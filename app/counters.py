@@ -0,0 +1,76 @@
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import DashboardStats, User
+
+STATS_ROW_ID = 1
+COUNTER_COLUMNS = ('total_users', 'total_premium_users', 'pending_requests', 'total_non_subscribers')
+
+
+def counter_state(role, transaction_id, subscription_id):
+    # Which dashboard counters a single user contributes to, given their current column values
+    return {
+        'total_users': 1,
+        'total_premium_users': int(role == 'premium'),
+        'pending_requests': int(transaction_id is not None and role == 'user'),
+        'total_non_subscribers': int(subscription_id is None),
+    }
+
+
+def user_counter_state(user):
+    return counter_state(user.role, user.transaction_id, user.subscription_id)
+
+
+def record_user_change(before, after):
+    # `before`/`after` are user_counter_state() snapshots, None when the user doesn't exist on that side
+    record_user_changes([(before, after)])
+
+
+def record_user_changes(changes):
+    # Sums many (before, after) pairs into a single counter update, for set-based writes
+    deltas = dict.fromkeys(COUNTER_COLUMNS, 0)
+    for before, after in changes:
+        before = before or {}
+        after = after or {}
+        for name in COUNTER_COLUMNS:
+            deltas[name] += after.get(name, 0) - before.get(name, 0)
+    apply_deltas(deltas)
+
+
+def apply_deltas(deltas):
+    # Runs in the caller's transaction so counters commit (or roll back) with the change itself
+    values = {name: getattr(DashboardStats, name) + delta for name, delta in deltas.items() if delta}
+    if values:
+        db.session.execute(update(DashboardStats).where(DashboardStats.id == STATS_ROW_ID).values(**values))
+
+
+def aggregate_counts():
+    # All counters from one scan of the user table
+    pending = (User.transaction_id.isnot(None)) & (User.role == 'user')
+    row = db.session.query(
+        func.count(User.id),
+        func.count(User.id).filter(User.role == 'premium'),
+        func.count(User.id).filter(pending),
+        func.count(User.id).filter(User.subscription_id.is_(None))
+    ).one()
+    return dict(zip(COUNTER_COLUMNS, row))
+
+
+def get_dashboard_counts(refresh=False):
+    stats = db.session.get(DashboardStats, STATS_ROW_ID)
+    if stats is None or refresh:
+        counts = aggregate_counts()
+        if stats is None:
+            stats = DashboardStats(id=STATS_ROW_ID, **counts)
+            db.session.add(stats)
+        else:
+            for name, value in counts.items():
+                setattr(stats, name, value)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker seeded the row first, use theirs
+            db.session.rollback()
+            stats = db.session.get(DashboardStats, STATS_ROW_ID)
+    return {name: getattr(stats, name) for name in COUNTER_COLUMNS}
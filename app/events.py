@@ -0,0 +1,135 @@
+import json
+import queue
+import select
+import threading
+import time
+
+from sqlalchemy import func
+from sqlalchemy import select as sql_select
+
+from . import db
+
+# Postgres NOTIFY payloads are capped at 8000 bytes
+PG_CHANNEL = 'notification_events'
+PG_PAYLOAD_LIMIT = 7900
+SUBSCRIBER_QUEUE_SIZE = 100
+LISTENER_RETRY_SECONDS = 5
+
+
+class InProcessBus:
+    # Pub/sub between request handlers of a single worker process
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # queue -> (user_id, subscription_id)
+
+    def subscribe(self, user_id, subscription_id):
+        events = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[events] = (user_id, subscription_id)
+        return events
+
+    def unsubscribe(self, events):
+        with self._lock:
+            self._subscribers.pop(events, None)
+
+    def publish(self, event):
+        self.dispatch(event)
+
+    def dispatch(self, event):
+        with self._lock:
+            targets = [
+                events for events, (user_id, subscription_id) in self._subscribers.items()
+                if event.get('user_id') == user_id
+                or (event.get('subscription_id') is not None and event.get('subscription_id') == subscription_id)
+            ]
+        for events in targets:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                # Slow consumer; it will catch up from the inbox endpoint
+                pass
+
+
+class PostgresBus(InProcessBus):
+    # Events go through LISTEN/NOTIFY so every gunicorn worker sees them
+
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+        self._listener = None
+        self._listener_lock = threading.Lock()
+
+    def subscribe(self, user_id, subscription_id):
+        self._ensure_listener()
+        return super().subscribe(user_id, subscription_id)
+
+    def publish(self, event):
+        payload = json.dumps(event)
+        if len(payload.encode()) > PG_PAYLOAD_LIMIT:
+            payload = json.dumps(dict(event, message=None, truncated=True))
+        db.session.execute(sql_select(func.pg_notify(PG_CHANNEL, payload)))
+        db.session.commit()
+
+    def _ensure_listener(self):
+        # Started on first use so it never runs in a pre-fork master process
+        with self._listener_lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='notification-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        # Reconnects after errors so connected clients keep receiving events
+        while True:
+            try:
+                self._listen_once()
+            except Exception as e:
+                self.app.logger.error(f"Notification listener error, reconnecting: {e}")
+                time.sleep(LISTENER_RETRY_SECONDS)
+
+    def _listen_once(self):
+        with self.app.app_context():
+            connection = db.engine.raw_connection()
+        try:
+            dbapi_connection = connection.dbapi_connection
+            dbapi_connection.set_session(autocommit=True)
+            dbapi_connection.cursor().execute(f'LISTEN {PG_CHANNEL}')
+            while True:
+                if select.select([dbapi_connection], [], [], 30) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notify = dbapi_connection.notifies.pop(0)
+                    self.dispatch(json.loads(notify.payload))
+        finally:
+            connection.invalidate()
+
+
+def init_app(app):
+    if app.config['NOTIFICATION_BUS'] == 'postgres':
+        app.extensions['notification_bus'] = PostgresBus(app)
+    else:
+        app.extensions['notification_bus'] = InProcessBus()
+
+
+def get_bus(app):
+    return app.extensions['notification_bus']
+
+
+def format_sse(event, event_type='notification'):
+    return f"event: {event_type}\ndata: {json.dumps(event)}\n\n"
+
+
+def publish_notification(app, subscription, message, kind, broadcast_id=None):
+    # Called after the notification is committed; push failures never fail the send
+    event = {
+        'kind': kind,
+        'id': broadcast_id,
+        'subscription_id': subscription.id,
+        'subscription': subscription.title,
+        'message': message
+    }
+    try:
+        get_bus(app).publish(event)
+    except Exception as e:
+        app.logger.error(f"Failed to publish notification event: {e}")
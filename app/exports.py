@@ -0,0 +1,101 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+
+from sqlalchemy import case, select
+
+from . import db
+from .models import Notification, Subscription, User
+from .replicas import use_replica
+from .utils import apply_user_filters, days_left, subscription_expiry
+
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+YIELD_PER = 1000  # Rows fetched per round trip from the server-side cursor, and written per chunk
+
+
+def users_export(status='all', subscription_name=None, start_date=None, end_date=None):
+    # Expiry only means something for subscribers, like in /users
+    subscribed = User.subscription_id.isnot(None)
+    expires_at = case((subscribed, subscription_expiry(User.subscription_timestamp)))
+    query = select(
+        User.id,
+        User.fname,
+        User.lastname,
+        User.email,
+        User.mobile_number,
+        User.city,
+        User.state,
+        User.role,
+        Subscription.title.label('subscription'),
+        User.subscription_timestamp,
+        expires_at.label('expires_at'),
+        case((subscribed, days_left(expires_at))).label('days_left')
+    ).outerjoin(Subscription, User.subscription_id == Subscription.id)
+    return apply_user_filters(query, status, subscription_name, start_date, end_date).order_by(User.id)
+
+
+def pending_transactions_export():
+    return select(
+        User.id,
+        User.email,
+        User.fname,
+        User.lastname,
+        User.mobile_number,
+        User.transaction_id,
+        Subscription.title.label('subscription'),
+        User.subscription_timestamp
+    ).outerjoin(Subscription, User.subscription_id == Subscription.id).where(
+        User.transaction_id.isnot(None), User.role == 'user'
+    ).order_by(User.id)
+
+
+def notifications_export(user_id=None):
+    query = select(
+        Notification.id,
+        Notification.user_id,
+        User.email,
+        Subscription.title.label('subscription'),
+        Notification.notification_type,
+        Notification.message,
+        Notification.is_read,
+        Notification.created_at
+    ).join(User, Notification.user_id == User.id).outerjoin(
+        Subscription, Notification.subscription_id == Subscription.id
+    )
+    if user_id is not None:
+        query = query.where(Notification.user_id == user_id)
+    return query.order_by(Notification.id)
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def stream_export(query, fmt):
+    # Rows come off a server-side cursor YIELD_PER at a time and leave as one chunk each,
+    # so memory stays flat however large the table is. Exports are read-only and go to the replica.
+    with use_replica():
+        result = db.session.execute(query, execution_options={'yield_per': YIELD_PER})
+        columns = list(result.keys())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if fmt == 'csv':
+            writer.writerow(columns)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+        for partition in result.partitions():
+            for row in partition:
+                if fmt == 'csv':
+                    writer.writerow([_plain(value) for value in row])
+                else:
+                    buffer.write(json.dumps({column: _plain(value) for column, value in zip(columns, row)}))
+                    buffer.write('\n')
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        result.close()
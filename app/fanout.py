@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import insert, literal, select
+
+from . import db
+from .events import publish_notification
+from .models import Notification, NotificationJob, Subscription, User
+
+# Fan-out jobs are I/O bound on the database, a couple of threads per worker is plenty
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='fanout')
+
+
+def _insert_notifications(subscription_id, notification_type, message, *conditions):
+    # INSERT ... SELECT straight from the user table, no user rows travel to Python
+    audience = select(
+        User.id,
+        literal(subscription_id),
+        literal(notification_type),
+        literal(message)
+    ).where(User.subscription_id == subscription_id, *conditions)
+    result = db.session.execute(
+        insert(Notification).from_select(
+            ['user_id', 'subscription_id', 'notification_type', 'message'], audience
+        )
+    )
+    return result.rowcount
+
+
+def fan_out(subscription, message):
+    # Synchronous fan-out for small audiences; the caller commits
+    return _insert_notifications(subscription.id, subscription.title, message)
+
+
+def start_fan_out_job(subscription, message, total):
+    # Returns the job id, read at the flush so the commit doesn't force a reload
+    job = NotificationJob(subscription_id=subscription.id, message=message, total=total)
+    db.session.add(job)
+    db.session.flush()
+    job_id = job.id
+    db.session.commit()
+
+    _executor.submit(_run_job, current_app._get_current_object(), job_id)
+    return job_id
+
+
+def _chunk_upper_bound(subscription_id, after, chunk_size):
+    # Highest user id of the next chunk, found from the index without loading the chunk
+    query = select(User.id).where(User.subscription_id == subscription_id)
+    if after is not None:
+        query = query.where(User.id > after)
+    upper = db.session.execute(query.order_by(User.id).offset(chunk_size - 1).limit(1)).scalar()
+    if upper is None:
+        # Last (partial) chunk
+        upper = db.session.execute(
+            select(User.id).where(User.subscription_id == subscription_id).order_by(User.id.desc()).limit(1)
+        ).scalar()
+    return upper
+
+
+def _run_job(app, job_id):
+    with app.app_context():
+        chunk_size = app.config['FANOUT_CHUNK_SIZE']
+        job = db.session.get(NotificationJob, job_id)
+        subscription = db.session.get(Subscription, job.subscription_id)
+        try:
+            job.status = 'running'
+            db.session.commit()
+
+            # Walk the audience in id ranges, committing each chunk so progress is visible to pollers
+            after = None
+            while True:
+                upper = _chunk_upper_bound(subscription.id, after, chunk_size)
+                if upper is None or (after is not None and upper <= after):
+                    break
+                conditions = [User.id <= upper]
+                if after is not None:
+                    conditions.append(User.id > after)
+                job.processed += _insert_notifications(subscription.id, subscription.title, job.message, *conditions)
+                db.session.commit()
+                after = upper
+
+            job.status = 'done'
+            publish_notification(app, subscription, job.message, 'direct')
+        except Exception as e:
+            db.session.rollback()
+            job.status = 'failed'
+            job.error = str(e)
+            app.logger.error(f"Notification fan-out job {job_id} failed: {e}")
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        db.session.remove()
@@ -0,0 +1,200 @@
+import csv
+import io
+import json
+
+import click
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import db
+from .counters import apply_deltas
+from .models import User
+from .passwords import get_hasher
+
+FORMATS = ('csv', 'ndjson')
+REQUIRED_FIELDS = ('email', 'fname', 'lastname', 'mobile_number', 'password', 'city', 'state')
+# Column limits from the User model
+MAX_LENGTHS = {'email': 120, 'fname': 50, 'lastname': 50, 'mobile_number': 20, 'city': 100, 'state': 100,
+               'education': 100}
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def detect_format(requested=None, filename=None, content_type=None):
+    if requested:
+        fmt = requested.lower()
+    elif filename and filename.lower().endswith(('.ndjson', '.jsonl')):
+        fmt = 'ndjson'
+    elif filename and filename.lower().endswith('.csv'):
+        fmt = 'csv'
+    elif content_type and 'ndjson' in content_type:
+        fmt = 'ndjson'
+    else:
+        fmt = 'csv'
+    if fmt not in FORMATS:
+        raise ImportFormatError(f"Unsupported format '{fmt}', expected csv or ndjson")
+    return fmt
+
+
+def read_rows(stream, fmt):
+    # Yields (line number, row dict or None, error) without reading the whole file into memory
+    if not hasattr(stream, 'read1'):
+        stream = io.BufferedReader(stream)
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='' if fmt == 'csv' else None)
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, None, 'Invalid JSON'
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, 'Each line must be a JSON object'
+            continue
+        yield line_number, row, None
+
+
+def validate_row(row):
+    # Returns (clean values, error message); values are what register would store
+    clean = {}
+    for field in REQUIRED_FIELDS + ('education', 'age'):
+        value = row.get(field)
+        if isinstance(value, str):
+            value = value.strip()
+        clean[field] = value if value not in ('', None) else None
+
+    missing = [field for field in REQUIRED_FIELDS if clean[field] is None]
+    if missing:
+        return None, f"Missing {', '.join(missing)}"
+    for field, limit in MAX_LENGTHS.items():
+        if clean[field] is not None:
+            clean[field] = str(clean[field])
+            if len(clean[field]) > limit:
+                return None, f"{field} is longer than {limit} characters"
+    if '@' not in clean['email']:
+        return None, 'Invalid email'
+    if clean['age'] is not None:
+        try:
+            clean['age'] = int(clean['age'])
+        except (TypeError, ValueError):
+            return None, 'age must be a whole number'
+    clean['password'] = str(clean['password'])
+    return clean, None
+
+
+class ImportReport:
+    def __init__(self, max_errors):
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []
+        self.max_errors = max_errors
+
+    def add_error(self, line, message, email=None):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'email': email, 'message': message})
+
+    def as_dict(self):
+        return {'imported': self.imported, 'failed': self.error_count, 'errors': self.errors,
+                'errors_truncated': self.error_count > len(self.errors)}
+
+
+def flush_batch(batch, report, hash_method):
+    # Dedupes a batch against the table, hashes what's left in parallel and inserts it in one statement.
+    # Each batch commits on its own so a bad row or a failed batch never loses the rest of the file.
+    emails = [row['email'] for _, row in batch]
+    mobiles = [row['mobile_number'] for _, row in batch]
+    taken_emails = set(db.session.execute(select(User.email).where(User.email.in_(emails))).scalars())
+    taken_mobiles = set(db.session.execute(
+        select(User.mobile_number).where(User.mobile_number.in_(mobiles))
+    ).scalars())
+    # Hand the connection back while the batch is hashed
+    db.session.rollback()
+
+    pending = []
+    for line, row in batch:
+        if row['email'] in taken_emails:
+            report.add_error(line, 'Email already registered', row['email'])
+        elif row['mobile_number'] in taken_mobiles:
+            report.add_error(line, 'Mobile number already registered', row['email'])
+        else:
+            pending.append((line, row))
+    if not pending:
+        return
+
+    hashes = get_hasher().hash_many([row['password'] for _, row in pending], method=hash_method)
+    values = [dict(row, password=password_hash, role='user') for (_, row), password_hash in zip(pending, hashes)]
+    try:
+        # Accounts registered since the dedupe query are skipped by the unique constraints instead of failing the batch
+        inserted = set(db.session.execute(
+            insert(User).values(values).on_conflict_do_nothing().returning(User.email)
+        ).scalars())
+        apply_deltas({'total_users': len(inserted), 'total_non_subscribers': len(inserted)})
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.error(f"Student import batch failed: {e}")
+        for line, row in pending:
+            report.add_error(line, 'Database error, row not imported', row['email'])
+        return
+
+    report.imported += len(inserted)
+    for line, row in pending:
+        if row['email'] not in inserted:
+            report.add_error(line, 'Email or mobile number already registered', row['email'])
+
+
+def import_students(stream, fmt, app=None):
+    app = app or current_app._get_current_object()
+    batch_size = app.config['IMPORT_BATCH_SIZE']
+    hash_method = app.config['IMPORT_PASSWORD_HASH_METHOD']
+    report = ImportReport(app.config['IMPORT_MAX_REPORTED_ERRORS'])
+
+    # Duplicates inside the file are caught here, duplicates against the table per batch
+    seen_emails, seen_mobiles = set(), set()
+    batch = []
+    for line, raw, error in read_rows(stream, fmt):
+        row = None
+        if error is None:
+            row, error = validate_row(raw)
+        if error is None:
+            if row['email'] in seen_emails:
+                error = 'Duplicate email in file'
+            elif row['mobile_number'] in seen_mobiles:
+                error = 'Duplicate mobile number in file'
+        if error:
+            report.add_error(line, error, raw.get('email') if raw else None)
+            continue
+
+        seen_emails.add(row['email'])
+        seen_mobiles.add(row['mobile_number'])
+        batch.append((line, row))
+        if len(batch) >= batch_size:
+            flush_batch(batch, report, hash_method)
+            batch = []
+    if batch:
+        flush_batch(batch, report, hash_method)
+    return report
+
+
+@click.command('import-students')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None, help='Defaults to the file extension.')
+def import_students_command(path, fmt):
+    """Import students from a CSV or NDJSON file, for batches too large for one HTTP request."""
+    with open(path, 'rb') as stream:
+        report = import_students(stream, detect_format(fmt, filename=path))
+    click.echo(f"Imported {report.imported}, failed {report.error_count}")
+    for error in report.errors:
+        click.echo(f"  line {error['line']}: {error['message']}" + (f" ({error['email']})" if error['email'] else ''))
@@ -0,0 +1,230 @@
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+import click
+from flask import current_app
+from sqlalchemy import func, select, update
+
+from . import db
+from .models import OutboundEmail
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 6
+LEASE_SECONDS = 120  # A claimed email is retried by another worker if not finished in time
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+IDLE_POLL_SECONDS = 2
+CONNECTION_MAX_IDLE_SECONDS = 60
+
+_in_process_lock = threading.Lock()
+_in_process_started = False
+
+
+class MailNotConfigured(RuntimeError):
+    pass
+
+
+def sender_address(app):
+    return app.config['MAIL_SENDER'] or app.config['MAIL_USERNAME']
+
+
+def check_mail_settings(app):
+    # Raised before any worker starts, so a missing secret is reported once instead of per email
+    if not sender_address(app):
+        raise MailNotConfigured('Set MAIL_SENDER (or MAIL_USERNAME) to send email')
+    if app.config['MAIL_USERNAME'] and not app.config['MAIL_PASSWORD']:
+        raise MailNotConfigured('MAIL_USERNAME is set but MAIL_PASSWORD is not')
+
+
+def enqueue_email(recipient, subject, body):
+    # Queued in the caller's transaction; a worker sends it once committed
+    email = OutboundEmail(recipient=recipient, subject=subject, body=body)
+    db.session.add(email)
+    maybe_start_in_process_workers(current_app._get_current_object())
+    return email
+
+
+class SMTPConnection:
+    # One authenticated SMTP session reused across sends, reconnecting when it goes stale
+
+    def __init__(self, app):
+        self.app = app
+        self._server = None
+        self._last_used = 0
+
+    def _connect(self):
+        server = smtplib.SMTP(self.app.config['MAIL_SERVER'], self.app.config['MAIL_PORT'], timeout=30)
+        if self.app.config['MAIL_USE_TLS']:
+            server.starttls()
+        if self.app.config['MAIL_USERNAME']:
+            server.login(self.app.config['MAIL_USERNAME'], self.app.config['MAIL_PASSWORD'])
+        return server
+
+    def _ensure_connected(self):
+        if self._server is not None and time.monotonic() - self._last_used > CONNECTION_MAX_IDLE_SECONDS:
+            try:
+                self._server.noop()
+            except smtplib.SMTPException:
+                self.close()
+        if self._server is None:
+            self._server = self._connect()
+
+    def send(self, message):
+        self._ensure_connected()
+        try:
+            self._server.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped an idle session, retry once on a fresh one
+            self.close()
+            self._server = self._connect()
+            self._server.send_message(message)
+        self._last_used = time.monotonic()
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._server = None
+
+
+def build_message(app, email):
+    message = EmailMessage()
+    message['From'] = sender_address(app)
+    message['To'] = email.recipient
+    message['Subject'] = email.subject
+    message.set_content(email.body)
+    return message
+
+
+def claim_batch(batch_size=BATCH_SIZE):
+    # Lease due emails with SKIP LOCKED so concurrent workers never pick the same rows
+    now = datetime.utcnow()
+    due = select(OutboundEmail.id).where(
+        OutboundEmail.status == 'pending', OutboundEmail.next_attempt_at <= now
+    ).order_by(OutboundEmail.id).limit(batch_size).with_for_update(skip_locked=True).scalar_subquery()
+    claimed = db.session.execute(
+        update(OutboundEmail)
+        .where(OutboundEmail.id.in_(due))
+        .values(next_attempt_at=now + timedelta(seconds=LEASE_SECONDS), attempts=OutboundEmail.attempts + 1)
+        .returning(OutboundEmail.id, OutboundEmail.recipient, OutboundEmail.subject,
+                   OutboundEmail.body, OutboundEmail.attempts)
+    ).all()
+    db.session.commit()
+    return claimed
+
+
+def backoff_delay(attempts):
+    return min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+
+
+def process_batch(app, connection, batch_size=BATCH_SIZE):
+    # Sends one claimed batch and records the outcome; returns how many were claimed
+    batch = claim_batch(batch_size)
+    sent = []
+    for email in batch:
+        try:
+            connection.send(build_message(app, email))
+            sent.append(email.id)
+        except (smtplib.SMTPException, OSError) as e:
+            connection.close()
+            failed = email.attempts >= MAX_ATTEMPTS
+            db.session.execute(
+                update(OutboundEmail).where(OutboundEmail.id == email.id).values(
+                    status='failed' if failed else 'pending',
+                    next_attempt_at=datetime.utcnow() + timedelta(seconds=backoff_delay(email.attempts)),
+                    last_error=str(e)
+                )
+            )
+            app.logger.error(f"Failed to send email {email.id} (attempt {email.attempts}): {e}")
+    if sent:
+        db.session.execute(
+            update(OutboundEmail).where(OutboundEmail.id.in_(sent)).values(status='sent', sent_at=datetime.utcnow())
+        )
+    db.session.commit()
+    return len(batch)
+
+
+def run_worker(app, stop=None):
+    connection = SMTPConnection(app)
+    with app.app_context():
+        try:
+            while stop is None or not stop.is_set():
+                try:
+                    claimed = process_batch(app, connection)
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"Mail worker error: {e}")
+                    claimed = 0
+                if not claimed:
+                    connection.close()  # Don't hold an idle session against the SMTP server
+                    time.sleep(IDLE_POLL_SECONDS)
+        finally:
+            connection.close()
+            db.session.remove()
+
+
+def start_workers(app, count):
+    check_mail_settings(app)
+    stop = threading.Event()
+    threads = [threading.Thread(target=run_worker, args=(app, stop), name=f'mail-worker-{i}', daemon=True)
+               for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return stop, threads
+
+
+def maybe_start_in_process_workers(app):
+    # Single-node deployments can drain the queue from the web process instead of `flask mail-worker`
+    global _in_process_started
+    count = app.config['MAIL_IN_PROCESS_WORKERS']
+    if not count or _in_process_started:
+        return
+    with _in_process_lock:
+        if not _in_process_started:
+            _in_process_started = True
+            try:
+                start_workers(app, count)
+            except MailNotConfigured as e:
+                app.logger.error(f"Mail workers not started, emails stay queued: {e}")
+
+
+def queue_stats():
+    now = datetime.utcnow()
+    pending, failed, oldest = db.session.query(
+        func.count(OutboundEmail.id).filter(OutboundEmail.status == 'pending'),
+        func.count(OutboundEmail.id).filter(OutboundEmail.status == 'failed'),
+        func.min(OutboundEmail.created_at).filter(OutboundEmail.status == 'pending')
+    ).one()
+    latency = db.session.query(
+        func.avg(func.extract('epoch', OutboundEmail.sent_at - OutboundEmail.created_at))
+    ).filter(OutboundEmail.status == 'sent', OutboundEmail.sent_at >= now - timedelta(hours=1)).scalar()
+    return {
+        'queue_depth': pending,
+        'failed': failed,
+        'oldest_pending_seconds': (now - oldest).total_seconds() if oldest else 0,
+        'avg_latency_seconds_last_hour': float(latency) if latency is not None else None
+    }
+
+
+@click.command('mail-worker')
+@click.option('--threads', default=2, show_default=True, help='Concurrent SMTP connections.')
+def mail_worker_command(threads):
+    """Drain the outbound email queue."""
+    app = current_app._get_current_object()
+    try:
+        stop, workers = start_workers(app, threads)
+    except MailNotConfigured as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Mail worker running with {threads} thread(s)')
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop.set()
@@ -0,0 +1,99 @@
+import mimetypes
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+
+from flask import Response, current_app, request, send_file
+
+FileMetadata = namedtuple('FileMetadata', 'size mtime etag')
+
+
+class MetadataCache:
+    # Small LRU of file stats for the offload modes, where nothing else stat()s the file.
+    # Missing files are never cached, so a new upload is served as soon as it lands.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # path -> (expires_at, FileMetadata)
+
+    def get(self, path, ttl, max_size):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(path)
+                return entry[1]
+
+        metadata = self._stat(path)
+        with self._lock:
+            if metadata is None:
+                self._entries.pop(path, None)
+                return None
+            self._entries[path] = (now + ttl, metadata)
+            self._entries.move_to_end(path)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+        return metadata
+
+    def _stat(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return FileMetadata(stat.st_size, stat.st_mtime, f"{stat.st_size:x}-{int(stat.st_mtime):x}")
+
+    def invalidate(self, path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+
+metadata_cache = MetadataCache()
+
+
+def send_media(file_path, upload_folder, as_attachment=False, download_name=None):
+    # Returns None when the file is missing so the caller can answer 404 in its own format.
+    # Blobs have no extension, so the type and download name come from `download_name` when given.
+    file_path = os.path.abspath(file_path)
+    download_name = download_name or os.path.basename(file_path)
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+
+    mode = current_app.config['MEDIA_SENDFILE']
+    if mode is None:
+        # Werkzeug stats the file once, builds the validators from it and answers Range (206) and
+        # If-None-Match / If-Modified-Since (304) itself; a cached stat would only add staleness
+        try:
+            response = send_file(file_path, mimetype=mimetype, as_attachment=as_attachment,
+                                 download_name=download_name, conditional=True,
+                                 max_age=current_app.config['MEDIA_MAX_AGE'])
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+        # Subscriber-only content, shared caches must not keep it
+        response.cache_control.public = False
+        response.cache_control.private = True
+        return response
+
+    # Offloaded: validators are checked here, the web server streams the bytes and handles Range
+    metadata = metadata_cache.get(file_path, current_app.config['MEDIA_METADATA_TTL'],
+                                  current_app.config['MEDIA_METADATA_CACHE_SIZE'])
+    if metadata is None:
+        return None
+    response = Response(mimetype=mimetype)
+    response.set_etag(metadata.etag)
+    response.last_modified = datetime.fromtimestamp(metadata.mtime, tz=timezone.utc)
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config['MEDIA_MAX_AGE']
+    disposition = 'attachment' if as_attachment else 'inline'
+    response.headers['Content-Disposition'] = f'{disposition}; filename="{download_name}"'
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.make_conditional(request)
+    if response.status_code == 304:
+        return response
+
+    if mode == 'x-accel':
+        relative = os.path.relpath(file_path, os.path.abspath(upload_folder))
+        response.headers['X-Accel-Redirect'] = current_app.config['MEDIA_ACCEL_PREFIX'].rstrip('/') + '/' + relative
+    else:
+        response.headers['X-Sendfile'] = file_path
+    return response
@@ -0,0 +1,197 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from flask import Response, current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import db
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+# Per-request SQL tally; None outside instrumented requests so background threads pay nothing
+_current = ContextVar('request_sql_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('endpoint', 'queries', 'db_seconds', 'statements')
+
+    def __init__(self, endpoint=None):
+        self.endpoint = endpoint
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements = None  # Set to a list to capture statement text (see budgets.py)
+
+
+class Histogram:
+    # Cumulative-bucket histogram keyed by a label tuple, rendered in Prometheus text format
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {series[-1]}')
+            lines.append(f'{self.name}_count{{{label_text}}} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = dict(self._values)
+        for labels, value in sorted(snapshot.items()):
+            label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            lines.append(f'{self.name}{{{label_text}}} {value}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Time to build the response, per endpoint.',
+                            ('endpoint', 'method', 'status'), LATENCY_BUCKETS)
+REQUEST_QUERIES = Histogram('http_request_sql_queries', 'SQL statements issued per request.',
+                            ('endpoint',), QUERY_COUNT_BUCKETS)
+REQUEST_DB_TIME = Histogram('http_request_db_seconds', 'Time spent in SQL per request.',
+                            ('endpoint',), LATENCY_BUCKETS)
+SLOW_QUERIES = Counter('sql_slow_queries_total', 'Statements slower than METRICS_SLOW_QUERY_MS.', ('endpoint',))
+
+
+def current_request_stats():
+    return _current.get()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is None:
+        return
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    stats.queries += 1
+    stats.db_seconds += elapsed
+    if stats.statements is not None:
+        stats.statements.append(statement)
+
+    threshold = current_app.config['METRICS_SLOW_QUERY_MS']
+    if threshold is not None and elapsed * 1000 >= threshold:
+        endpoint = stats.endpoint or 'unknown'
+        SLOW_QUERIES.inc((endpoint,))
+        limit = current_app.config['METRICS_SLOW_QUERY_LOG_CHARS']
+        current_app.logger.warning(f"Slow query ({elapsed * 1000:.0f} ms) in {endpoint}: {statement[:limit]}")
+
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_token = _current.set(RequestStats(request.endpoint))
+
+
+def _record(status):
+    stats = _current.get()
+    if stats is None or g.get('metrics_recorded'):
+        return
+    g.metrics_recorded = True
+    endpoint = request.endpoint or 'unknown'
+    REQUEST_LATENCY.observe((endpoint, request.method, str(status)), time.perf_counter() - g.metrics_started)
+    REQUEST_QUERIES.observe((endpoint,), stats.queries)
+    REQUEST_DB_TIME.observe((endpoint,), stats.db_seconds)
+
+
+def _after_request(response):
+    # Streaming responses (SSE, exports) are timed to their first byte
+    _record(response.status_code)
+    return response
+
+
+def _teardown_request(error=None):
+    if error is not None:
+        _record(500)
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        _current.reset(token)
+
+
+def init_blueprint(blueprint):
+    # Hooks on the blueprint so only API routes are measured; /metrics itself is skipped
+    def before():
+        if current_app.config['METRICS_ENABLED'] and request.endpoint != f'{blueprint.name}.metrics':
+            _start_request()
+
+    blueprint.before_request(before)
+    blueprint.after_request(_after_request)
+    blueprint.teardown_request(_teardown_request)
+
+
+def render_metrics(app):
+    lines = []
+    for metric in (REQUEST_LATENCY, REQUEST_QUERIES, REQUEST_DB_TIME, SLOW_QUERIES):
+        lines.extend(metric.render())
+
+    lines += ['# HELP db_pool_checked_out Connections currently checked out of the pool.',
+              '# TYPE db_pool_checked_out gauge']
+    for bind, engine in sorted(db.engines.items(), key=lambda item: str(item[0])):
+        checked_out = engine.pool.checkedout() if hasattr(engine.pool, 'checkedout') else 0
+        lines.append(f'db_pool_checked_out{{bind="{bind or "primary"}"}} {checked_out}')
+
+    hasher = app.extensions.get('password_hasher')
+    if hasher is not None:
+        lines += ['# HELP password_hash_queue_seconds Time hashing jobs waited for a pool worker.',
+                  '# TYPE password_hash_queue_seconds summary',
+                  f"password_hash_queue_seconds_sum {hasher.stats['queue_seconds_total']}",
+                  f"password_hash_queue_seconds_count {hasher.stats['calls']}",
+                  '# HELP password_hash_queue_seconds_max Longest wait for a hashing worker.',
+                  '# TYPE password_hash_queue_seconds_max gauge',
+                  f"password_hash_queue_seconds_max {hasher.stats['queue_seconds_max']}"]
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_response():
+    # Per process: with several gunicorn workers each one reports its own series
+    return Response(render_metrics(current_app._get_current_object()), mimetype='text/plain; version=0.0.4')
@@ -18,13 +18,25 @@ class User(db.Model):
     education = db.Column(db.String(100), nullable=True)
     city = db.Column(db.String(100))
     state = db.Column(db.String(100))
-    subscription_id = db.Column(db.Integer, db.ForeignKey('subscription.id'))  # Foreign key to Subscription
+    subscription_id = db.Column(db.Integer, db.ForeignKey('subscription.id'), index=True)  # Foreign key to Subscription
     transaction_id = db.Column(db.String(100))
     reset_token = db.Column(db.String(20), nullable=True)
     subscription_timestamp = db.Column(db.DateTime, default=datetime.utcnow)  # Timestamp for subscription
+    broadcast_read_id = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Read watermark: highest Broadcast id seen
+    # Moves on every ORM or Core UPDATE of the row; the profile ETag is derived from it
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow,
+                           server_default=db.text("timezone('utc', now())"))
     notifications = db.relationship('Notification', backref='user', lazy=True)
     subscription = db.relationship('Subscription', back_populates='users')  # Link to Subscription
 
+    __table_args__ = (
+        # Admin dashboard pending-approval list, paged by id
+        db.Index('ix_user_pending_approval', 'id',
+                 postgresql_where=db.text("transaction_id IS NOT NULL AND role = 'user'")),
+        # Reset-password lookups; only the few users mid-reset have a token
+        db.Index('ix_user_reset_token', 'reset_token', postgresql_where=db.text('reset_token IS NOT NULL')),
+    )
+
 class Subscription(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     heading = db.Column(db.String(100), nullable=True)  # New field
@@ -38,22 +50,35 @@ class Subscription(db.Model):
     pdfs = db.relationship('PDF', backref='subscription', lazy=True, cascade="all, delete-orphan")
     videos = db.relationship('Video', backref='subscription', lazy=True, cascade="all, delete-orphan")
     notifications = db.relationship('Notification', backref='subscription', lazy=True, cascade="all, delete-orphan")
+    broadcasts = db.relationship('Broadcast', backref='subscription', lazy=True, cascade="all, delete-orphan")
     course_links = db.relationship('CourseLink', back_populates='subscription', cascade="all, delete-orphan")
 
+    __table_args__ = (
+        db.UniqueConstraint('title', name='uq_subscription_title'),  # Routes look plans up by title
+    )
+
 class PDF(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     pdf_type = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(255), nullable=False)
     subscription_id = db.Column(db.Integer, db.ForeignKey('subscription.id'))
+    blob_hash = db.Column(db.String(64), nullable=True, index=True)  # Content-addressed blob, None for legacy files
+    filename = db.Column(db.String(255), nullable=True)  # Original upload name, used for downloads
+
+    __table_args__ = (
+        db.Index('ix_pdf_subscription_id_pdf_type', 'subscription_id', 'pdf_type'),
+    )
 
 class Video(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     file_path = db.Column(db.String(255), nullable=False)
-    subscription_id = db.Column(db.Integer, db.ForeignKey('subscription.id'))
+    subscription_id = db.Column(db.Integer, db.ForeignKey('subscription.id'), index=True)
+    blob_hash = db.Column(db.String(64), nullable=True, index=True)
+    filename = db.Column(db.String(255), nullable=True)
 
 class CourseLink(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    subscription_id = db.Column(db.Integer, db.ForeignKey('subscription.id'), nullable=False)
+    subscription_id = db.Column(db.Integer, db.ForeignKey('subscription.id'), nullable=False, index=True)
     name = db.Column(db.String(255), nullable=False)  # Display name for the link
     url = db.Column(db.String(255), nullable=False)   # The actual URL of the link
     subscription = db.relationship('Subscription', back_populates='course_links')
@@ -62,7 +87,97 @@ class CourseLink(db.Model):
 class Notification(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    subscription_id = db.Column(db.Integer, db.ForeignKey('subscription.id'), nullable=True)  # Foreign key to Subscription
+    subscription_id = db.Column(db.Integer, db.ForeignKey('subscription.id'), nullable=True, index=True)  # Foreign key to Subscription
     notification_type = db.Column(db.String(100), nullable=False)  # Usually the Subscription name or other types
     message = db.Column(db.Text, nullable=False)  # Message content
     is_read = db.Column(db.Boolean, default=False)  # Whether the user has read the notification
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                           server_default=db.text("timezone('utc', now())"))
+
+    __table_args__ = (
+        db.Index('ix_notification_unread', 'user_id', postgresql_where=db.text('is_read = false')),  # unread counts
+        db.Index('ix_notification_user_id_created_at', 'user_id', 'created_at', 'id'),  # inbox pages, any user_id lookup
+    )
+
+
+class Broadcast(db.Model):
+    # A message stored once for every subscriber of a plan (fan-out on read)
+    id = db.Column(db.Integer, primary_key=True)
+    subscription_id = db.Column(db.Integer, db.ForeignKey('subscription.id'), nullable=False)
+    notification_type = db.Column(db.String(100), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                           server_default=db.text("timezone('utc', now())"))
+
+    __table_args__ = (
+        db.Index('ix_broadcast_subscription_id_created_at', 'subscription_id', 'created_at', 'id'),
+    )
+
+
+class DashboardStats(db.Model):
+    # Single-row counter cache for the admin dashboard, kept current by app/counters.py
+    id = db.Column(db.Integer, primary_key=True)
+    total_users = db.Column(db.Integer, nullable=False, default=0)
+    total_premium_users = db.Column(db.Integer, nullable=False, default=0)
+    pending_requests = db.Column(db.Integer, nullable=False, default=0)
+    total_non_subscribers = db.Column(db.Integer, nullable=False, default=0)
+
+
+class NotificationJob(db.Model):
+    # Background fan-out of a notification to a large audience, polled by the admin UI
+    id = db.Column(db.Integer, primary_key=True)
+    subscription_id = db.Column(db.Integer, db.ForeignKey('subscription.id', ondelete='CASCADE'), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    total = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+class OutboundEmail(db.Model):
+    # Mail queue drained by the workers in app/mailer.py
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_outbound_email_pending', 'next_attempt_at', postgresql_where=db.text("status = 'pending'")),
+    )
+
+
+class CacheVersion(db.Model):
+    # Bumped on every write to a cached dataset so all workers notice and reload
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class UploadSession(db.Model):
+    # Resumable chunked upload; the PDF/Video row is only created when it is completed
+    id = db.Column(db.String(36), primary_key=True)
+    subscription_id = db.Column(db.Integer, db.ForeignKey('subscription.id', ondelete='CASCADE'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    file_type = db.Column(db.String(255), nullable=True)  # pdf_type for documents
+    status = db.Column(db.String(20), nullable=False, default='open')  # open, complete, aborted, expired
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class Blob(db.Model):
+    # Uploaded content stored once under its sha256, shared by every PDF/Video row pointing at it
+    hash = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    released_at = db.Column(db.DateTime, nullable=True)  # Reserved or last lost a reference; starts the GC grace period
+
+    __table_args__ = (
+        db.Index('ix_blob_unreferenced', 'released_at', postgresql_where=db.text('ref_count <= 0')),
+    )
@@ -1,15 +1,167 @@
-from twilio.rest import Client
-import os
+import asyncio
+import atexit
+import threading
+import time
 
-def send_whatsapp_notification(user_email, transaction_id):
-    account_sid = os.getenv('TWILIO_ACCOUNT_SID')
-    auth_token = os.getenv('TWILIO_AUTH_TOKEN')
-    client = Client(account_sid, auth_token)
+import aiohttp
+from flask import current_app
+
+WHATSAPP_MAX_BODY = 1600
+MAX_SEND_ATTEMPTS = 3
+
+
+class TokenBucket:
+    # Allows `rate` sends per second on average with bursts of up to `capacity`
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def build_digest(bodies):
+    if len(bodies) == 1:
+        return bodies[0]
+    digest = f"{len(bodies)} updates:\n" + "\n".join(f"- {body}" for body in bodies)
+    if len(digest) > WHATSAPP_MAX_BODY:
+        digest = digest[:WHATSAPP_MAX_BODY - 3] + '...'
+    return digest
+
+
+class WhatsAppDispatcher:
+    # Sends WhatsApp messages from a background event loop over one shared HTTP session
+
+    def __init__(self, app):
+        self.app = app
+        self.sent = 0
+        self.failed = 0
+        self._loop = None
+        self._queue = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def submit(self, body, to=None, digest=True):
+        # Thread-safe and non-blocking; digest=False bypasses coalescing
+        self._ensure_started()
+        item = (to or self.app.config['WHATSAPP_ADMIN_TO'], body, digest)
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+
+    def close(self, timeout=10):
+        # Flushes pending digests and waits for in-flight sends; a no-op once the loop has exited
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+        self._thread.join(timeout)
+
+    def _ensure_started(self):
+        # Started lazily so the loop never runs in a pre-fork master process
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run_loop, name='whatsapp-dispatcher', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+        self._ready.wait()
 
-    message = client.messages.create(
-        body=f"User {user_email} updated transaction ID: {transaction_id}",
-        from_='whatsapp:+14155238886',  # Twilio sandbox number
-        to='whatsapp:+1234567890'  # Admin's number
-    )
-    return message.sid
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue()
+        self._ready.set()
+        self._loop.run_until_complete(self._run())
+        self._loop.close()
 
+    async def _run(self):
+        bucket = TokenBucket(self.app.config['WHATSAPP_RATE_PER_SECOND'],
+                             self.app.config['WHATSAPP_BURST'])
+        semaphore = asyncio.Semaphore(self.app.config['WHATSAPP_CONCURRENCY'])
+        window = self.app.config['WHATSAPP_DIGEST_SECONDS']
+        auth = aiohttp.BasicAuth(self.app.config['TWILIO_ACCOUNT_SID'] or '',
+                                 self.app.config['TWILIO_AUTH_TOKEN'] or '')
+        tasks = set()
+        pending = {}  # recipient -> bodies waiting for the digest window to close
+        deadline = None
+
+        async with aiohttp.ClientSession(auth=auth, timeout=aiohttp.ClientTimeout(total=30)) as session:
+            def spawn(to, body):
+                task = asyncio.create_task(self._send(session, bucket, semaphore, to, body))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            def flush():
+                for to, bodies in pending.items():
+                    spawn(to, build_digest(bodies))
+                pending.clear()
+
+            while True:
+                timeout = None if deadline is None else max(0, deadline - self._loop.time())
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    flush()
+                    deadline = None
+                    continue
+
+                if item is None:
+                    break
+                to, body, digest = item
+                if not digest or not window:
+                    spawn(to, body)
+                    continue
+                pending.setdefault(to, []).append(body)
+                if deadline is None:
+                    deadline = self._loop.time() + window
+
+            flush()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _send(self, session, bucket, semaphore, to, body):
+        account_sid = self.app.config['TWILIO_ACCOUNT_SID']
+        url = f"{self.app.config['TWILIO_API_BASE']}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        data = {'From': self.app.config['WHATSAPP_FROM'], 'To': to, 'Body': body}
+
+        async with semaphore:
+            for attempt in range(1, MAX_SEND_ATTEMPTS + 1):
+                await bucket.acquire()
+                try:
+                    async with session.post(url, data=data) as response:
+                        if response.status < 300:
+                            self.sent += 1
+                            return (await response.json()).get('sid')
+                        retryable = response.status == 429 or response.status >= 500
+                        error = f"HTTP {response.status}: {await response.text()}"
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    retryable = True
+                    error = str(e)
+                if not retryable or attempt == MAX_SEND_ATTEMPTS:
+                    break
+                await asyncio.sleep(2 ** attempt)
+
+        self.failed += 1
+        self.app.logger.error(f"WhatsApp message to {to} failed: {error}")
+
+
+def get_dispatcher(app):
+    return app.extensions.setdefault('whatsapp', WhatsAppDispatcher(app))
+
+
+def send_whatsapp_notification(user_email, transaction_id):
+    # Queues an admin alert and returns immediately; alerts are coalesced into digests
+    app = current_app._get_current_object()
+    if not app.config['WHATSAPP_ENABLED']:
+        return
+    get_dispatcher(app).submit(f"User {user_email} updated transaction ID: {transaction_id}")
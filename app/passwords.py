@@ -0,0 +1,119 @@
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+SLOW_QUEUE_SECONDS = 0.5
+HASH_MANY_CHUNK = 16
+
+
+def _timed_hash(password, method, submitted_at):
+    # Returns (hash, seconds spent waiting for this worker), measured before the hash starts
+    started = time.time()
+    return generate_password_hash(password, method=method), started - submitted_at
+
+
+def _hash_chunk(passwords, method):
+    return [generate_password_hash(password, method=method) for password in passwords]
+
+
+def _timed_check(stored_hash, password, submitted_at):
+    started = time.time()
+    return check_password_hash(stored_hash, password), started - submitted_at
+
+
+class PasswordHasher:
+    # Runs pbkdf2/scrypt in a bounded process pool so request threads wait without holding the GIL
+
+    def __init__(self, method, workers, max_pending):
+        self.method = method
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._canonical_method = None
+        self._stats_lock = threading.Lock()
+        self.stats = {'calls': 0, 'queue_seconds_total': 0.0, 'queue_seconds_max': 0.0}
+
+    def _get_pool(self):
+        # Created on first use in each worker process; spawn avoids forking a threaded server
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args, time.time())[0]
+        with self._slots:
+            result, queued = self._get_pool().submit(fn, *args, time.time()).result()
+        with self._stats_lock:
+            self.stats['calls'] += 1
+            self.stats['queue_seconds_total'] += queued
+            self.stats['queue_seconds_max'] = max(self.stats['queue_seconds_max'], queued)
+        if queued > SLOW_QUEUE_SECONDS:
+            current_app.logger.warning(f"Password hash waited {queued:.2f}s for a free worker")
+        return result
+
+    def hash(self, password):
+        return self._run(_timed_hash, password, self.method)
+
+    def hash_many(self, passwords, method=None):
+        # Bulk hashing spread over every worker; `method` overrides the configured one (e.g. for imports)
+        method = method or self.method
+        if not self.workers:
+            return _hash_chunk(passwords, method)
+        # At most one chunk per worker is queued at a time, so a login never waits behind the whole batch
+        pool = self._get_pool()
+        hashes, in_flight = [], deque()
+        for start in range(0, len(passwords), HASH_MANY_CHUNK):
+            if len(in_flight) >= self.workers:
+                hashes.extend(in_flight.popleft().result())
+            in_flight.append(self._submit_chunk(pool, passwords[start:start + HASH_MANY_CHUNK], method))
+        while in_flight:
+            hashes.extend(in_flight.popleft().result())
+        return hashes
+
+    def _submit_chunk(self, pool, passwords, method):
+        # A queued chunk holds a slot like a single hash does, so imports count against PASSWORD_HASH_MAX_PENDING
+        self._slots.acquire()
+        try:
+            future = pool.submit(_hash_chunk, passwords, method)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def verify(self, stored_hash, password):
+        return self._run(_timed_check, stored_hash, password)
+
+    def needs_rehash(self, stored_hash):
+        # Compares the stored method prefix with what the configured method produces,
+        # e.g. 'pbkdf2:sha256' is stored as 'pbkdf2:sha256:600000'
+        if self._canonical_method is None:
+            self._canonical_method = generate_password_hash('', method=self.method).split('$', 1)[0]
+        return stored_hash.split('$', 1)[0] != self._canonical_method
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+def init_app(app):
+    app.extensions['password_hasher'] = PasswordHasher(
+        app.config['PASSWORD_HASH_METHOD'],
+        app.config['PASSWORD_HASH_WORKERS'],
+        app.config['PASSWORD_HASH_MAX_PENDING']
+    )
+
+
+def get_hasher(app=None):
+    return (app or current_app).extensions['password_hasher']
@@ -0,0 +1,39 @@
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND = 'replica'
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+class RoutingSession(Session):
+    # Sends statements to the replica engine inside `use_replica()`; flushes, and everything
+    # outside the block, go to the primary. Without a configured replica this is a plain Session.
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _use_replica.get() and not self._flushing:
+            engines = self._db.engines
+            if REPLICA_BIND in engines:
+                return engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@contextmanager
+def use_replica():
+    # Results may lag the primary by the replication delay, so only wrap reads that can tolerate it
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def replica_reads(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with use_replica():
+            return view(*args, **kwargs)
+    return wrapper
@@ -1,38 +1,71 @@
-from flask import Blueprint, request, jsonify
-from .models import Notification, db, User, PDF, Video, Subscription,CourseLink
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context, url_for
+from .models import CacheVersion, NotificationJob, UploadSession, db, User, PDF, Video, Subscription,CourseLink
 from .notifications import send_whatsapp_notification
 import os
+import queue
+import time
 from werkzeug.utils import secure_filename
-from werkzeug.security import check_password_hash
-from werkzeug.security import generate_password_hash
+from sqlalchemy import func
 from sqlalchemy.orm import joinedload
+from .bulk import (BulkInputError, add_course_links, approve_transactions, delete_course_links,
+                   require_list, revoke_subscriptions, summarize)
+from .broadcasts import (fanout_mode, inbox_page, mark_broadcasts_read, mark_notifications_read, parse_inbox_cursor,
+                         publish_broadcast, start_watermark, unread_count)
+from .events import format_sse, get_bus, publish_notification
+from .blobstore import commit_blob, release_subscription_blobs, store_stream
+from .blobstore import temp_path as blob_temp_path
+from .storage import get_storage, parts_folder, spool_folder
+from .uploads import (VIDEO_EXTENSIONS, PartTooLarge, assemble, create_media_row, discard_parts, file_extension,
+                      list_parts, start_upload, write_part)
+from .exports import FORMATS as EXPORT_FORMATS
+from .exports import notifications_export, pending_transactions_export, stream_export, users_export
+from .imports import ImportFormatError, detect_format, import_students
+from .mailer import enqueue_email, queue_stats
+from .budgets import init_blueprint as init_budgets
+from .budgets import query_budget
+from .metrics import init_blueprint as init_metrics
+from .metrics import metrics_response
+from .passwords import get_hasher
+from .serialization import stream_json_array
+from .replicas import replica_reads
+from .fanout import fan_out, start_fan_out_job
+from .compression import precompressed_response
+from .catalog import CATALOG_CACHE_NAME, catalog, invalidate_catalog
+from .conditional import COURSE_LINKS_CACHE_NAME, bump_cache_version, cache_version, conditional_response, make_etag
+from .counters import apply_deltas, get_dashboard_counts, record_user_change, user_counter_state
+from .utils import apply_user_filters, days_left, keyset_page, parse_date_arg, parse_page_args, subscription_expiry
 
 
 from twilio.rest import Client
 
 
-from flask import send_file
-
 main = Blueprint('main', __name__)
 
-# Define base directory (path to the 'backend' folder)
-BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))  # Gets you to the backend directory
-UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')  # Now points to backend/uploads
+# Latency, SQL count and DB time per endpoint, exported at /metrics
+init_metrics(main)
+# SQL statement budgets declared with @query_budget, checked per QUERY_BUDGET_MODE
+init_budgets(main)
 
-# Ensure that the uploads directory exists
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
 # Allowable file types
 ALLOWED_EXTENSIONS = {'pdf', 'mp4', 'avi', 'mov'}
 
+# Comment sent on idle notification streams so proxies don't drop the connection
+STREAM_KEEPALIVE_SECONDS = 15
+
+@main.route('/metrics', methods=['GET'])
+def metrics():
+    return metrics_response()
+
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
 @main.route('/register', methods=['POST'])
+@query_budget(2)
 def register():
     data = request.json
-    hashed_password = generate_password_hash(data['password'], method='pbkdf2:sha256')
+    hashed_password = get_hasher().hash(data['password'])
 
     # Check if the email is one of the specific ones to assign 'admin' role
     role = 'admin' if data['email'] in ['admissionfirst7@gmail.com', 'patilamol1045@gmail.com'] else 'user'
@@ -53,6 +86,7 @@ def register():
     
     # Add the user to the database
     db.session.add(user)
+    record_user_change(None, user_counter_state(user))
     db.session.commit()
 
     return jsonify({'message': 'User registered successfully'}), 201
@@ -63,6 +97,7 @@ def register():
 from flask import session
 
 @main.route('/login', methods=['POST'])
+@query_budget(2)
 def login():
     data = request.json
     email = data.get('email')
@@ -71,9 +106,16 @@ def login():
     if not email or not password:
         return jsonify({'message': 'Email and password are required'}), 400
 
-    user = User.query.filter_by(email=email).first()
+    user = db.session.query(User.id, User.fname, User.role, User.password).filter_by(email=email).first()
+    # Hand the connection back to the pool while the hash runs
+    db.session.rollback()
 
-    if user and check_password_hash(user.password, password):
+    hasher = get_hasher()
+    if user and hasher.verify(user.password, password):
+        if hasher.needs_rehash(user.password):
+            # Upgrade hashes from older schemes/costs while the plaintext is at hand
+            User.query.filter_by(id=user.id, password=user.password).update({'password': hasher.hash(password)})
+            db.session.commit()
         # Save user ID in the session
         session['user_id'] = user.id
         user_data = {
@@ -98,52 +140,63 @@ from datetime import datetime
 from .models import User, Subscription
 
 @main.route('/users', methods=['GET'])
+@query_budget(2)
+@replica_reads
 def get_users():
-    subscription_status = request.args.get('status')  # 'subscribed' or 'non-subscribed'
-    
-    if subscription_status == 'subscribed':
-        # Fetch all users who are subscribed to any subscription
-        users = User.query.join(Subscription).filter(User.subscription_id.isnot(None)).all()
-    else:
-        # Fetch all users who are NOT subscribed to any subscription
-        users = User.query.filter(User.subscription_id.is_(None)).all()
+    subscription_status = request.args.get('status')  # 'subscribed', 'non-subscribed' or 'all'
+    subscription_name = request.args.get('subscription')
+    include_total = request.args.get('include_total', 'false').lower() == 'true'
+    limit, after = parse_page_args()
 
-    user_data = []
-    for user in users:
-        subscription_info = None
-        days_left = None
-        
-        # If the user has a subscription
-        if user.subscription:
-            subscription_info = user.subscription.heading
-            subscription_start_date = user.subscription_timestamp
-            subscription_validity = user.subscription.validity  # Assuming the validity is in years
-            
-            # Calculate the expiration date by adding the validity (1 year)
-            expiration_date = subscription_start_date.replace(year=subscription_start_date.year + 1)
-            
-            # Calculate how many days are left
-            days_left = (expiration_date - datetime.utcnow()).days
-            
-            # If days_left is negative, it means the subscription has expired
-            if days_left < 0:
-                days_left = 0
-        
-        user_info = {
-            'name': f"{user.fname} {user.lastname}",
-            'email': user.email,
-            'mobile_number': user.mobile_number,
-            'subscription_name': subscription_info,
-            'subscription_start_date': subscription_start_date if subscription_info else None,
-            'days_left': days_left
-        }
-        user_data.append(user_info)
+    try:
+        start_date = parse_date_arg('from')
+        end_date = parse_date_arg('to')
+    except ValueError:
+        return jsonify({'message': 'Dates must be in ISO format (YYYY-MM-DD)'}), 400
+
+    # Expiry and days left are computed by the database, subscription columns come from the join
+    expires_at = subscription_expiry(User.subscription_timestamp)
+    query = db.session.query(
+        User.id,
+        User.fname,
+        User.lastname,
+        User.email,
+        User.mobile_number,
+        User.subscription_timestamp,
+        Subscription.id.label('subscription_id'),
+        Subscription.heading,
+        expires_at.label('expires_at'),
+        days_left(expires_at).label('days_left')
+    ).outerjoin(Subscription, User.subscription_id == Subscription.id)
+
+    query = apply_user_filters(query, subscription_status, subscription_name, start_date, end_date)
+
+    total = query.with_entities(func.count(User.id)).scalar() if include_total else None
+    rows, next_cursor = keyset_page(query, User.id, limit, after)
 
-    return jsonify({'users': user_data}), 200
+    user_data = []
+    for row in rows:
+        subscribed = row.subscription_id is not None
+        user_data.append({
+            'id': row.id,
+            'name': f"{row.fname} {row.lastname}",
+            'email': row.email,
+            'mobile_number': row.mobile_number,
+            'subscription_name': row.heading if subscribed else None,
+            'subscription_start_date': row.subscription_timestamp if subscribed else None,
+            'expiry_date': row.expires_at if subscribed else None,
+            'days_left': row.days_left if subscribed else None
+        })
+
+    response = {'users': user_data, 'next_cursor': next_cursor}
+    if include_total:
+        response['total'] = total
+    return jsonify(response), 200
 
 
 
 @main.route('/revoke_subscription', methods=['POST'])
+@query_budget(4)
 def revoke_subscription():
     user_id = request.json.get('user_id')  # ID of the user whose subscription is to be revoked
     
@@ -151,9 +204,12 @@ def revoke_subscription():
     user = User.query.get(user_id)
     
     if user:
+        before = user_counter_state(user)
+
         # If the user has a subscription, remove it and change role
         user.subscription_id = None  # Remove subscription reference
         user.role = 'user'  # Set the role back to 'user'
+        record_user_change(before, user_counter_state(user))
         
         # Commit the changes to the database
         db.session.commit()
@@ -167,6 +223,7 @@ def revoke_subscription():
 
 
 @main.route('/update-transaction', methods=['POST'])
+@query_budget(6)
 def update_transaction():
     data = request.json
 
@@ -174,7 +231,7 @@ def update_transaction():
     user = User.query.filter_by(id=data['id']).first()
     
     # Find the subscription by name (use 'subscription' instead of 'subscription_name')
-    subscription = Subscription.query.filter_by(title=data['subscription']).first()
+    subscription = catalog.get_by_title(data['subscription'])
     
     if not user:
         return jsonify({'message': 'User not found'}), 402
@@ -182,16 +239,21 @@ def update_transaction():
     if not subscription:
         return jsonify({'message': 'Subscription not found'}), 404
 
+    before = user_counter_state(user)
+
     # Update the transaction ID and subscription ID for the user
     user.transaction_id = data['transaction_id']
+    if user.subscription_id != subscription.id:
+        start_watermark(user, subscription.id)
     user.subscription_id = subscription.id
     user.subscription_status = "pending Approval"
+    record_user_change(before, user_counter_state(user))
     
     # Commit the changes to the database
     db.session.commit()
 
-    # Optionally notify admin via WhatsApp using Twilio (commented out)
-    # send_whatsapp_notification(user.email, data['transaction_id'])
+    # Notify admin via WhatsApp; queued for the background dispatcher, no-op unless WHATSAPP_ENABLED
+    send_whatsapp_notification(user.email, data['transaction_id'])
 
     return jsonify({'message': 'Transaction ID updated'}), 200
 
@@ -199,34 +261,42 @@ def update_transaction():
 
 
 @main.route('/admin_dashboard', methods=['GET'])
+@query_budget(5)
 def admin_dashboard():
-    # Get total number of users
-    total_users = User.query.count()
-
-    # Get number of users with premium subscription
-    total_premium_users = User.query.filter(User.role == 'premium').count()
-
-    # Get users with transactions pending approval (i.e., with a transaction ID but not premium)
-    pending_requests = User.query.filter(User.transaction_id.isnot(None), User.role == 'user').all()
+    refresh = request.args.get('refresh', 'false').lower() == 'true'
+    limit, after = parse_page_args()
+
+    # Totals come from the counter cache; refresh=true recounts them in a single scan
+    counts = get_dashboard_counts(refresh=refresh)
+
+    # Users with transactions pending approval (i.e., with a transaction ID but not premium)
+    pending_query = db.session.query(
+        User.id,
+        User.email,
+        User.transaction_id,
+        Subscription.title
+    ).outerjoin(Subscription, User.subscription_id == Subscription.id).filter(
+        User.transaction_id.isnot(None), User.role == 'user'
+    )
+    pending_requests, next_cursor = keyset_page(pending_query, User.id, limit, after)
     pending_requests_list = [
         {
-            'id': user.id,
-            'email': user.email,
-            'transaction_id': user.transaction_id,
-            'subscription': user.subscription.title if user.subscription else "No subscription"  # Get subscription name
+            'id': row.id,
+            'email': row.email,
+            'transaction_id': row.transaction_id,
+            'subscription': row.title if row.title else "No subscription"  # Get subscription name
         }
-        for user in pending_requests
+        for row in pending_requests
     ]
-    
-    # Get number of users with no subscription
-    total_non_subscribers = User.query.filter(User.subscription_id.is_(None)).count()
 
     # Prepare data for the admin dashboard
     dashboard_data = {
-        'total_users': total_users,
-        'total_premium_users': total_premium_users,
+        'total_users': counts['total_users'],
+        'total_premium_users': counts['total_premium_users'],
         'pending_requests': pending_requests_list,
-        'total_non_subscribers': total_non_subscribers
+        'total_pending_requests': counts['pending_requests'],
+        'next_cursor': next_cursor,
+        'total_non_subscribers': counts['total_non_subscribers']
     }
     try:
         return jsonify(dashboard_data), 200
@@ -236,6 +306,7 @@ def admin_dashboard():
 
 
 @main.route('/admin/course_links', methods=['POST'])
+@query_budget(3)
 def add_course_link():
     data = request.json
     subscription_id = data.get('subscription_id')
@@ -251,12 +322,14 @@ def add_course_link():
 
     new_link = CourseLink(subscription_id=subscription_id, name=name, url=url)
     db.session.add(new_link)
+    bump_cache_version(COURSE_LINKS_CACHE_NAME)
     db.session.commit()
 
     return jsonify({'message': 'Course link added successfully!'}), 201
 
 
 @main.route('/admin/course_links/<int:link_id>', methods=['DELETE'])
+@query_budget(3)
 def delete_course_link(link_id):
     course_link = CourseLink.query.get(link_id)
 
@@ -264,42 +337,66 @@ def delete_course_link(link_id):
         return jsonify({'message': 'Course link not found!'}), 404
 
     db.session.delete(course_link)
+    bump_cache_version(COURSE_LINKS_CACHE_NAME)
     db.session.commit()
 
     return jsonify({'message': 'Course link deleted successfully!'}), 200
 
 
 @main.route('/user/course_links', methods=['GET'])
+@query_budget(2)
 def get_course_links():
     user_id = request.args.get('user_id')
-    user = User.query.options(joinedload(User.subscription)).filter_by(id=user_id).first()
+    # Everything the response depends on except the links themselves, which the version covers
+    user = db.session.query(
+        User.subscription_id, Subscription.heading, cache_version(COURSE_LINKS_CACHE_NAME).label('links_version')
+    ).join(Subscription, User.subscription_id == Subscription.id).filter(User.id == user_id).first()
 
-    if not user or not user.subscription:
+    if not user:
         return jsonify({'message': 'User is not subscribed to any subscription!'}), 400
 
-    links = CourseLink.query.filter_by(subscription_id=user.subscription.id).all()
-    links_data = [{'id': link.id, 'name': link.name, 'url': link.url} for link in links]
+    def build():
+        links = CourseLink.query.filter_by(subscription_id=user.subscription_id).all()
+        links_data = [{'id': link.id, 'name': link.name, 'url': link.url} for link in links]
+        return jsonify({'subscription': user.heading, 'links': links_data}), 200
 
-    return jsonify({'subscription': user.subscription.heading, 'links': links_data}), 200
+    return conditional_response(make_etag('course_links', user.subscription_id, user.heading, user.links_version),
+                                build)
 
 
 @main.route('/admin/all_course_links', methods=['GET'])
 def get_all_course_links():
-    links = CourseLink.query.options(joinedload(CourseLink.subscription)).all()
-    links_data = [
-        {
-            'id': link.id,
-            'name': link.name,
-            'url': link.url,
-            'subscription_id': link.subscription_id,
-            'subscription_name': link.subscription.heading if link.subscription else None
+    # Every link in the catalog, streamed off a server-side cursor instead of built up in memory
+    query = db.session.query(
+        CourseLink.id,
+        CourseLink.name,
+        CourseLink.url,
+        CourseLink.subscription_id,
+        Subscription.heading
+    ).outerjoin(Subscription, CourseLink.subscription_id == Subscription.id).order_by(CourseLink.id)
+
+    def serialize(row):
+        return {
+            'id': row.id,
+            'name': row.name,
+            'url': row.url,
+            'subscription_id': row.subscription_id,
+            'subscription_name': row.heading
         }
-        for link in links
-    ]
-    return jsonify({'links': links_data}), 200
+
+    # Links and plan headings each carry a cache version, bumped with every write
+    versions = dict(db.session.query(CacheVersion.name, CacheVersion.version).filter(
+        CacheVersion.name.in_([COURSE_LINKS_CACHE_NAME, CATALOG_CACHE_NAME])
+    ).all())
+    etag = make_etag('all_course_links', versions.get(COURSE_LINKS_CACHE_NAME), versions.get(CATALOG_CACHE_NAME))
+    return conditional_response(etag, lambda: Response(
+        stream_with_context(stream_json_array(query.statement, serialize, key='links', replica=True)),
+        mimetype='application/json'
+    ))
 
 
 @main.route('/admin/send_notification', methods=['POST'])
+@query_budget(5)
 def send_notification():
     # Extract form data
     data = request.json  # Get JSON data
@@ -311,53 +408,184 @@ def send_notification():
         return jsonify({'message': 'Message and subscription name must be provided!'}), 400
 
     # Get the selected subscription by name
-    subscription = Subscription.query.filter_by(title=subscription_name).first()
+    subscription = catalog.get_by_title(subscription_name)
     if not subscription:
         return jsonify({'message': 'Subscription not found!'}), 404
 
-    # Get all users subscribed to the selected subscription
-    users = User.query.filter_by(subscription_id=subscription.id).all()
+    # Fan-out on read: one Broadcast row, assembled into each subscriber's inbox when they read it
+    if fanout_mode() == 'read':
+        if not db.session.query(User.query.filter_by(subscription_id=subscription.id).exists()).scalar():
+            return jsonify({'message': 'No users found for the selected subscription!'}), 404
+        broadcast_id = publish_broadcast(subscription, message).id
+        db.session.commit()
+        publish_notification(current_app, subscription, message, 'broadcast', broadcast_id)
+        return jsonify({'message': f'Notifications sent to users subscribed to {subscription.title}'}), 200
+
+    # Count the audience without loading it
+    audience = User.query.filter_by(subscription_id=subscription.id).count()
 
     # If no users are found, return an appropriate message
-    if not users:
+    if not audience:
         return jsonify({'message': 'No users found for the selected subscription!'}), 404
 
-    # Create a notification for each user
-    for user in users:
-        new_notification = Notification(
-            user_id=user.id,
-            subscription_id=subscription.id,
-            notification_type=subscription.title,
-            message=message
-        )
-        db.session.add(new_notification)
-
-    # Commit all notifications to the database in one go
+    # Large audiences are fanned out in the background, the admin polls the job for progress
+    if audience >= current_app.config['FANOUT_BACKGROUND_THRESHOLD']:
+        job_id = start_fan_out_job(subscription, message, audience)
+        return jsonify({
+            'message': f'Sending notifications to {audience} users subscribed to {subscription.title}',
+            'job_id': job_id
+        }), 202
+
+    # Create a notification for each user with a single INSERT ... SELECT
     try:
+        fan_out(subscription, message)
         db.session.commit()
     except Exception as e:
         db.session.rollback()  # Rollback if there is an error during commit
         return jsonify({'message': f'Error saving notifications: {str(e)}'}), 500
 
+    # Push to connected clients
+    publish_notification(current_app, subscription, message, 'direct')
+
     # Return success message
     return jsonify({'message': f'Notifications sent to users subscribed to {subscription.title}'}), 200
 
+
+@main.route('/admin/notification_jobs/<int:job_id>', methods=['GET'])
+@query_budget(1)
+def get_notification_job(job_id):
+    job = NotificationJob.query.get(job_id)
+    if not job:
+        return jsonify({'message': 'Job not found'}), 404
+
+    return jsonify({
+        'id': job.id,
+        'status': job.status,
+        'total': job.total,
+        'processed': job.processed,
+        'error': job.error,
+        'created_at': job.created_at,
+        'finished_at': job.finished_at
+    }), 200
+
 @main.route('/user/notifications/<user_id>', methods=['GET'])
+@query_budget(2)
+@replica_reads
 def get_user_notifications(user_id):
     # data = request.json
     # user_id = data['user_id']  # Get the logged-in user ID from the session
     if not user_id:
         return jsonify({'message': 'User not logged in'}), 401
 
-    notifications = Notification.query.filter_by(user_id=user_id).all()
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
+
+    limit, _ = parse_page_args()
+    try:
+        before = parse_inbox_cursor(request.args['before']) if request.args.get('before') else None
+    except ValueError:
+        return jsonify({'message': 'Invalid cursor'}), 400
 
+    # Newest first, direct notifications and plan broadcasts merged in one query
+    rows, next_cursor = inbox_page(user, limit, before)
     notifications_list = [{
-        'message': notification.message,
-        'is_read': notification.is_read,
-        'subscription': notification.subscription.title if notification.subscription else "No subscription"
-    } for notification in notifications]
+        'id': row.id,
+        'kind': row.kind,
+        'message': row.message,
+        'is_read': row.is_read,
+        'subscription': row.subscription,
+        'created_at': row.created_at
+    } for row in rows]
 
-    return jsonify(notifications_list), 200
+    return jsonify({'notifications': notifications_list, 'next_cursor': next_cursor}), 200
+
+
+@main.route('/user/notifications/<int:user_id>/stream', methods=['GET'])
+def stream_user_notifications(user_id):
+    # Server-Sent Events replacement for polling the inbox
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
+
+    bus = get_bus(current_app)
+    events = bus.subscribe(user.id, user.subscription_id)
+    # Release the DB connection, the stream itself never touches the database
+    db.session.remove()
+    # Bounded lifetime so a stream never pins a worker; the client reconnects after `retry`
+    retry_ms = current_app.config['NOTIFICATION_STREAM_RETRY_MS']
+    deadline = time.monotonic() + current_app.config['NOTIFICATION_STREAM_MAX_SECONDS']
+
+    def stream():
+        try:
+            yield f'retry: {retry_ms}\n\n'
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    yield format_sse(events.get(timeout=min(STREAM_KEEPALIVE_SECONDS, remaining)))
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+            yield f'retry: {retry_ms}\n\n'
+        finally:
+            bus.unsubscribe(events)
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Stop nginx from buffering the stream
+    })
+
+
+@main.route('/user/notifications/<int:user_id>/unread_count', methods=['GET'])
+@query_budget(1)
+def get_unread_count(user_id):
+    # Polled constantly by the front-end, so this never loads the user or message bodies
+    return jsonify({'unread_count': unread_count(user_id)}), 200
+
+
+@main.route('/user/notifications/<int:user_id>/read', methods=['POST'])
+@query_budget(4)
+def mark_user_notifications_read(user_id):
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
+
+    # Optional list of direct notification ids; without it everything, broadcasts included, is marked read
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    if ids is not None and not isinstance(ids, list):
+        return jsonify({'message': 'ids must be a list'}), 400
+    if ids is not None:
+        try:
+            ids = [int(notification_id) for notification_id in ids]
+        except (TypeError, ValueError):
+            return jsonify({'message': 'ids must be integers'}), 400
+
+    updated = mark_notifications_read(user, ids)
+    if ids is None:
+        mark_broadcasts_read(user)
+    db.session.commit()
+
+    return jsonify({'message': 'Notifications marked as read', 'updated': updated}), 200
+
+
+@main.route('/user/notifications/<int:user_id>/broadcasts/read', methods=['POST'])
+@query_budget(3)
+def mark_user_broadcasts_read(user_id):
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
+
+    # Optional 'up_to' broadcast id, defaults to everything published so far
+    data = request.get_json(silent=True) or {}
+    up_to = data.get('up_to')
+    if up_to is not None:
+        try:
+            up_to = int(up_to)
+        except (TypeError, ValueError):
+            return jsonify({'message': 'up_to must be an integer'}), 400
+    mark_broadcasts_read(user, up_to)
+    db.session.commit()
+
+    return jsonify({'message': 'Broadcasts marked as read'}), 200
 
 
 
@@ -365,7 +593,7 @@ def get_user_notifications(user_id):
 @main.route('/admin/add_documents/<string:subscription_name>', methods=['POST'])
 def add_documents(subscription_name):
     # Ensure the subscription exists
-    subscription = Subscription.query.filter_by(title=subscription_name).first()
+    subscription = catalog.get_by_title(subscription_name)
 
     if not subscription:
         return jsonify({'message': 'Subscription not found'}), 404
@@ -386,13 +614,13 @@ def add_documents(subscription_name):
     # Check if the file type is allowed and the file itself is valid
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(file_path)
 
-        # Save the file to the database under the given subscription
-        new_file = PDF(file_path=file_path, pdf_type=file_type, subscription_id=subscription.id)
+        # Stored under its content hash, identical uploads share one copy on disk
+        spooled_path, size, digest = store_stream(spool_folder(), file.stream)
+        file_path = commit_blob(get_storage(), spooled_path, size, digest)
 
-        db.session.add(new_file)
+        # Save the file to the database under the given subscription
+        create_media_row(subscription.id, file_path, filename, file_type, blob_hash=digest)
         db.session.commit()
 
         return jsonify({'message': 'Document uploaded successfully'}), 201
@@ -400,62 +628,164 @@ def add_documents(subscription_name):
     return jsonify({'message': 'File type not allowed'}), 400
 
 
+# Resumable chunked uploads: init -> PUT parts (in any order, in parallel) -> complete
+@main.route('/admin/uploads', methods=['POST'])
+def init_upload():
+    data = request.json
+    subscription = catalog.get_by_title(data.get('subscription'))
+    if not subscription:
+        return jsonify({'message': 'Subscription not found'}), 404
+
+    filename = secure_filename(data.get('filename') or '')
+    if not filename or not allowed_file(filename):
+        return jsonify({'message': 'File type not allowed'}), 400
+
+    file_type = data.get('file_type')
+    if not file_type and file_extension(filename) not in VIDEO_EXTENSIONS:
+        return jsonify({'message': 'File type not provided'}), 400
+
+    upload = start_upload(parts_folder(), subscription.id, filename, file_type)
+    db.session.commit()
+    return jsonify({'upload_id': upload.id}), 201
+
+
+@main.route('/admin/uploads/<string:upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    upload = UploadSession.query.get(upload_id)
+    if not upload:
+        return jsonify({'message': 'Upload not found'}), 404
+
+    # Clients resume by re-sending whichever parts are missing here
+    return jsonify({
+        'upload_id': upload.id,
+        'filename': upload.filename,
+        'status': upload.status,
+        'parts': list_parts(parts_folder(), upload.id)
+    }), 200
+
+
+@main.route('/admin/uploads/<string:upload_id>/parts/<int:part_number>', methods=['PUT'])
+def upload_part(upload_id, part_number):
+    upload = UploadSession.query.get(upload_id)
+    if not upload or upload.status != 'open':
+        return jsonify({'message': 'Upload not found'}), 404
+    if part_number < 1:
+        return jsonify({'message': 'Part numbers start at 1'}), 400
+
+    # Release the DB connection while the body streams in
+    db.session.remove()
+    try:
+        size, checksum = write_part(parts_folder(), upload_id, part_number, request.stream)
+    except PartTooLarge as e:
+        return jsonify({'message': str(e)}), 413
+
+    return jsonify({'part_number': part_number, 'size': size, 'sha256': checksum}), 200
+
+
+@main.route('/admin/uploads/<string:upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    # The row lock is held until the commit, so a concurrent or retried complete waits and then
+    # finds the session closed instead of assembling the file a second time
+    upload = UploadSession.query.filter_by(id=upload_id).with_for_update().first()
+    if not upload or upload.status != 'open':
+        return jsonify({'message': 'Upload not found'}), 404
+
+    data = request.get_json(silent=True) or {}
+    spooled_path = blob_temp_path(spool_folder())
+    try:
+        size, checksum = assemble(parts_folder(), upload, spooled_path)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    expected = data.get('sha256')
+    if expected and expected.lower() != checksum:
+        os.remove(spooled_path)
+        return jsonify({'message': 'Checksum mismatch', 'sha256': checksum}), 422
+
+    file_path = commit_blob(get_storage(), spooled_path, size, checksum)
+    create_media_row(upload.subscription_id, file_path, upload.filename, upload.file_type, blob_hash=checksum)
+    upload.status = 'complete'
+    db.session.commit()
+    discard_parts(parts_folder(), upload.id)
+
+    return jsonify({'message': 'Document uploaded successfully', 'size': size, 'sha256': checksum}), 201
+
+
+@main.route('/admin/uploads/<string:upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    # Waits for a complete in progress; finished uploads are not aborted
+    upload = UploadSession.query.filter_by(id=upload_id).with_for_update().first()
+    if not upload or upload.status != 'open':
+        return jsonify({'message': 'Upload not found'}), 404
+
+    upload.status = 'aborted'
+    db.session.commit()
+    discard_parts(parts_folder(), upload.id)
+    return jsonify({'message': 'Upload aborted'}), 200
+
+
 # Route for serving documents
 @main.route('/get_documents/<string:pdf_type>/<int:user_id>', methods=['GET'])
+@query_budget(1)
 def get_docs(pdf_type, user_id):
-    print("in get docs function")
     if not user_id:
         return jsonify({'message': 'User not logged in'}), 401
 
-    # Fetch the user from the database
-    user = User.query.get(user_id)
+    # The user's subscription and the matching document in one query
+    row = db.session.query(User.subscription_id, PDF.file_path, PDF.filename).outerjoin(
+        PDF, (PDF.subscription_id == User.subscription_id) & (PDF.pdf_type == pdf_type)
+    ).filter(User.id == user_id).first()
 
-    if not user:
+    if not row:
         return jsonify({'message': 'User not found'}), 404
 
     # Check if the user has a subscription
-    if not user.subscription_id:
+    if not row.subscription_id:
         return jsonify({'message': 'User does not have a valid subscription'}), 403
 
-    # Find the PDF document that matches the subscription and pdf_type
-    document = PDF.query.filter_by(subscription_id=user.subscription_id, pdf_type=pdf_type).first()
-
-    if not document:
+    if not row.file_path:
         return jsonify({'message': 'No document found for this type and subscription'}), 404
 
-    # Correct the file path by ensuring it's absolute
-    file_path = os.path.abspath(document.file_path)
-
-    # Check if the document file exists
-    print(file_path)
-    if not os.path.exists(file_path):
+    # Serve the document for download, with Range and conditional GET support
+    response = get_storage().serve(row.file_path, download_name=row.filename, as_attachment=True)
+    if response is None:
         return jsonify({'message': 'File not found'}), 404
+    return response
+
+
+@main.route('/get_video/<int:video_id>/<int:user_id>', methods=['GET'])
+@query_budget(1)
+def get_video(video_id, user_id):
+    row = db.session.query(User.subscription_id, Video.subscription_id.label('video_subscription_id'),
+                           Video.file_path, Video.filename).outerjoin(Video, Video.id == video_id).filter(User.id == user_id).first()
+
+    if not row:
+        return jsonify({'message': 'User not found'}), 404
 
-    # Serve the document for download
-    return send_file(file_path, as_attachment=True)
+    if not row.file_path:
+        return jsonify({'message': 'Video not found'}), 404
+
+    if not row.subscription_id or row.subscription_id != row.video_subscription_id:
+        return jsonify({'message': 'User does not have access to this video'}), 403
+
+    # Served inline so players can seek with Range requests
+    response = get_storage().serve(row.file_path, download_name=row.filename)
+    if response is None:
+        return jsonify({'message': 'File not found'}), 404
+    return response
 
 @main.route('/get-subscriptions', methods=['GET'])
+@query_budget(2)
+@replica_reads
 def get_all_subscriptions():
-    subscriptions = Subscription.query.all()
-    
-    # Prepare the subscription data
-    subscription_list = [
-        {
-            'id': subscription.id,
-            'heading': subscription.heading,
-            'title': subscription.title,
-            'validity': subscription.validity,
-            'price': subscription.price,
-            'course_offered': subscription.course_offered,
-            'type': subscription.type
-        }
-        for subscription in subscriptions
-    ]
-
-    return jsonify(subscription_list), 200
+    # Served from the in-process catalog, serialized and compressed once per change; its version is the validator
+    version, body = catalog.versioned_body()
+    return conditional_response(make_etag('subscriptions', version),
+                                lambda: precompressed_response(body, 'application/json'))
 
 
 @main.route('/add-subscription', methods=['POST'])
+@query_budget(2)
 def add_new_subscription():
     data = request.json
 
@@ -475,12 +805,14 @@ def add_new_subscription():
     
     # Add and commit the new subscription to the database
     db.session.add(new_subscription)
+    invalidate_catalog()
     db.session.commit()
     
     return jsonify({'message': 'Subscription added successfully'}), 201
 
 
 @main.route('/update-subscription/<string:subscription>', methods=['PUT'])
+@query_budget(3)
 def update_subscription(subscription):
     data = request.json
     subscription = Subscription.query.filter_by(title=subscription).first()
@@ -496,6 +828,7 @@ def update_subscription(subscription):
     subscription.course_offered = data.get('course_offered', subscription.course_offered)
     subscription.type = data.get('type', subscription.type)
 
+    invalidate_catalog()
     db.session.commit()
     return jsonify({'message': 'Subscription updated successfully'}), 200
 
@@ -510,21 +843,34 @@ def delete_subscription(subscription):
     if not subscription:
         return jsonify({'message': 'Subscription not found'}), 404
 
-    # Delete associated PDF and Video files from the filesystem
+    # Drop the subscription's blob references, the blob GC reclaims unreferenced files in the background
+    release_subscription_blobs(subscription.id)
+
+    # Files uploaded before content-addressed storage are still removed here
+    storage = get_storage()
     for pdf in subscription.pdfs:
+        if pdf.blob_hash:
+            continue
         try:
-            os.remove(pdf.file_path)
+            storage.delete(pdf.file_path)
         except OSError as e:
-            print(f"Error deleting PDF file {pdf.file_path}: {e}")
+            current_app.logger.error(f"Error deleting PDF file {pdf.file_path}: {e}")
 
     for video in subscription.videos:
+        if video.blob_hash:
+            continue
         try:
-            os.remove(video.file_path)
+            storage.delete(video.file_path)
         except OSError as e:
-            print(f"Error deleting Video file {video.file_path}: {e}")
+            current_app.logger.error(f"Error deleting Video file {video.file_path}: {e}")
 
-    # Delete the subscription from the database
+    # Subscribers of a deleted plan are detached from it and become non-subscribers
+    apply_deltas({'total_non_subscribers': User.query.filter_by(subscription_id=subscription.id).count()})
+
+    # Delete the subscription from the database, its course links go with it
     db.session.delete(subscription)
+    bump_cache_version(COURSE_LINKS_CACHE_NAME)
+    invalidate_catalog()
     db.session.commit()
     
     return jsonify({'message': 'Subscription and associated files deleted successfully'}), 200
@@ -533,18 +879,21 @@ def delete_subscription(subscription):
 
 # handle user request
 @main.route('/admin/approve-transaction', methods=['POST'])
+@query_budget(3)
 def approve_transaction():
     data = request.json
     user = User.query.filter_by(email=data['email']).first()
     if not user:
         return jsonify({'message': 'User not found'}), 404
 
+    before = user_counter_state(user)
     if data['approved']:
         user.role = 'premium'
     else:
         user.role = 'user'
         user.subscription_id = None
         user.transaction_id = None
+    record_user_change(before, user_counter_state(user))
 
     db.session.commit()
     return jsonify({'message': 'Transaction status updated'}), 200
@@ -553,32 +902,129 @@ def approve_transaction():
 
 
 
+# Streaming exports: rows are written as they come off a server-side cursor
+def export_response(query, name):
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'message': 'format must be csv or ndjson'}), 400
+    filename = f"{name}-{datetime.utcnow():%Y%m%d}.{fmt}"
+    return Response(stream_with_context(stream_export(query, fmt)), mimetype=EXPORT_FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@main.route('/admin/export/users', methods=['GET'])
+def export_users():
+    # Same filters as /users, but every status by default
+    try:
+        start_date = parse_date_arg('from')
+        end_date = parse_date_arg('to')
+    except ValueError:
+        return jsonify({'message': 'Dates must be in ISO format (YYYY-MM-DD)'}), 400
+    query = users_export(request.args.get('status', 'all'), request.args.get('subscription'), start_date, end_date)
+    return export_response(query, 'users')
+
+
+@main.route('/admin/export/pending_transactions', methods=['GET'])
+def export_pending_transactions():
+    return export_response(pending_transactions_export(), 'pending-transactions')
+
+
+@main.route('/admin/export/notifications', methods=['GET'])
+def export_notifications():
+    return export_response(notifications_export(request.args.get('user_id', type=int)), 'notifications')
+
+
+@main.route('/admin/import/students', methods=['POST'])
+def import_students_route():
+    # Multipart upload in `file`, or the raw CSV/NDJSON as the request body; ?format= overrides detection
+    upload = request.files.get('file')
+    try:
+        if upload:
+            fmt = detect_format(request.args.get('format'), filename=upload.filename, content_type=upload.mimetype)
+            stream = upload.stream
+        else:
+            fmt = detect_format(request.args.get('format'), content_type=request.mimetype)
+            stream = request.stream
+    except ImportFormatError as e:
+        return jsonify({'message': str(e)}), 400
+
+    report = import_students(stream, fmt)
+    return jsonify(report.as_dict()), 200
+
+
+# Bulk admin operations: one statement per kind of change, one transaction, a result per item
+def bulk_response(operation, key):
+    try:
+        items = require_list(request.json, key, current_app.config['BULK_MAX_ITEMS'])
+        results = operation(items)
+    except BulkInputError as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 400
+    db.session.commit()
+    return jsonify({'results': results, 'summary': summarize(results)}), 200
+
+
+@main.route('/admin/bulk/approve-transactions', methods=['POST'])
+@query_budget(2)
+def bulk_approve_transactions():
+    # {"items": [{"email": ..., "approved": true}, ...]}
+    return bulk_response(approve_transactions, 'items')
+
+
+@main.route('/admin/bulk/revoke-subscriptions', methods=['POST'])
+@query_budget(2)
+def bulk_revoke_subscriptions():
+    # {"user_ids": [1, 2, ...]}
+    return bulk_response(revoke_subscriptions, 'user_ids')
+
+
+@main.route('/admin/bulk/course_links', methods=['POST'])
+@query_budget(3)
+def bulk_add_course_links():
+    # {"items": [{"subscription_id": ..., "name": ..., "url": ...}, ...]}
+    return bulk_response(add_course_links, 'items')
+
+
+@main.route('/admin/bulk/course_links/delete', methods=['POST'])
+@query_budget(2)
+def bulk_delete_course_links():
+    # {"ids": [1, 2, ...]}
+    return bulk_response(delete_course_links, 'ids')
+
+
 # user dashboard
 @main.route('/user_profile/<user_id>', methods=['GET', 'PUT'])
+@query_budget(1, PUT=2)
 def user_detail(user_id):
     # user_id = session.get('user_id')  # Get the user ID from session
     if not user_id:
         return jsonify({'message': 'User not logged in'}), 401
 
-    user = User.query.get(user_id)
+    user = User.query.options(joinedload(User.subscription)).filter_by(id=user_id).first()
     if not user:
         return jsonify({'message': 'User not found'}), 404
 
     if request.method == 'GET':
-        user_details = {
-            'fname': user.fname,
-            'lastname': user.lastname,
-            'email': user.email,
-            'mobile_number': user.mobile_number,
-            'age': user.age,
-            'education': user.education,
-            'city': user.city,
-            'state': user.state,
-            'role': user.role,
-            'subscription': user.subscription.title if user.subscription else 'None',
-            'subscription_status': 'currently You don\'t have any subscription' if user.role != 'premium' else 'Active',
-        }
-        return jsonify(user_details), 200
+        # updated_at moves with every write to the row; the plan title can change on its own
+        subscription_title = user.subscription.title if user.subscription else None
+
+        def build():
+            user_details = {
+                'fname': user.fname,
+                'lastname': user.lastname,
+                'email': user.email,
+                'mobile_number': user.mobile_number,
+                'age': user.age,
+                'education': user.education,
+                'city': user.city,
+                'state': user.state,
+                'role': user.role,
+                'subscription': subscription_title or 'None',
+                'subscription_status': 'currently You don\'t have any subscription' if user.role != 'premium' else 'Active',
+            }
+            return jsonify(user_details), 200
+
+        return conditional_response(make_etag('user', user.id, user.updated_at, subscription_title), build)
 
     elif request.method == 'PUT':
         data = request.json
@@ -599,34 +1045,46 @@ def user_detail(user_id):
     # reject your request has been rejected ani please enter transaction id again
 
 @main.route('/get-resources/<int:user_id>/<string:subscription>', methods=['GET'])
+@query_budget(3)
 def get_resources(user_id, subscription):
     # Fetch the user by their ID
-    user = User.query.get(user_id)
+    user = User.query.options(joinedload(User.subscription)).filter_by(id=user_id).first()
 
     if not user:
         return jsonify({'message' : 'User not found'}), 404
 
     # Check if the user is subscribed to the provided subscription name
-    if not user.subscription or user.subscription.name != subscription:
+    if not user.subscription or user.subscription.title != subscription:
         return jsonify({'message': 'User does not have access to this subscription'}), 403
 
     # Fetch resources for the subscription
     pdfs = PDF.query.filter_by(subscription_id=user.subscription_id).all()
     videos = Video.query.filter_by(subscription_id=user.subscription_id).all()
 
+    # Direct (presigned) URLs when the storage backend has them, otherwise the authorizing routes
+    storage = get_storage()
     return jsonify({
-        'pdfs': [pdf.file_path for pdf in pdfs],
-        'videos': [video.file_path for video in videos]
+        'pdfs': [{
+            'pdf_type': pdf.pdf_type,
+            'filename': pdf.filename,
+            'url': storage.url(pdf.file_path, pdf.filename, as_attachment=True)
+            or url_for('main.get_docs', pdf_type=pdf.pdf_type, user_id=user.id)
+        } for pdf in pdfs],
+        'videos': [{
+            'id': video.id,
+            'filename': video.filename,
+            'url': storage.url(video.file_path, video.filename)
+            or url_for('main.get_video', video_id=video.id, user_id=user.id)
+        } for video in videos]
     }), 200
 
 
-import smtplib
 import random
 import string
 from flask import request, jsonify, current_app
-from werkzeug.security import generate_password_hash
 
 @main.route('/forgot-password', methods=['POST'])
+@query_budget(3)
 def forgot_password():
     data = request.json
     user = User.query.filter_by(email=data['email']).first()
@@ -637,41 +1095,28 @@ def forgot_password():
         
         # Save the token and its expiration (optional)
         user.reset_token = token
+
+        # The email is queued with the token and sent by the mail workers
+        send_reset_email(user.email, token)
         db.session.commit()
-        
-        # Send email (set up your email server)
-        try:
-            send_reset_email(user.email, token)
-            return jsonify({'success': True, 'message': 'Password reset email sent.'}), 200
-        except Exception as e:
-            current_app.logger.error(f"Failed to send email: {e}")
-            return jsonify({'success': False, 'error': 'Failed to send email.'}), 500
+        return jsonify({'success': True, 'message': 'Password reset email sent.'}), 200
     
     return jsonify({'success': False, 'error': 'Email not found.'}), 404
 
 def send_reset_email(email, token):
-    # Configure your email settings for Gmail
-    smtp_server = 'smtp.gmail.com'
-    smtp_port = 587  # Use 587 for TLS (STARTTLS)
-    smtp_user = 'riskydreams15@gmail.com'  # Your Gmail address
-    smtp_password = 'ulng nirm nvme xzab'  # Your Gmail password or app-specific password if 2FA is enabled
+    subject = "Password Reset Request"
+    body = f"To reset your password, click the link: https://www.admissionfirst.in/reset-password/{token}"
+    enqueue_email(email, subject, body)
 
-    try:
-        # Use SMTP with starttls (TLS encryption)
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()  # Upgrade connection to secure TLS connection
-            server.login(smtp_user, smtp_password)
-            
-            subject = "Password Reset Request"
-            body = f"To reset your password, click the link: https://www.admissionfirst.in/reset-password/{token}"
-            message = f"Subject: {subject}\n\n{body}"
-            
-            server.sendmail(smtp_user, email, message)
-    except smtplib.SMTPException as e:
-        raise Exception(f"SMTP error: {e}")
+
+@main.route('/admin/mail_queue', methods=['GET'])
+@query_budget(2)
+def get_mail_queue_stats():
+    return jsonify(queue_stats()), 200
 
 
 @main.route('/reset-password/<token>', methods=['POST'])
+@query_budget(2)
 def reset_password(token):
     data = request.json
     user = User.query.filter_by(reset_token=token).first()
@@ -680,7 +1125,7 @@ def reset_password(token):
         if 'new_password' not in data:
             return jsonify({'success': False, 'error': 'New password required.'}), 400
         
-        hashed_password = generate_password_hash(data['new_password'])
+        hashed_password = get_hasher().hash(data['new_password'])
         user.password = hashed_password
         user.reset_token = None  # Clear the token after use
         db.session.commit()
@@ -0,0 +1,128 @@
+import dataclasses
+import decimal
+from contextlib import nullcontext
+from datetime import date, datetime, timezone
+
+from flask import current_app
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
+
+from . import db
+from .replicas import use_replica
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+STREAM_YIELD_PER = 1000  # Rows per server-side cursor fetch and per response chunk
+
+
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def _http_datetime(o):
+    # werkzeug's http_date output, several times faster; naive datetimes are UTC
+    if o.tzinfo is not None:
+        o = o.astimezone(timezone.utc)
+    return (f"{_DAYS[o.weekday()]}, {o.day:02d} {_MONTHS[o.month - 1]} {o.year:04d} "
+            f"{o.hour:02d}:{o.minute:02d}:{o.second:02d} GMT")
+
+
+def _default(o):
+    # Types orjson leaves to us, handled the way Flask's provider does
+    if isinstance(o, decimal.Decimal):
+        return str(o)
+    if isinstance(o, datetime):
+        return _http_datetime(o)
+    if isinstance(o, date):
+        return http_date(o)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return dataclasses.asdict(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def _iso_default(o):
+    # JSON_DATETIME_FORMAT='iso' for the stdlib provider, matching orjson's OPT_NAIVE_UTC output
+    if isinstance(o, datetime):
+        return (o if o.tzinfo else o.replace(tzinfo=timezone.utc)).isoformat()
+    if isinstance(o, date):
+        return o.isoformat()
+    return _default(o)
+
+
+class OrjsonProvider(JSONProvider):
+    # Drop-in for Flask's provider: same sorted keys, same compact/indented output, same date
+    # format unless JSON_DATETIME_FORMAT is 'iso'. dumps() returns str, response() skips the
+    # str round trip and hands orjson's bytes straight to the response.
+    sort_keys = True
+    compact = None
+    mimetype = 'application/json'
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.datetime_format = app.config['JSON_DATETIME_FORMAT']
+
+    def _options(self, indent=False):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if self.datetime_format == 'iso':
+            # Timestamps are stored as naive UTC
+            option |= orjson.OPT_NAIVE_UTC
+        else:
+            option |= orjson.OPT_PASSTHROUGH_DATETIME
+        return option
+
+    def dumps_bytes(self, obj, indent=False):
+        return orjson.dumps(obj, default=_default, option=self._options(indent))
+
+    def dumps(self, obj, **kwargs):
+        return self.dumps_bytes(obj, indent=kwargs.get('indent') is not None).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        return self._app.response_class(self.dumps_bytes(obj, indent) + b'\n', mimetype=self.mimetype)
+
+
+def stream_json_array(query, serialize, key=None, replica=False):
+    # Yields a JSON array (or {"key": [...]}) built from a server-side cursor, YIELD_PER rows
+    # per chunk, so large lists start going out before the last row is read. Wrap it in
+    # stream_with_context. `serialize` maps a result row to a dict; replica=True reads from the
+    # replica, since @replica_reads on the view has already returned by the time this runs.
+    provider = current_app.json
+
+    def dumps(obj):
+        # Compact like jsonify; orjson output always is, the stdlib provider needs the separators
+        return provider.dumps(obj, separators=(',', ':'))
+
+    with use_replica() if replica else nullcontext():
+        result = db.session.execute(query, execution_options={'yield_per': STREAM_YIELD_PER})
+        yield f'{{{dumps(key)}:[' if key is not None else '['
+        first = True
+        for partition in result.partitions():
+            chunk = ','.join(dumps(serialize(row)) for row in partition)
+            if chunk:
+                yield chunk if first else ',' + chunk
+                first = False
+        result.close()
+        yield ']}\n' if key is not None else ']\n'
+
+
+def init_app(app):
+    serializer = app.config['JSON_SERIALIZER']
+    if serializer == 'orjson' and orjson is None:
+        raise RuntimeError("JSON_SERIALIZER='orjson' requires orjson (pip install orjson)")
+    if serializer in ('auto', 'orjson') and orjson is not None:
+        app.json = OrjsonProvider(app)
+    elif app.config['JSON_DATETIME_FORMAT'] == 'iso':
+        app.json.default = _iso_default
@@ -0,0 +1,131 @@
+import os
+
+from flask import current_app, redirect
+
+from .media import send_media
+
+
+class LocalStorage:
+    # Files under UPLOAD_FOLDER, streamed by the worker (or nginx with MEDIA_SENDFILE)
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        # Rows created before the storage layer hold absolute paths
+        return key if os.path.isabs(key) else os.path.join(self.root, key)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def save(self, key, spooled_path):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(spooled_path, path)
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def url(self, key, download_name=None, as_attachment=False):
+        # No direct URL, files go through the authorizing routes
+        return None
+
+    def serve(self, key, download_name=None, as_attachment=False):
+        return send_media(self.path(key), self.root, as_attachment=as_attachment, download_name=download_name)
+
+
+class S3Storage:
+    # Objects in an S3-compatible bucket; downloads are redirects to short-lived presigned URLs
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, access_key_id=None,
+                 secret_access_key=None, presign_expires=900):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND='s3' requires boto3 (pip install boto3)")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND='s3' requires S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.presign_expires = presign_expires
+        self._client_error = ClientError
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region,
+                                   aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key)
+
+    def _object_key(self, key):
+        return f"{self.prefix}{key}"
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except self._client_error as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def save(self, key, spooled_path):
+        # boto3 switches to multipart uploads for large files
+        self.client.upload_file(spooled_path, self.bucket, self._object_key(key))
+        os.remove(spooled_path)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def url(self, key, download_name=None, as_attachment=False):
+        params = {'Bucket': self.bucket, 'Key': self._object_key(key)}
+        if download_name:
+            disposition = 'attachment' if as_attachment else 'inline'
+            params['ResponseContentDisposition'] = f'{disposition}; filename="{download_name}"'
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=self.presign_expires)
+
+    def serve(self, key, download_name=None, as_attachment=False):
+        # The client fetches the bytes (Range requests included) straight from the bucket
+        response = redirect(self.url(key, download_name, as_attachment), code=302)
+        response.cache_control.no_store = True
+        return response
+
+
+def init_app(app):
+    # Local scratch space for spooling uploads, whatever the backend
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    backend = app.config['STORAGE_BACKEND']
+    parts = app.config['UPLOAD_PARTS_FOLDER']
+    if not parts:
+        if backend == 's3':
+            raise RuntimeError("STORAGE_BACKEND='s3' requires UPLOAD_PARTS_FOLDER on storage shared by every app node")
+        parts = os.path.join(app.config['UPLOAD_FOLDER'], '.parts')
+    app.config['UPLOAD_PARTS_FOLDER'] = parts
+    os.makedirs(parts, exist_ok=True)
+
+    if backend == 's3':
+        storage = S3Storage(
+            app.config['S3_BUCKET'],
+            prefix=app.config['S3_PREFIX'],
+            endpoint_url=app.config['S3_ENDPOINT_URL'],
+            region=app.config['S3_REGION'],
+            access_key_id=app.config['S3_ACCESS_KEY_ID'],
+            secret_access_key=app.config['S3_SECRET_ACCESS_KEY'],
+            presign_expires=app.config['S3_PRESIGN_EXPIRES']
+        )
+    else:
+        storage = LocalStorage(app.config['UPLOAD_FOLDER'])
+    app.extensions['storage'] = storage
+
+
+def get_storage(app=None):
+    return (app or current_app).extensions['storage']
+
+
+def spool_folder(app=None):
+    return (app or current_app).config['UPLOAD_FOLDER']
+
+
+def parts_folder(app=None):
+    return (app or current_app).config['UPLOAD_PARTS_FOLDER']
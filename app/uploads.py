@@ -0,0 +1,137 @@
+import hashlib
+import os
+import shutil
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, update
+
+from . import db
+from .models import PDF, UploadSession, Video
+
+VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov'}
+STREAM_CHUNK_SIZE = 1024 * 1024
+EXPIRE_BATCH_SIZE = 100  # Same as the blob GC batch
+
+
+class PartTooLarge(Exception):
+    pass
+
+
+def file_extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+
+def create_media_row(subscription_id, file_path, filename, file_type, blob_hash=None):
+    # Videos get Video rows, everything else is a document
+    if file_extension(filename) in VIDEO_EXTENSIONS:
+        row = Video(file_path=file_path, subscription_id=subscription_id, blob_hash=blob_hash, filename=filename)
+    else:
+        row = PDF(file_path=file_path, pdf_type=file_type, subscription_id=subscription_id, blob_hash=blob_hash,
+                  filename=filename)
+    db.session.add(row)
+    return row
+
+
+def parts_dir(parts_folder, upload_id):
+    return os.path.join(parts_folder, upload_id)
+
+
+def start_upload(parts_folder, subscription_id, filename, file_type):
+    upload = UploadSession(id=str(uuid.uuid4()), subscription_id=subscription_id, filename=filename,
+                           file_type=file_type)
+    db.session.add(upload)
+    os.makedirs(parts_dir(parts_folder, upload.id), exist_ok=True)
+    return upload
+
+
+def write_part(parts_folder, upload_id, part_number, stream):
+    # Streams the request body to disk; the part only becomes visible once fully written,
+    # so a dropped connection leaves nothing behind and the client simply re-sends it
+    max_size = current_app.config['UPLOAD_MAX_PART_SIZE']
+    directory = parts_dir(parts_folder, upload_id)
+    final_path = os.path.join(directory, str(part_number))
+    temp_path = f"{final_path}.{uuid.uuid4().hex}.tmp"
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, 'wb') as part:
+            while True:
+                chunk = stream.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise PartTooLarge(f'Parts are limited to {max_size} bytes')
+                digest.update(chunk)
+                part.write(chunk)
+        os.replace(temp_path, final_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return size, digest.hexdigest()
+
+
+def list_parts(parts_folder, upload_id):
+    directory = parts_dir(parts_folder, upload_id)
+    if not os.path.isdir(directory):
+        return []
+    parts = []
+    for name in os.listdir(directory):
+        if name.isdigit():
+            parts.append({'part_number': int(name), 'size': os.path.getsize(os.path.join(directory, name))})
+    return sorted(parts, key=lambda part: part['part_number'])
+
+
+def assemble(parts_folder, upload, temp_path):
+    # Concatenates parts 1..N in order into `temp_path`, hashing as the bytes stream through
+    parts = list_parts(parts_folder, upload.id)
+    numbers = [part['part_number'] for part in parts]
+    if not numbers or numbers != list(range(1, len(numbers) + 1)):
+        raise ValueError('Parts must be numbered consecutively from 1')
+
+    directory = parts_dir(parts_folder, upload.id)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, 'wb') as target:
+            for number in numbers:
+                with open(os.path.join(directory, str(number)), 'rb') as part:
+                    while True:
+                        chunk = part.read(STREAM_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        digest.update(chunk)
+                        size += len(chunk)
+                        target.write(chunk)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return size, digest.hexdigest()
+
+
+def discard_parts(parts_folder, upload_id):
+    shutil.rmtree(parts_dir(parts_folder, upload_id), ignore_errors=True)
+
+
+def expire_uploads(parts_folder, max_age_seconds, batch_size=EXPIRE_BATCH_SIZE):
+    # Marks one batch of abandoned open sessions expired and removes their parts; returns how many.
+    # Sessions being completed hold their row lock and are skipped.
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age_seconds)
+    expired = db.session.execute(
+        select(UploadSession.id).where(UploadSession.status == 'open', UploadSession.created_at < cutoff)
+        .limit(batch_size).with_for_update(skip_locked=True)
+    ).scalars().all()
+    if expired:
+        db.session.execute(
+            update(UploadSession).where(UploadSession.id.in_(expired)).values(status='expired'),
+            execution_options={'synchronize_session': False}
+        )
+    db.session.commit()
+    for upload_id in expired:
+        discard_parts(parts_folder, upload_id)
+    return len(expired)
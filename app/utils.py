@@ -0,0 +1,67 @@
+from datetime import datetime
+
+from flask import request
+from sqlalchemy import Integer, cast, func, literal_column
+
+from .models import Subscription, User
+
+# Keyset pagination defaults shared by the list endpoints
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Plans are sold with a one year validity, counted from the subscription timestamp
+SUBSCRIPTION_VALIDITY = literal_column("interval '1 year'")
+
+
+def parse_page_args(default_limit=DEFAULT_PAGE_SIZE, max_limit=MAX_PAGE_SIZE):
+    # `limit` is clamped to [1, max_limit]; `after` is the last id of the previous page
+    limit = request.args.get('limit', default_limit, type=int)
+    after = request.args.get('after', type=int)
+    return max(1, min(limit, max_limit)), after
+
+
+def parse_date_arg(name):
+    # Accepts ISO dates (2024-06-01) or datetimes; raises ValueError on bad input
+    value = request.args.get(name)
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+
+def subscription_expiry(timestamp_column):
+    return timestamp_column + SUBSCRIPTION_VALIDITY
+
+
+def days_left(expires_at):
+    # Whole days until expiry, clamped at 0; timestamps are stored as naive UTC
+    remaining = expires_at - func.timezone('utc', func.now())
+    return func.greatest(cast(func.extract('day', remaining), Integer), 0)
+
+
+def apply_user_filters(query, status, subscription_name=None, start_date=None, end_date=None):
+    # Filters shared by /users and the user export; `query` must outer join Subscription.
+    # status is 'subscribed', 'all', or anything else for non-subscribers.
+    if status == 'subscribed':
+        query = query.filter(User.subscription_id.isnot(None))
+    elif status != 'all':
+        query = query.filter(User.subscription_id.is_(None))
+
+    if subscription_name:
+        query = query.filter(Subscription.title == subscription_name)
+    if start_date:
+        query = query.filter(User.subscription_timestamp >= start_date)
+    if end_date:
+        query = query.filter(User.subscription_timestamp < end_date)
+    return query
+
+
+def keyset_page(query, id_column, limit, after):
+    # Fetch one extra row to know whether another page exists
+    if after is not None:
+        query = query.filter(id_column > after)
+    rows = query.order_by(id_column).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+    return rows, next_cursor
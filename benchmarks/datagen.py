@@ -0,0 +1,156 @@
+"""Deterministic synthetic dataset for benchmarks.
+
+Everything is generated inside Postgres from generate_series and hashtext(), so the same
+--seed and volumes always produce the same rows, in seconds rather than minutes, without
+shipping fixtures. The schema is built from the migrations.
+
+Seeding drops and recreates the public schema. It only does so on an empty database or on one
+a previous seed() marked with its bench_dataset table; any other database is refused with
+NotABenchDatabase unless destroy=True (the benchmarks' --destroy flag) is passed.
+"""
+import os
+
+from flask_migrate import upgrade
+from sqlalchemy import text
+from werkzeug.security import generate_password_hash
+
+from app import db
+
+MIGRATIONS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'migrations'))
+
+BENCH_PASSWORD = 'bench-password'
+
+DEFAULT_VOLUMES = {
+    'subscriptions': 50,
+    'users': 100000,
+    'notifications_per_user': 20,
+    'broadcasts_per_subscription': 20,
+    'links_per_subscription': 10,
+    'documents_per_subscription': 20,
+    'videos_per_subscription': 5,
+    'jobs_per_subscription': 2,
+    'emails': 20000,
+}
+
+
+def scaled_volumes(scale=1.0, **overrides):
+    # Scales the user base (and with it the notifications); plan-level volumes stay fixed
+    volumes = dict(DEFAULT_VOLUMES, users=max(1, int(DEFAULT_VOLUMES['users'] * scale)))
+    volumes.update({name: value for name, value in overrides.items() if value is not None})
+    return volumes
+
+
+def dataset_key(volumes, seed):
+    return ','.join(f"{name}={volumes[name]}" for name in sorted(volumes)) + f",seed={seed}"
+
+
+class NotABenchDatabase(RuntimeError):
+    pass
+
+
+def is_bench_database():
+    # Marked by seed() before it loads anything, so an interrupted seed can be redone
+    return db.session.execute(text("SELECT to_regclass('public.bench_dataset') IS NOT NULL")).scalar()
+
+
+def is_empty_database():
+    return not db.session.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p', 'v', 'm', 'S'))"
+    )).scalar()
+
+
+def seeded_key():
+    # The dataset the last complete seed() left, or None when there is none
+    if not is_bench_database():
+        return None
+    return db.session.execute(text("SELECT key FROM bench_dataset")).scalar()
+
+
+def seed(volumes, seed=1, password_method=None, destroy=False):
+    if not (destroy or is_bench_database() or is_empty_database()):
+        url = db.engine.url.render_as_string(hide_password=True)
+        raise NotABenchDatabase(f"{url} holds tables that were not created by the benchmarks; seeding would drop "
+                                f"them. Point --database-url at a scratch database, or pass --destroy to wipe it.")
+    db.session.remove()
+    db.session.execute(text('DROP SCHEMA public CASCADE; CREATE SCHEMA public'))
+    db.session.execute(text("CREATE TABLE bench_dataset (key text PRIMARY KEY)"))
+    db.session.commit()
+    upgrade(directory=MIGRATIONS)
+
+    # h(g, salt) is a stable pseudo-random integer in [0, 2^31) for row g
+    params = dict(volumes, seed=str(seed),
+                  password=generate_password_hash(BENCH_PASSWORD, method=password_method or 'pbkdf2:sha256:600000'))
+    statements = [
+        "CREATE FUNCTION pg_temp.h(g bigint, salt text) RETURNS bigint IMMUTABLE LANGUAGE sql AS "
+        "$$ SELECT abs(hashtext(g::text || ':' || salt || ':' || current_setting('bench.seed')))::bigint $$",
+        "SELECT set_config('bench.seed', :seed, false)",
+        "INSERT INTO subscription (heading, title, validity, price, course_offered, type) "
+        "SELECT 'Plan ' || g, 'plan' || g, '1 year', 500 + pg_temp.h(g, 'price') % 5000, "
+        "'Course material for plan ' || g, CASE WHEN g % 5 = 0 THEN 'premium' ELSE 'basic' END "
+        "FROM generate_series(1, :subscriptions) AS g",
+        # 40% premium subscribers, 10% awaiting approval, the rest without a plan; 1% with a reset token
+        "INSERT INTO \"user\" (fname, lastname, email, mobile_number, password, role, age, education, city, state, "
+        "subscription_id, transaction_id, reset_token, subscription_timestamp) "
+        "SELECT 'First' || g, 'Last' || g, 'user' || g || '@bench.test', '9' || lpad(g::text, 9, '0'), :password, "
+        "CASE WHEN pg_temp.h(g, 'kind') % 10 < 4 THEN 'premium' ELSE 'user' END, "
+        "16 + pg_temp.h(g, 'age') % 10, 'Class 12', 'City' || pg_temp.h(g, 'city') % 200, "
+        "'State' || pg_temp.h(g, 'state') % 30, "
+        "CASE WHEN pg_temp.h(g, 'kind') % 10 < 5 THEN 1 + pg_temp.h(g, 'plan') % :subscriptions END, "
+        "CASE WHEN pg_temp.h(g, 'kind') % 10 = 4 THEN 'TXN' || g END, "
+        "CASE WHEN pg_temp.h(g, 'reset') % 100 = 0 THEN 'reset' || g END, "
+        "timestamp '2024-01-01' + (pg_temp.h(g, 'since') % 730) * interval '1 day' "
+        "FROM generate_series(1, :users) AS g",
+        "INSERT INTO notification (user_id, subscription_id, notification_type, message, is_read, created_at) "
+        "SELECT u.id, u.subscription_id, 'Plan update', 'Notification ' || n || ' for user ' || u.id, "
+        "pg_temp.h(u.id * 1000 + n, 'read') % 4 <> 0, "
+        "timestamp '2026-01-01' - (n * 7 + pg_temp.h(u.id * 1000 + n, 'at') % 7) * interval '1 hour' "
+        "FROM \"user\" u CROSS JOIN generate_series(1, :notifications_per_user) AS n",
+        "INSERT INTO broadcast (subscription_id, notification_type, message, created_at) "
+        "SELECT s.id, s.title, 'Broadcast ' || n, timestamp '2026-01-01' - n * interval '1 day' "
+        "FROM subscription s CROSS JOIN generate_series(1, :broadcasts_per_subscription) AS n",
+        "INSERT INTO course_link (subscription_id, name, url) "
+        "SELECT s.id, 'Lecture ' || n, 'https://example.com/' || s.id || '/' || n "
+        "FROM subscription s CROSS JOIN generate_series(1, :links_per_subscription) AS n",
+        "INSERT INTO pdf (pdf_type, file_path, subscription_id, filename) "
+        "SELECT 'type' || n, 'bench/' || s.id || '/' || n || '.pdf', s.id, n || '.pdf' "
+        "FROM subscription s CROSS JOIN generate_series(1, :documents_per_subscription) AS n",
+        "INSERT INTO video (file_path, subscription_id, filename) "
+        "SELECT 'bench/' || s.id || '/video' || n || '.mp4', s.id, 'video' || n || '.mp4' "
+        "FROM subscription s CROSS JOIN generate_series(1, :videos_per_subscription) AS n",
+        "INSERT INTO notification_job (subscription_id, message, status, total, processed, created_at, finished_at) "
+        "SELECT s.id, 'Job ' || n, 'done', 2000, 2000, timestamp '2026-01-01' - n * interval '1 day', "
+        "timestamp '2026-01-01' - n * interval '1 day' + interval '1 minute' "
+        "FROM subscription s CROSS JOIN generate_series(1, :jobs_per_subscription) AS n",
+        # Mostly sent, 2% waiting and 1% given up on
+        "INSERT INTO outbound_email (recipient, subject, body, status, attempts, next_attempt_at, last_error, "
+        "created_at, sent_at) "
+        "SELECT 'user' || g || '@bench.test', 'Notice ' || g, 'Body ' || g, "
+        "CASE WHEN k < 2 THEN 'pending' WHEN k = 2 THEN 'failed' ELSE 'sent' END, "
+        "CASE WHEN k = 2 THEN 6 WHEN k < 2 THEN 0 ELSE 1 END, at, "
+        "CASE WHEN k = 2 THEN 'bench: mailbox unavailable' END, at, "
+        "CASE WHEN k > 2 THEN at + interval '5 seconds' END "
+        "FROM (SELECT g, pg_temp.h(g, 'mail') % 100 AS k, timestamp '2026-01-01' - g * interval '1 minute' AS at "
+        "FROM generate_series(1, :emails) AS g) AS e",
+    ]
+    for statement in statements:
+        db.session.execute(text(statement), params)
+    db.session.execute(text("INSERT INTO bench_dataset (key) VALUES (:key)"), {'key': dataset_key(volumes, seed)})
+    db.session.commit()
+    db.session.remove()
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.exec_driver_sql('VACUUM ANALYZE')
+
+
+def seed_audience(size, destroy=False):
+    # A single plan, plan1, with `size` premium subscribers and nothing else, for the fan-out and
+    # push benchmarks. Goes through seed() and its guard; the reassignment below no longer matches
+    # the dataset key, so the key is dropped and the next seed() rebuilds the rows.
+    empty = {name: 0 for name in DEFAULT_VOLUMES if name not in ('subscriptions', 'users')}
+    seed(dict(empty, subscriptions=1, users=size), destroy=destroy)
+    db.session.execute(text(
+        "UPDATE \"user\" SET role = 'premium', subscription_id = 1, transaction_id = NULL"
+    ))
+    db.session.execute(text("DELETE FROM bench_dataset"))
+    db.session.commit()
+    return 'plan1'
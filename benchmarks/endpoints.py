@@ -0,0 +1,303 @@
+"""Latency, throughput and queries per request for the API routes, on a deterministic dataset.
+
+The database is seeded by datagen.py (about 100k users, 50 plans and 2M notifications at
+--scale 1) and reused as long as the volumes and --seed match, so repeated runs measure the
+same rows. Seeding drops everything in the database: it only runs on an empty database or one
+an earlier run seeded, anything else is refused unless --destroy is given. The PDFs and videos
+the media scenarios download are written to --upload-folder.
+
+Every scenario is warmed up, then called --requests times from --concurrency threads through
+the test client; the report has p50/p95/p99 latency, requests per second and SQL statements
+per request.
+
+    python benchmarks/endpoints.py --database-url postgresql://localhost/bench --save-baseline baseline.json
+    python benchmarks/endpoints.py --database-url postgresql://localhost/bench --baseline baseline.json
+
+With --baseline the run exits with status 1 when a route's p95 is more than --threshold slower
+than the baseline, or when it issues more queries than before. Write routes change the data,
+so they only run with --include-writes, and the next run reseeds.
+
+Not covered here:
+  - the notification stream and large background fan-outs: notification_push.py and fanout.py
+  - exports and student imports: their cost is the row count, not the request
+  - resumable and form uploads: dominated by the body transfer
+  - single-row admin edits (add/update/delete-subscription, revoke_subscription, add and delete
+    course_links), profile updates, read marks, logout and /metrics: the bulk scenarios and
+    update_transaction cover the same statements
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+from app import create_app, db
+from datagen import BENCH_PASSWORD, NotABenchDatabase, dataset_key, scaled_volumes, seed, seeded_key
+
+SAMPLE_SIZE = 200  # Distinct users each scenario picks its ids from
+BULK_ITEMS = 20  # Per request to the bulk endpoints
+MEDIA_DOCUMENT_TYPES = 3  # get_docs asks for type1..typeN, so only those files are written
+MIN_REGRESSION_MS = 2.0  # Below this p95 difference, cached routes only show scheduler noise
+
+_counter = threading.local()
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    _counter.queries = getattr(_counter, 'queries', 0) + 1
+
+
+def sample_users(rng):
+    # Ids are drawn from the dataset itself, so the picks follow the seed rather than the generator's internals
+    def pick(where):
+        ids = db.session.execute(text(f'SELECT id FROM "user" WHERE {where} ORDER BY id LIMIT 5000')).scalars().all()
+        return rng.sample(ids, min(SAMPLE_SIZE, len(ids)))
+
+    subscribed = db.session.execute(text(
+        'SELECT u.id, s.title FROM "user" u JOIN subscription s ON s.id = u.subscription_id '
+        'WHERE u.role = \'premium\' ORDER BY u.id LIMIT 5000'
+    )).all()
+    viewers = db.session.execute(text(
+        'SELECT u.id, v.id FROM "user" u JOIN video v ON v.subscription_id = u.subscription_id '
+        'WHERE u.role = \'premium\' ORDER BY u.id, v.id LIMIT 5000'
+    )).all()
+    tokens = db.session.execute(text(
+        'SELECT reset_token FROM "user" WHERE reset_token IS NOT NULL ORDER BY id LIMIT 5000'
+    )).scalars().all()
+    rng.shuffle(tokens)
+    return {
+        'any': pick('true'),
+        'subscribed': rng.sample(subscribed, min(SAMPLE_SIZE, len(subscribed))),
+        'pending': pick("transaction_id IS NOT NULL AND role = 'user'"),
+        'free': pick('subscription_id IS NULL'),
+        'viewers': rng.sample(viewers, min(SAMPLE_SIZE, len(viewers))),
+        'reset_tokens': tokens,
+        'jobs': db.session.execute(text('SELECT id FROM notification_job ORDER BY id')).scalars().all(),
+        'links': db.session.execute(text('SELECT id FROM course_link ORDER BY id LIMIT 5000')).scalars().all(),
+    }
+
+
+def write_media_files(upload_folder, size, seed_value):
+    # The same bytes for every file; only what is missing or has the wrong size is (re)written
+    data = random.Random(seed_value).randbytes(size)
+    paths = db.session.execute(text(
+        "SELECT file_path FROM pdf WHERE pdf_type = ANY(:types) UNION ALL SELECT file_path FROM video"
+    ), {'types': [f'type{n}' for n in range(1, MEDIA_DOCUMENT_TYPES + 1)]}).scalars().all()
+    for relative in paths:
+        path = os.path.join(upload_folder, relative)
+        if os.path.exists(path) and os.path.getsize(path) == size:
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+
+def scenarios(users, plans, include_writes):
+    # name -> (method, function of rng returning (url, json body))
+    reads = {
+        'users_subscribed': ('GET', lambda rng: ('/users?status=subscribed', None)),
+        'users_by_plan': ('GET', lambda rng: (f'/users?status=subscribed&subscription=plan{rng.randint(1, plans)}', None)),
+        'users_all': ('GET', lambda rng: ('/users?status=all', None)),
+        'admin_dashboard': ('GET', lambda rng: ('/admin_dashboard', None)),
+        'get_subscriptions': ('GET', lambda rng: ('/get-subscriptions', None)),
+        'all_course_links': ('GET', lambda rng: ('/admin/all_course_links', None)),
+        'user_course_links': ('GET', lambda rng: (f"/user/course_links?user_id={rng.choice(users['subscribed'])[0]}", None)),
+        'user_notifications': ('GET', lambda rng: (f"/user/notifications/{rng.choice(users['any'])}", None)),
+        'unread_count': ('GET', lambda rng: (f"/user/notifications/{rng.choice(users['any'])}/unread_count", None)),
+        'user_profile': ('GET', lambda rng: (f"/user_profile/{rng.choice(users['any'])}", None)),
+        'get_resources': ('GET', lambda rng: ('/get-resources/{}/{}'.format(*rng.choice(users['subscribed'])), None)),
+        'get_docs': ('GET', lambda rng: ('/get_documents/type{}/{}'.format(
+            rng.randint(1, MEDIA_DOCUMENT_TYPES), rng.choice(users['subscribed'])[0]), None)),
+        'get_video': ('GET', lambda rng: ('/get_video/{1}/{0}'.format(*rng.choice(users['viewers'])), None)),
+        'notification_job': ('GET', lambda rng: (f"/admin/notification_jobs/{rng.choice(users['jobs'])}", None)),
+        'mail_queue': ('GET', lambda rng: ('/admin/mail_queue', None)),
+    }
+    if not include_writes:
+        return reads
+    # Calls are built in order before a scenario runs, so each reset uses the next token; at
+    # small scales the tokens repeat and the repeats answer 400
+    tokens = itertools.cycle(users['reset_tokens'])
+    writes = {
+        'login': ('POST', lambda rng: ('/login', {'email': f"user{rng.choice(users['any'])}@bench.test",
+                                                  'password': BENCH_PASSWORD})),
+        'update_transaction': ('POST', lambda rng: ('/update-transaction', {
+            'id': rng.choice(users['free']), 'subscription': f'plan{rng.randint(1, plans)}',
+            'transaction_id': f'BENCH{rng.randrange(10 ** 9)}'})),
+        'approve_transaction': ('POST', lambda rng: ('/admin/approve-transaction', {
+            'email': f"user{rng.choice(users['pending'])}@bench.test", 'approved': True})),
+        'send_notification': ('POST', lambda rng: ('/admin/send_notification', {
+            'message': 'Benchmark notice', 'subscription': f'plan{rng.randint(1, plans)}'})),
+        'register': ('POST', lambda rng: ('/register', {
+            'email': f'new{rng.randrange(10 ** 12)}@bench.test', 'password': BENCH_PASSWORD, 'fname': 'New',
+            'lastname': 'User', 'mobile_number': f'8{rng.randrange(10 ** 9):09d}', 'city': 'City1',
+            'state': 'State1'})),
+        'forgot_password': ('POST', lambda rng: ('/forgot-password', {
+            'email': f"user{rng.choice(users['any'])}@bench.test"})),
+        'reset_password': ('POST', lambda rng: (f'/reset-password/{next(tokens)}', {'new_password': BENCH_PASSWORD})),
+        'bulk_approve': ('POST', lambda rng: ('/admin/bulk/approve-transactions', {'items': [
+            {'email': f'user{user_id}@bench.test', 'approved': rng.random() < 0.8}
+            for user_id in rng.sample(users['pending'], min(BULK_ITEMS, len(users['pending'])))]})),
+        'bulk_revoke': ('POST', lambda rng: ('/admin/bulk/revoke-subscriptions', {'user_ids': [
+            user_id for user_id, _ in rng.sample(users['subscribed'], min(BULK_ITEMS, len(users['subscribed'])))]})),
+        'bulk_add_links': ('POST', lambda rng: ('/admin/bulk/course_links', {'items': [
+            {'subscription_id': rng.randint(1, plans), 'name': f'Bench link {n}',
+             'url': f'https://example.com/bench/{n}'}
+            for n in range(BULK_ITEMS)]})),
+        'bulk_delete_links': ('POST', lambda rng: ('/admin/bulk/course_links/delete', {
+            'ids': rng.sample(users['links'], min(BULK_ITEMS, len(users['links'])))})),
+    }
+    return dict(reads, **writes)
+
+
+def percentile(sorted_values, fraction):
+    # Nearest rank
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(app, method, build, requests, concurrency, warmup, seed_value):
+    calls = [build(random.Random(f'{seed_value}:{number}')) for number in range(warmup + requests)]
+    client = app.test_client()
+
+    def call(url_and_body):
+        url, body = url_and_body
+        _counter.queries = 0
+        started = time.perf_counter()
+        response = client.open(url, method=method, json=body)
+        response.get_data()
+        elapsed = time.perf_counter() - started
+        return elapsed, _counter.queries, response.status_code
+
+    for url_and_body in calls[:warmup]:
+        call(url_and_body)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.perf_counter()
+        samples = list(pool.map(call, calls[warmup:]))
+        wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed for elapsed, _, _ in samples)
+    statuses = sorted({status for _, _, status in samples})
+    return {
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'rps': len(samples) / wall,
+        'queries': sum(queries for _, queries, _ in samples) / len(samples),
+        'statuses': statuses,
+    }
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        slower = result['p95_ms'] - before['p95_ms']
+        if result['p95_ms'] > before['p95_ms'] * (1 + threshold) and slower > MIN_REGRESSION_MS:
+            regressions.append(f"{name}: p95 {before['p95_ms']:.1f} ms -> {result['p95_ms']:.1f} ms")
+        # Query counts are deterministic, any increase is a regression (an N+1 creeping back in)
+        if result['queries'] > before['queries'] + 0.01:
+            regressions.append(f"{name}: queries per request {before['queries']:.2f} -> {result['queries']:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--scale', type=float, default=1.0, help='fraction of the default 100k users')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reseed', action='store_true', help='rebuild the dataset even if it matches')
+    parser.add_argument('--destroy', action='store_true',
+                        help='allow seeding a database that holds other tables; everything in it is dropped')
+    parser.add_argument('--upload-folder', default=os.path.join(tempfile.gettempdir(), 'bench-uploads'),
+                        help='where the files for the media scenarios are written')
+    parser.add_argument('--media-size', type=int, default=256 * 1024, help='bytes per PDF and video')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--only', action='append', help='run just these scenarios (repeatable)')
+    parser.add_argument('--include-writes', action='store_true')
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--baseline', metavar='PATH')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed p95 slowdown against the baseline')
+    args = parser.parse_args()
+
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': args.database_url,
+        'DATABASE_REPLICA_URL': None,
+        'STORAGE_BACKEND': 'local',
+        'UPLOAD_FOLDER': args.upload_folder,
+        'UPLOAD_PARTS_FOLDER': None,
+        # Large enough that the send_notification scenario measures the inline fan-out
+        'FANOUT_BACKGROUND_THRESHOLD': 10 ** 9,
+    })
+    volumes = scaled_volumes(args.scale)
+    key = dataset_key(volumes, args.seed)
+    with app.app_context():
+        if args.reseed or seeded_key() != key:
+            print(f"Seeding {key} ...")
+            started = time.perf_counter()
+            try:
+                seed(volumes, args.seed, destroy=args.destroy)
+            except NotABenchDatabase as e:
+                parser.error(str(e))
+            print(f"Seeded in {time.perf_counter() - started:.1f}s")
+        write_media_files(args.upload_folder, args.media_size, args.seed)
+        users = sample_users(random.Random(args.seed))
+        db.session.remove()
+
+    selected = scenarios(users, volumes['subscriptions'], args.include_writes)
+    if args.only:
+        selected = {name: selected[name] for name in args.only}
+
+    results = {}
+    event.listen(Engine, 'before_cursor_execute', _count_query)
+    try:
+        print(f"\n{'scenario':<22} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'queries':>8}  status")
+        for name, (method, build) in selected.items():
+            result = run_scenario(app, method, build, args.requests, args.concurrency, args.warmup, args.seed)
+            results[name] = result
+            print(f"{name:<22} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+                  f"{result['rps']:>9.1f} {result['queries']:>8.2f}  {','.join(map(str, result['statuses']))}")
+    finally:
+        event.remove(Engine, 'before_cursor_execute', _count_query)
+
+    if args.include_writes:
+        # The writes changed the data, so the next run must not reuse it
+        with app.app_context():
+            db.session.execute(text('DELETE FROM bench_dataset'))
+            db.session.commit()
+
+    report = {'dataset': key, 'requests': args.requests, 'concurrency': args.concurrency, 'results': results}
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('dataset') != key:
+            print(f"\nWarning: baseline was recorded on {baseline.get('dataset')}, this run used {key}")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressions against {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline} (threshold {args.threshold:.0%})")
+
+
+if __name__ == '__main__':
+    main()
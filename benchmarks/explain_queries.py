@@ -0,0 +1,143 @@
+"""EXPLAIN ANALYZE for the SQL the read routes actually run, on a seeded dataset.
+
+Each route is called through the test client; every SELECT it issues is captured and
+re-run under EXPLAIN (ANALYZE, BUFFERS). With --compare the routes run twice, first with the
+route indexes of migration 0002 dropped and then with them rebuilt, and a timing summary is
+printed at the end. Only 0002 is undone, so later revisions such as 0003 stay applied.
+
+The dataset comes from datagen.py, which drops everything in the database: it only runs on an
+empty database or one a benchmark seeded, anything else is refused unless --destroy is given.
+
+    python benchmarks/explain_queries.py --database-url postgresql://localhost/bench --users 200000 --compare
+"""
+import argparse
+import importlib.util
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import event, select
+
+from app import create_app, db
+from app.catalog import catalog
+from app.models import Subscription, User
+from datagen import MIGRATIONS, NotABenchDatabase, scaled_volumes, seed
+
+ROUTE_INDEXES = os.path.join(MIGRATIONS, 'versions', '0002_indexes_for_route_queries.py')
+PLANS = 20
+
+
+def route_indexes(step):
+    """Run only migration 0002's 'upgrade' or 'downgrade' against the current schema."""
+    spec = importlib.util.spec_from_file_location('route_indexes', ROUTE_INDEXES)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    db.session.remove()
+    with db.engine.connect() as connection:
+        context = MigrationContext.configure(connection)
+        with Operations.context(context), context.begin_transaction():
+            getattr(migration, step)()
+        connection.exec_driver_sql('ANALYZE')
+        connection.commit()
+
+
+def route_calls(users):
+    # The first subscriber and a user halfway through the table, as the seed laid them out
+    subscribed, plan = db.session.execute(
+        select(User.id, Subscription.title).join(Subscription, User.subscription_id == Subscription.id)
+        .order_by(User.id).limit(1)
+    ).one()
+    db.session.remove()
+    return [
+        ('GET', f'/users?status=subscribed&subscription={plan}'),
+        ('GET', '/users?status=subscribed'),
+        ('GET', '/admin_dashboard'),
+        ('GET', f'/user/course_links?user_id={subscribed}'),
+        ('GET', f'/get-resources/{subscribed}/{plan}'),
+        ('GET', f'/get_documents/type3/{subscribed}'),
+        ('GET', f'/user/notifications/{users // 2}'),
+        ('GET', f'/user/notifications/{users // 2}/unread_count'),
+        ('GET', f'/user_profile/{users // 2}'),
+        ('POST', '/reset-password/no-such-token'),
+    ]
+
+
+def capture_selects(app, method, url):
+    captured = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            captured.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', on_execute)
+    try:
+        app.test_client().open(url, method=method, json={'new_password': 'x'} if method == 'POST' else None)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', on_execute)
+        # The request shares our app context, so its session outlives the request
+        db.session.remove()
+    return captured
+
+
+def explain(statement, parameters):
+    with db.engine.connect() as connection:
+        plan = connection.exec_driver_sql('EXPLAIN (ANALYZE, BUFFERS) ' + statement, parameters).scalars().all()
+        connection.rollback()
+    execution_ms = next(float(line.split(':')[1].split()[0]) for line in plan if line.startswith('Execution Time'))
+    return plan, execution_ms
+
+
+def run(app, calls, label):
+    timings = []
+    print(f"\n==================== {label} ====================")
+    for method, url in calls:
+        catalog.reset()
+        for number, (statement, parameters) in enumerate(capture_selects(app, method, url), 1):
+            plan, execution_ms = explain(statement, parameters)
+            timings.append((f"{method} {url} #{number}", execution_ms))
+            print(f"\n--- {method} {url}  query {number}: {execution_ms:.3f} ms")
+            print(statement)
+            print('\n'.join(plan))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--notifications-per-user', type=int, default=10)
+    parser.add_argument('--compare', action='store_true', help='also run on the schema without the 0002 indexes')
+    parser.add_argument('--destroy', action='store_true',
+                        help='allow seeding a database that holds other tables; everything in it is dropped')
+    args = parser.parse_args()
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database_url})
+    volumes = scaled_volumes(subscriptions=PLANS, users=args.users, notifications_per_user=args.notifications_per_user)
+    with app.app_context():
+        try:
+            seed(volumes, destroy=args.destroy)
+        except NotABenchDatabase as e:
+            parser.error(str(e))
+        calls = route_calls(args.users)
+        results = {}
+        if args.compare:
+            route_indexes('downgrade')
+            results['baseline'] = run(app, calls, 'without route indexes')
+            route_indexes('upgrade')
+        results['indexed'] = run(app, calls, 'with route indexes (0002)')
+
+    if args.compare:
+        print(f"\n{'query':<60} {'baseline ms':>12} {'indexed ms':>12}")
+        # Cached routes (the dashboard counters) can issue fewer statements on the second pass
+        baseline, indexed = dict(results['baseline']), dict(results['indexed'])
+        for name in dict.fromkeys([*baseline, *indexed]):
+            before, after = baseline.get(name), indexed.get(name)
+            print(f"{name:<60} {'-' if before is None else f'{before:.3f}':>12} "
+                  f"{'-' if after is None else f'{after:.3f}':>12}")
+
+
+if __name__ == '__main__':
+    main()
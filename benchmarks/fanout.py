@@ -0,0 +1,94 @@
+"""Throughput of /admin/send_notification fan-out strategies.
+
+Each audience is seeded through datagen.py, which drops everything in the database: it only
+runs on an empty database or one a benchmark seeded, anything else is refused unless --destroy
+is given.
+
+    python benchmarks/fanout.py --database-url postgresql://localhost/bench --sizes 1000 10000 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import text
+
+from app import create_app, db
+from app.fanout import _run_job, fan_out
+from app.models import Notification, NotificationJob, Subscription, User
+from datagen import NotABenchDatabase, seed_audience
+
+
+def clear_notifications():
+    db.session.execute(text('TRUNCATE notification'))
+    db.session.commit()
+
+
+def legacy(subscription, message):
+    # The original implementation: one ORM object per recipient
+    for user in User.query.filter_by(subscription_id=subscription.id).all():
+        db.session.add(Notification(
+            user_id=user.id,
+            subscription_id=subscription.id,
+            notification_type=subscription.title,
+            message=message
+        ))
+    db.session.commit()
+
+
+def insert_select(subscription, message):
+    fan_out(subscription, message)
+    db.session.commit()
+
+
+def background_job(app, subscription, message, size):
+    job = NotificationJob(subscription_id=subscription.id, message=message, total=size)
+    db.session.add(job)
+    db.session.commit()
+    _run_job(app, job.id)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--skip-legacy-above', type=int, default=100000,
+                        help='skip the ORM loop for audiences larger than this')
+    parser.add_argument('--destroy', action='store_true',
+                        help='allow seeding a database that holds other tables; everything in it is dropped')
+    args = parser.parse_args()
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database_url})
+    message = 'Exam results are out, check your dashboard.'
+
+    print(f"{'recipients':>10} {'strategy':>14} {'seconds':>9} {'rows/sec':>11}")
+    with app.app_context():
+        for size in args.sizes:
+            try:
+                title = seed_audience(size, destroy=args.destroy)
+            except NotABenchDatabase as e:
+                parser.error(str(e))
+            subscription = Subscription.query.filter_by(title=title).one()
+            strategies = [('insert-select', insert_select, (subscription, message)),
+                          ('chunked job', background_job, (app, subscription, message, size))]
+            if size <= args.skip_legacy_above:
+                strategies.insert(0, ('orm loop', legacy, (subscription, message)))
+
+            for name, fn, fn_args in strategies:
+                clear_notifications()
+                elapsed = timed(fn, *fn_args)
+                assert Notification.query.count() == size
+                print(f"{size:>10} {name:>14} {elapsed:>9.3f} {size / elapsed:>11.0f}")
+        db.session.remove()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""JSON encoding throughput and peak memory: Flask's stdlib provider versus orjson, and a
+fully built list response versus stream_json_array.
+
+The first part needs no database, it encodes synthetic /users-like rows (datetimes included):
+
+    python benchmarks/json_serialization.py --rows 200000
+
+With --database-url the course link catalog is seeded with --links rows through datagen.py and
+/admin/all_course_links is compared against building the same payload in memory first. Like
+endpoints.py, seeding refuses a database holding other tables unless --destroy is given:
+
+    python benchmarks/json_serialization.py --database-url postgresql://localhost/bench --links 200000
+
+Peak memory is measured with tracemalloc, so it covers Python allocations only.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import jsonify
+
+from app import create_app, db
+from app.models import CourseLink, Subscription
+from datagen import NotABenchDatabase, dataset_key, scaled_volumes, seed, seeded_key
+
+
+def synthetic_rows(count):
+    start = datetime(2024, 1, 1)
+    return [{
+        'id': number,
+        'name': f"First{number} Last{number}",
+        'email': f"user{number}@bench.test",
+        'mobile_number': f"9{number:09d}",
+        'subscription_name': f"Plan {number % 50}",
+        'subscription_start_date': start + timedelta(hours=number),
+        'expiry_date': start + timedelta(days=365, hours=number),
+        'days_left': number % 365
+    } for number in range(count)]
+
+
+def measure(work):
+    # (seconds, bytes produced, peak traced bytes); tracing slows Python down several times over,
+    # so time and memory come from separate runs
+    started = time.perf_counter()
+    size = work()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    work()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, size, peak
+
+
+def report(label, elapsed, size, peak, first_byte=None):
+    line = (f"{label:<34} {elapsed * 1000:>9.1f} ms {size / elapsed / 2 ** 20:>9.1f} MB/s "
+            f"{peak / 2 ** 20:>9.1f} MB peak")
+    if first_byte is not None:
+        line += f" {first_byte * 1000:>9.1f} ms to first byte"
+    print(line)
+
+
+def encode(serializer, datetime_format, rows):
+    app = create_app({'JSON_SERIALIZER': serializer, 'JSON_DATETIME_FORMAT': datetime_format,
+                      'DATABASE_REPLICA_URL': None})
+    with app.test_request_context():
+        jsonify({'users': rows})  # warm up
+        report(f"jsonify, {serializer}, {datetime_format} dates",
+               *measure(lambda: len(jsonify({'users': rows}).get_data())))
+
+
+def materialized_links():
+    # What the route did before streaming: every row loaded and encoded in one piece
+    links = db.session.query(
+        CourseLink.id, CourseLink.name, CourseLink.url, CourseLink.subscription_id, Subscription.heading
+    ).outerjoin(Subscription, CourseLink.subscription_id == Subscription.id).order_by(CourseLink.id).all()
+    links_data = [{'id': link.id, 'name': link.name, 'url': link.url, 'subscription_id': link.subscription_id,
+                   'subscription_name': link.heading} for link in links]
+    return len(jsonify({'links': links_data}).get_data())
+
+
+def streamed_links(client, timings):
+    started = time.perf_counter()
+    response = client.get('/admin/all_course_links', buffered=False)
+    size = 0
+    for chunk in response.response:
+        if not size:
+            timings['first_byte'] = time.perf_counter() - started
+        size += len(chunk)
+    response.close()
+    return size
+
+
+def compare_links(database_url, links, serializer, destroy=False):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url, 'DATABASE_REPLICA_URL': None,
+                      'JSON_SERIALIZER': serializer})
+    volumes = scaled_volumes(0.01, links_per_subscription=links // scaled_volumes()['subscriptions'])
+    with app.app_context():
+        if seeded_key() != dataset_key(volumes, 1):
+            seed(volumes, destroy=destroy)
+
+    with app.test_request_context():
+        materialized_links()
+        report(f"all_course_links built, {serializer}", *measure(materialized_links))
+        db.session.remove()
+
+    client = app.test_client()
+    timings = {}
+    streamed_links(client, timings)
+    elapsed, size, peak = measure(lambda: streamed_links(client, timings))
+    streamed_links(client, timings)
+    report(f"all_course_links streamed, {serializer}", elapsed, size, peak, first_byte=timings['first_byte'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--database-url')
+    parser.add_argument('--links', type=int, default=200000)
+    parser.add_argument('--destroy', action='store_true',
+                        help='allow seeding a database that holds other tables; everything in it is dropped')
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.rows)
+    # HTTP dates go through werkzeug on every value, ISO dates stay inside orjson
+    for serializer, datetime_format in (('stdlib', 'http'), ('orjson', 'http'), ('stdlib', 'iso'), ('orjson', 'iso')):
+        encode(serializer, datetime_format, rows)
+
+    if args.database_url:
+        for serializer in ('stdlib', 'orjson'):
+            try:
+                compare_links(args.database_url, args.links, serializer, args.destroy)
+            except NotABenchDatabase as e:
+                parser.error(str(e))
+
+
+if __name__ == '__main__':
+    main()
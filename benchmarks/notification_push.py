@@ -0,0 +1,115 @@
+"""DB queries per minute for N clients polling the inbox versus holding an SSE stream.
+
+The clients are seeded through datagen.py, which drops everything in the database: it only
+runs on an empty database or one a benchmark seeded, anything else is refused unless --destroy
+is given.
+
+    python benchmarks/notification_push.py --database-url postgresql://localhost/bench --clients 10 50 200
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import event
+
+from app import create_app, db
+from datagen import NotABenchDatabase, seed_audience
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+def poller(app, user_id, interval, stop):
+    client = app.test_client()
+    while not stop.is_set():
+        client.get(f'/user/notifications/{user_id}')
+        stop.wait(interval)
+
+
+def listener(app, user_id, received, stop):
+    client = app.test_client()
+    response = client.get(f'/user/notifications/{user_id}/stream', buffered=False)
+    chunks = iter(response.response)
+    try:
+        while not stop.is_set():
+            if next(chunks).startswith(b'event: notification'):
+                received.append(user_id)
+    finally:
+        response.close()
+
+
+def run(app, counter, clients, title, mode, args):
+    stop = threading.Event()
+    received = []
+    if mode == 'poll':
+        threads = [threading.Thread(target=poller, args=(app, user_id, args.poll_interval, stop))
+                   for user_id in range(1, clients + 1)]
+    else:
+        threads = [threading.Thread(target=listener, args=(app, user_id, received, stop))
+                   for user_id in range(1, clients + 1)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    time.sleep(1)
+
+    admin = app.test_client()
+    start_count = counter.count
+    start = time.perf_counter()
+    sends = 0
+    while time.perf_counter() - start < args.duration:
+        admin.post('/admin/send_notification', json={'message': f'update {sends}', 'subscription': title})
+        sends += 1
+        time.sleep(args.send_interval)
+    elapsed = time.perf_counter() - start
+    queries = counter.count - start_count
+
+    stop.set()
+    # Wake blocked streams so their threads exit
+    admin.post('/admin/send_notification', json={'message': 'stop', 'subscription': title})
+    return queries / elapsed * 60, sends, len(received)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--clients', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--duration', type=float, default=20, help='seconds per run')
+    parser.add_argument('--poll-interval', type=float, default=5, help='seconds between polls per client')
+    parser.add_argument('--send-interval', type=float, default=5, help='seconds between admin notifications')
+    parser.add_argument('--bus', choices=['memory', 'postgres'], default='memory')
+    parser.add_argument('--destroy', action='store_true',
+                        help='allow seeding a database that holds other tables; everything in it is dropped')
+    args = parser.parse_args()
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database_url, 'NOTIFICATION_BUS': args.bus,
+                      'SQLALCHEMY_ENGINE_OPTIONS': {'pool_size': 20, 'max_overflow': 200}})
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+
+    print(f"{'clients':>8} {'mode':>6} {'queries/min':>12} {'sends':>6} {'pushed':>7}")
+    for clients in args.clients:
+        with app.app_context():
+            try:
+                title = seed_audience(clients, destroy=args.destroy)
+            except NotABenchDatabase as e:
+                parser.error(str(e))
+            db.session.remove()
+        for mode in ('poll', 'sse'):
+            per_minute, sends, pushed = run(app, counter, clients, title, mode, args)
+            print(f"{clients:>8} {mode:>6} {per_minute:>12.0f} {sends:>6} {pushed if mode == 'sse' else '-':>7}")
+
+
+if __name__ == '__main__':
+    main()
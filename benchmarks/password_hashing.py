@@ -0,0 +1,71 @@
+"""Login throughput (password verifications per second) with hashing inline versus in the process pool.
+
+No database needed; concurrent logins are simulated with request threads:
+
+    python benchmarks/password_hashing.py --method pbkdf2:sha256:600000 --threads 8 --seconds 10
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from werkzeug.security import generate_password_hash
+
+from app import create_app
+from app.passwords import PasswordHasher
+
+
+def run(app, hasher, stored_hash, threads, seconds):
+    done = [0] * threads
+    deadline = time.monotonic() + seconds
+
+    def login(slot):
+        with app.app_context():
+            while time.monotonic() < deadline:
+                assert hasher.verify(stored_hash, 'correct horse')
+                done[slot] += 1
+
+    workers = [threading.Thread(target=login, args=(slot,)) for slot in range(threads)]
+    started = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sum(done) / (time.monotonic() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--method', default='pbkdf2:sha256:600000')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent login requests')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='hashing processes for the pool run')
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    app = create_app()
+    stored_hash = generate_password_hash('correct horse', method=args.method)
+    cores = os.cpu_count() or 1
+    print(f"method={args.method} threads={args.threads} cores={cores}")
+
+    for label, workers in (('inline', 0), (f'pool x{args.workers}', args.workers)):
+        hasher = PasswordHasher(args.method, workers, max_pending=args.threads)
+        if workers:
+            # Warm the pool so process start-up isn't timed
+            with app.app_context():
+                hasher.verify(stored_hash, 'correct horse')
+            hasher.stats.update(calls=0, queue_seconds_total=0.0, queue_seconds_max=0.0)
+        rate = run(app, hasher, stored_hash, args.threads, args.seconds)
+        line = f"{label:>12}: {rate:8.1f} logins/s  {rate / cores:7.1f} per core"
+        if workers:
+            calls = hasher.stats['calls'] or 1
+            line += (f"  queue avg {hasher.stats['queue_seconds_total'] / calls * 1000:.1f}ms"
+                     f" max {hasher.stats['queue_seconds_max'] * 1000:.1f}ms")
+        print(line)
+        hasher.shutdown()
+
+
+if __name__ == '__main__':
+    main()
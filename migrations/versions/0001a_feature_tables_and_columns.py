@@ -0,0 +1,146 @@
+"""tables and columns for the features added since the baseline
+
+New tables: dashboard counters, fan-out jobs, read-side broadcasts, the mail queue, cache
+versions, resumable upload sessions and content-addressed blobs. New columns on existing tables
+are nullable or carry a server default, so rows already in a production database stay valid:
+users start with a broadcast watermark of 0, existing notifications get the migration time as
+created_at, and files uploaded before blob storage keep blob_hash/filename NULL (they are served
+and deleted by path as before).
+
+The notification inbox index is built CONCURRENTLY, that table is the largest one.
+
+Revision ID: 0001a
+Revises: 0001
+Create Date: 2026-10-18 20:24:51.913204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001a'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('dashboard_stats',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('total_users', sa.Integer(), nullable=False),
+    sa.Column('total_premium_users', sa.Integer(), nullable=False),
+    sa.Column('pending_requests', sa.Integer(), nullable=False),
+    sa.Column('total_non_subscribers', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('notification_job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('subscription_id', sa.Integer(), nullable=False),
+    sa.Column('message', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('total', sa.Integer(), nullable=False),
+    sa.Column('processed', sa.Integer(), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['subscription_id'], ['subscription.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('broadcast',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('subscription_id', sa.Integer(), nullable=False),
+    sa.Column('notification_type', sa.String(length=100), nullable=False),
+    sa.Column('message', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text("timezone('utc', now())"), nullable=False),
+    sa.ForeignKeyConstraint(['subscription_id'], ['subscription.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('broadcast', schema=None) as batch_op:
+        batch_op.create_index('ix_broadcast_subscription_id_created_at', ['subscription_id', 'created_at', 'id'], unique=False)
+
+    op.create_table('outbound_email',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('recipient', sa.String(length=120), nullable=False),
+    sa.Column('subject', sa.String(length=255), nullable=False),
+    sa.Column('body', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('sent_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('outbound_email', schema=None) as batch_op:
+        batch_op.create_index('ix_outbound_email_pending', ['next_attempt_at'], unique=False, postgresql_where=sa.text("status = 'pending'"))
+
+    op.create_table('cache_version',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.create_table('upload_session',
+    sa.Column('id', sa.String(length=36), nullable=False),
+    sa.Column('subscription_id', sa.Integer(), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('file_type', sa.String(length=255), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['subscription_id'], ['subscription.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('blob',
+    sa.Column('hash', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('released_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('hash')
+    )
+    with op.batch_alter_table('blob', schema=None) as batch_op:
+        batch_op.create_index('ix_blob_unreferenced', ['released_at'], unique=False, postgresql_where=sa.text('ref_count <= 0'))
+
+    # Constant and stable defaults: Postgres 11+ adds these without rewriting the tables
+    op.add_column('user', sa.Column('broadcast_read_id', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('notification', sa.Column('created_at', sa.DateTime(), nullable=False,
+                                            server_default=sa.text("timezone('utc', now())")))
+
+    for table in ('pdf', 'video'):
+        op.add_column(table, sa.Column('blob_hash', sa.String(length=64), nullable=True))
+        op.add_column(table, sa.Column('filename', sa.String(length=255), nullable=True))
+        op.create_index(op.f(f'ix_{table}_blob_hash'), table, ['blob_hash'], unique=False)
+
+    with op.get_context().autocommit_block():
+        op.create_index('ix_notification_user_id_created_at', 'notification', ['user_id', 'created_at', 'id'],
+                        unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_notification_user_id_created_at', table_name='notification', postgresql_concurrently=True,
+                      if_exists=True)
+
+    for table in ('video', 'pdf'):
+        op.drop_index(op.f(f'ix_{table}_blob_hash'), table_name=table)
+        op.drop_column(table, 'filename')
+        op.drop_column(table, 'blob_hash')
+    op.drop_column('notification', 'created_at')
+    op.drop_column('user', 'broadcast_read_id')
+
+    with op.batch_alter_table('blob', schema=None) as batch_op:
+        batch_op.drop_index('ix_blob_unreferenced', postgresql_where=sa.text('ref_count <= 0'))
+
+    op.drop_table('blob')
+    op.drop_table('upload_session')
+    op.drop_table('cache_version')
+    with op.batch_alter_table('outbound_email', schema=None) as batch_op:
+        batch_op.drop_index('ix_outbound_email_pending', postgresql_where=sa.text("status = 'pending'"))
+
+    op.drop_table('outbound_email')
+    with op.batch_alter_table('broadcast', schema=None) as batch_op:
+        batch_op.drop_index('ix_broadcast_subscription_id_created_at')
+
+    op.drop_table('broadcast')
+    op.drop_table('notification_job')
+    op.drop_table('dashboard_stats')
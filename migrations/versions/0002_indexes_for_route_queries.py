@@ -0,0 +1,62 @@
+"""indexes for route queries
+
+Covers the lookups the routes actually make: users/videos/links/notifications by subscription,
+documents by (subscription, pdf_type), pending approvals, reset tokens, unread notifications,
+and plans by title (now unique).
+
+Indexes are built CONCURRENTLY so a live database keeps taking writes while this runs.
+
+Revision ID: 0002
+Revises: 0001a
+Create Date: 2026-10-18 19:34:17.261575
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001a'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    # (name, table, columns, partial index predicate)
+    ('ix_user_subscription_id', 'user', ['subscription_id'], None),
+    ('ix_user_pending_approval', 'user', ['id'], "transaction_id IS NOT NULL AND role = 'user'"),
+    ('ix_user_reset_token', 'user', ['reset_token'], 'reset_token IS NOT NULL'),
+    ('ix_course_link_subscription_id', 'course_link', ['subscription_id'], None),
+    ('ix_pdf_subscription_id_pdf_type', 'pdf', ['subscription_id', 'pdf_type'], None),
+    ('ix_video_subscription_id', 'video', ['subscription_id'], None),
+    ('ix_notification_subscription_id', 'notification', ['subscription_id'], None),
+    ('ix_notification_unread', 'notification', ['user_id'], 'is_read = false'),
+]
+
+
+def upgrade():
+    # Offline (--sql) there is no database to ask; building the unique index fails on duplicates instead
+    if not context.is_offline_mode():
+        duplicates = op.get_bind().execute(sa.text(
+            "SELECT title FROM subscription WHERE title IS NOT NULL GROUP BY title HAVING count(*) > 1"
+        )).scalars().all()
+        if duplicates:
+            raise RuntimeError(f"Rename duplicate subscription titles before upgrading: {', '.join(duplicates)}")
+
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True,
+                            postgresql_where=sa.text(where) if where else None, if_not_exists=True)
+
+        # Build the unique index without blocking writes, then attach it as the constraint
+        op.create_index('uq_subscription_title', 'subscription', ['title'], unique=True,
+                        postgresql_concurrently=True, if_not_exists=True)
+    op.execute('ALTER TABLE subscription ADD CONSTRAINT uq_subscription_title UNIQUE USING INDEX uq_subscription_title')
+
+
+def downgrade():
+    op.drop_constraint('uq_subscription_title', 'subscription', type_='unique')
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,28 @@
+"""user.updated_at for conditional GETs
+
+Validator for the /user_profile ETag. The default is stable, so on Postgres 11+ the
+column is added without rewriting the table; existing rows get the migration time.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 20:02:41.518304
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('updated_at', sa.DateTime(), nullable=False,
+                                    server_default=sa.text("timezone('utc', now())")))
+
+
+def downgrade():
+    op.drop_column('user', 'updated_at')
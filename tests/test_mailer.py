@@ -0,0 +1,237 @@
+"""The outbound email queue against a local SMTP stub: queueing, SKIP LOCKED claims and retries.
+
+Needs a scratch database in TEST_DATABASE_URL (its tables are dropped and recreated); skipped
+without one.
+"""
+import os
+import socketserver
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+if not os.getenv('TEST_DATABASE_URL'):
+    pytest.skip('TEST_DATABASE_URL is not set', allow_module_level=True)
+
+from sqlalchemy import text, update
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db, mailer
+from app.models import OutboundEmail, User
+
+
+class SMTPStub(socketserver.ThreadingTCPServer):
+    # Just enough of RFC 5321 for smtplib: no TLS, no auth, recipients in `reject` get a 550
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.messages = []
+        self.connections = 0
+        self.reject = set()
+        self.greeting_delay = 0
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        time.sleep(server.greeting_delay)
+        self.reply('220 stub ESMTP')
+        recipients = []
+        while line := self.rfile.readline():
+            command = line.decode().strip()
+            verb = command.split(' ', 1)[0].split(':', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 stub')
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipient = command.split(':', 1)[1].strip().strip('<>')
+                if recipient in server.reject:
+                    self.reply('550 mailbox unavailable')
+                else:
+                    recipients.append(recipient)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 end with .')
+                body = []
+                while (data := self.rfile.readline()) not in (b'.\r\n', b''):
+                    body.append(data)
+                server.messages.append((recipients, b''.join(body).decode()))
+                self.reply('250 queued')
+            elif verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:  # RSET, NOOP
+                self.reply('250 OK')
+
+
+@pytest.fixture
+def smtp():
+    server = SMTPStub()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def app(smtp):
+    with mock.patch.dict(os.environ, {'APP_ENV': 'testing'}):
+        app = create_app({
+            'DATABASE_REPLICA_URL': None,
+            'MAIL_SERVER': '127.0.0.1',
+            'MAIL_PORT': smtp.port,
+            'MAIL_USE_TLS': False,
+            'MAIL_USERNAME': None,
+            'MAIL_SENDER': 'noreply@test.example',
+        })
+    with app.app_context():
+        db.drop_all(bind_key=None)
+        db.create_all(bind_key=None)
+        db.session.remove()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all(bind_key=None)
+
+
+def queue(*recipients):
+    emails = [OutboundEmail(recipient=recipient, subject='Subject', body=f'Body for {recipient}')
+              for recipient in recipients]
+    db.session.add_all(emails)
+    db.session.commit()
+    return [email.id for email in emails]
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.05)
+
+
+def test_request_queues_email_without_waiting_on_smtp(app, smtp):
+    smtp.greeting_delay = 2
+    with app.app_context():
+        db.session.add(User(fname='Test', lastname='User', email='user@test.example', mobile_number='9000000001',
+                            password=generate_password_hash('x', method=app.config['PASSWORD_HASH_METHOD']),
+                            city='Pune', state='MH'))
+        db.session.commit()
+
+    started = []
+    start_workers = mailer.start_workers
+
+    def record(*args):
+        started.append(start_workers(*args))
+        return started[-1]
+
+    app.config['MAIL_IN_PROCESS_WORKERS'] = 1
+    with mock.patch.object(mailer, '_in_process_started', False), \
+            mock.patch.object(mailer, 'start_workers', record):
+        try:
+            begun = time.monotonic()
+            response = app.test_client().post('/forgot-password', json={'email': 'user@test.example'})
+            elapsed = time.monotonic() - begun
+
+            assert response.status_code == 200
+            assert elapsed < smtp.greeting_delay
+            assert smtp.messages == []
+            with app.app_context():
+                email = OutboundEmail.query.one()
+                assert (email.recipient, email.status) == ('user@test.example', 'pending')
+                db.session.remove()
+
+            # The in-process worker the request started delivers it once the server answers
+            wait_for(lambda: smtp.messages)
+            assert smtp.messages[0][0] == ['user@test.example']
+            assert 'Subject: Password Reset Request' in smtp.messages[0][1]
+        finally:
+            for stop, _ in started:
+                stop.set()
+            for _, threads in started:
+                for thread in threads:
+                    thread.join(timeout=10)
+
+
+def test_worker_sends_a_batch_over_one_connection(app, smtp):
+    with app.app_context():
+        ids = queue('a@test.example', 'b@test.example', 'c@test.example')
+        connection = mailer.SMTPConnection(app)
+        try:
+            assert mailer.process_batch(app, connection) == 3
+            assert mailer.process_batch(app, connection) == 0
+        finally:
+            connection.close()
+
+        assert sorted(recipients[0] for recipients, _ in smtp.messages) == [
+            'a@test.example', 'b@test.example', 'c@test.example']
+        assert smtp.connections == 1
+        emails = OutboundEmail.query.filter(OutboundEmail.id.in_(ids)).all()
+        assert {(email.status, email.attempts) for email in emails} == {('sent', 1)}
+        assert all(email.sent_at is not None for email in emails)
+
+
+def test_claims_skip_rows_locked_by_another_worker(app):
+    with app.app_context():
+        ids = queue('a@test.example', 'b@test.example', 'c@test.example', 'd@test.example')
+        with db.engine.connect() as other_worker:
+            # Another worker is in the middle of claiming the first two
+            other_worker.execute(text('SELECT id FROM outbound_email WHERE id = ANY(:ids) FOR UPDATE'),
+                                 {'ids': ids[:2]})
+
+            claimed = mailer.claim_batch()
+            assert sorted(email.id for email in claimed) == ids[2:]
+            # Leased, so a second claim finds nothing while they are being sent
+            assert mailer.claim_batch() == []
+            other_worker.rollback()
+
+        assert sorted(email.id for email in mailer.claim_batch()) == ids[:2]
+
+
+def test_failed_sends_are_retried_with_backoff_then_given_up(app, smtp):
+    smtp.reject.add('bounce@test.example')
+    with app.app_context():
+        good, bad = queue('good@test.example', 'bounce@test.example')
+        connection = mailer.SMTPConnection(app)
+        try:
+            before = datetime.utcnow()
+            assert mailer.process_batch(app, connection) == 2
+
+            assert [recipients for recipients, _ in smtp.messages] == [['good@test.example']]
+            assert db.session.get(OutboundEmail, good).status == 'sent'
+            email = db.session.get(OutboundEmail, bad)
+            assert (email.status, email.attempts) == ('pending', 1)
+            assert '550' in email.last_error
+            assert email.next_attempt_at >= before + timedelta(seconds=mailer.backoff_delay(1))
+            # Not due until the backoff has passed
+            assert mailer.process_batch(app, connection) == 0
+
+            # The last allowed attempt fails for good
+            db.session.execute(update(OutboundEmail).where(OutboundEmail.id == bad).values(
+                attempts=mailer.MAX_ATTEMPTS - 1, next_attempt_at=datetime.utcnow()))
+            db.session.commit()
+            assert mailer.process_batch(app, connection) == 1
+        finally:
+            connection.close()
+
+        db.session.expire_all()
+        email = db.session.get(OutboundEmail, bad)
+        assert (email.status, email.attempts) == ('failed', mailer.MAX_ATTEMPTS)
+        assert len(smtp.messages) == 1
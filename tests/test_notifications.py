@@ -0,0 +1,160 @@
+"""The WhatsApp dispatcher against a fake Twilio endpoint: rate limiting, digests and retries.
+
+The fake is an aiohttp server on its own event loop; TWILIO_API_BASE points the dispatcher at
+it. No database is involved.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+from aiohttp import web
+from flask import Flask
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.notifications import MAX_SEND_ATTEMPTS, TokenBucket, WhatsAppDispatcher, build_digest
+
+ADMIN = 'whatsapp:+10000000000'
+
+
+class FakeTwilio:
+    # Records each Messages.json POST; `statuses` are answered in order, then 201
+
+    def __init__(self):
+        self.requests = []
+        self.statuses = []
+        self.base_url = None
+        self._loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    async def messages(self, request):
+        form = await request.post()
+        self.requests.append((time.monotonic(), request.match_info['sid'], dict(form)))
+        status = self.statuses.pop(0) if self.statuses else 201
+        if status >= 300:
+            return web.json_response({'message': 'fake error'}, status=status)
+        return web.json_response({'sid': f'SM{len(self.requests)}'}, status=status)
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        app = web.Application()
+        app.router.add_post('/2010-04-01/Accounts/{sid}/Messages.json', self.messages)
+        self._runner = web.AppRunner(app)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        self._loop.run_until_complete(site.start())
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f'http://127.0.0.1:{port}'
+        self._started.set()
+        self._loop.run_forever()
+
+    def start(self):
+        self._thread.start()
+        self._started.wait(10)
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+
+    def bodies(self):
+        return [(form['To'], form['Body']) for _, _, form in self.requests]
+
+
+@pytest.fixture
+def twilio():
+    fake = FakeTwilio()
+    fake.start()
+    yield fake
+    fake.stop()
+
+
+def make_dispatcher(twilio, **config):
+    app = Flask(__name__)
+    app.config.update({
+        'TWILIO_ACCOUNT_SID': 'ACtest',
+        'TWILIO_AUTH_TOKEN': 'token',
+        'TWILIO_API_BASE': twilio.base_url,
+        'WHATSAPP_FROM': 'whatsapp:+14155238886',
+        'WHATSAPP_ADMIN_TO': ADMIN,
+        'WHATSAPP_RATE_PER_SECOND': 100.0,
+        'WHATSAPP_BURST': 10,
+        'WHATSAPP_CONCURRENCY': 4,
+        'WHATSAPP_DIGEST_SECONDS': 0,
+    }, **config)
+    return WhatsAppDispatcher(app)
+
+
+def test_token_bucket_allows_a_burst_then_holds_the_rate():
+    async def acquire_all():
+        bucket = TokenBucket(rate=10, capacity=2)
+        times = []
+        for _ in range(5):
+            await bucket.acquire()
+            times.append(time.monotonic())
+        return times
+
+    times = asyncio.run(acquire_all())
+    assert times[1] - times[0] < 0.05
+    # Three more tokens at 10 per second after the burst of two
+    assert times[4] - times[0] >= 0.28
+
+
+def test_sends_are_rate_limited(twilio):
+    dispatcher = make_dispatcher(twilio, WHATSAPP_RATE_PER_SECOND=10.0, WHATSAPP_BURST=1)
+    for number in range(4):
+        dispatcher.submit(f'message {number}', digest=False)
+    dispatcher.close()
+
+    assert dispatcher.sent == 4
+    times = sorted(at for at, _, _ in twilio.requests)
+    assert times[-1] - times[0] >= 0.28
+    assert {sid for _, sid, _ in twilio.requests} == {'ACtest'}
+
+
+def test_alerts_within_the_window_are_coalesced_per_recipient(twilio):
+    dispatcher = make_dispatcher(twilio, WHATSAPP_DIGEST_SECONDS=1)
+    for body in ('first', 'second', 'third'):
+        dispatcher.submit(body)
+    dispatcher.submit('for someone else', to='whatsapp:+19999999999')
+    dispatcher.submit('urgent', digest=False)
+
+    # Undigested messages go out straight away, the rest when the window closes
+    deadline = time.monotonic() + 0.5
+    while not twilio.requests and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert twilio.bodies() == [(ADMIN, 'urgent')]
+    time.sleep(1.5)
+    dispatcher.close()
+
+    assert sorted(twilio.bodies()) == sorted([
+        (ADMIN, 'urgent'),
+        (ADMIN, build_digest(['first', 'second', 'third'])),
+        ('whatsapp:+19999999999', 'for someone else'),
+    ])
+    assert build_digest(['first', 'second', 'third']) == '3 updates:\n- first\n- second\n- third'
+
+
+def test_server_errors_are_retried(twilio):
+    twilio.statuses = [503]
+    dispatcher = make_dispatcher(twilio)
+    dispatcher.submit('retried', digest=False)
+    dispatcher.close()
+
+    assert twilio.bodies() == [(ADMIN, 'retried'), (ADMIN, 'retried')]
+    assert (dispatcher.sent, dispatcher.failed) == (1, 0)
+
+
+def test_client_errors_are_not_retried_and_exhausted_retries_fail(twilio):
+    twilio.statuses = [400] + [429] * MAX_SEND_ATTEMPTS
+    dispatcher = make_dispatcher(twilio)
+    dispatcher.submit('rejected', digest=False)
+    dispatcher.submit('throttled', digest=False)
+    dispatcher.close(timeout=30)
+
+    assert (dispatcher.sent, dispatcher.failed) == (0, 2)
+    assert len(twilio.requests) == 1 + MAX_SEND_ATTEMPTS
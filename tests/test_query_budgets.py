@@ -0,0 +1,150 @@
+"""Every endpoint that declares a @query_budget stays within it, with QUERY_BUDGET_MODE='raise'.
+
+Each request runs against freshly seeded tables with the subscription catalog cold and the
+Postgres notification bus, the most statements a request can issue. Needs a scratch database
+in TEST_DATABASE_URL (its tables are dropped and recreated); skipped without one.
+
+    TEST_DATABASE_URL=postgresql://localhost/admissionfirst_test python -m pytest tests
+"""
+import os
+import sys
+from unittest import mock
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+if not os.getenv('TEST_DATABASE_URL'):
+    pytest.skip('TEST_DATABASE_URL is not set', allow_module_level=True)
+
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db
+from app.budgets import endpoint_budgets
+from app.catalog import catalog
+from app.counters import get_dashboard_counts
+from app.models import (PDF, Broadcast, CourseLink, Notification, NotificationJob, OutboundEmail, Subscription,
+                        User, Video)
+
+PASSWORD = 'test-password'
+
+# (endpoint, method, url, json body); ids are those seed() creates on empty tables
+CASES = [
+    ('main.register', 'POST', '/register', {
+        'email': 'new@test.example', 'password': PASSWORD, 'fname': 'New', 'lastname': 'User',
+        'mobile_number': '9000000009', 'city': 'Pune', 'state': 'MH'}),
+    ('main.login', 'POST', '/login', {'email': 'premium@test.example', 'password': PASSWORD}),
+    ('main.get_users', 'GET', '/users?status=all&include_total=true', None),
+    ('main.get_users', 'GET', '/users?status=subscribed&subscription=plan1', None),
+    ('main.revoke_subscription', 'POST', '/revoke_subscription', {'user_id': 1}),
+    ('main.update_transaction', 'POST', '/update-transaction', {
+        'id': 3, 'subscription': 'plan2', 'transaction_id': 'TXN3'}),
+    ('main.admin_dashboard', 'GET', '/admin_dashboard', None),
+    ('main.admin_dashboard', 'GET', '/admin_dashboard?refresh=true', None),
+    ('main.add_course_link', 'POST', '/admin/course_links', {
+        'subscription_id': 1, 'name': 'Lecture 3', 'url': 'https://example.com/3'}),
+    ('main.delete_course_link', 'DELETE', '/admin/course_links/1', None),
+    ('main.get_course_links', 'GET', '/user/course_links?user_id=1', None),
+    ('main.send_notification', 'POST', '/admin/send_notification', {'message': 'Hello', 'subscription': 'plan1'}),
+    ('main.get_notification_job', 'GET', '/admin/notification_jobs/1', None),
+    ('main.get_user_notifications', 'GET', '/user/notifications/1', None),
+    ('main.get_unread_count', 'GET', '/user/notifications/1/unread_count', None),
+    ('main.mark_user_notifications_read', 'POST', '/user/notifications/1/read', {'ids': [1, 2]}),
+    ('main.mark_user_notifications_read', 'POST', '/user/notifications/1/read', {}),
+    ('main.mark_user_broadcasts_read', 'POST', '/user/notifications/1/broadcasts/read', {}),
+    ('main.mark_user_broadcasts_read', 'POST', '/user/notifications/1/broadcasts/read', {'up_to': '99'}),
+    ('main.get_docs', 'GET', '/get_documents/notes/1', None),
+    ('main.get_video', 'GET', '/get_video/1/1', None),
+    ('main.get_all_subscriptions', 'GET', '/get-subscriptions', None),
+    ('main.add_new_subscription', 'POST', '/add-subscription', {
+        'heading': 'Plan 3', 'title': 'plan3', 'validity': '1 year', 'price': 300, 'course_offered': 'Course 3'}),
+    ('main.update_subscription', 'PUT', '/update-subscription/plan1', {'price': 150}),
+    ('main.approve_transaction', 'POST', '/admin/approve-transaction', {'email': 'pending@test.example', 'approved': True}),
+    ('main.approve_transaction', 'POST', '/admin/approve-transaction', {'email': 'pending@test.example', 'approved': False}),
+    ('main.bulk_approve_transactions', 'POST', '/admin/bulk/approve-transactions', {'items': [
+        {'email': 'pending@test.example', 'approved': True}, {'email': 'premium@test.example', 'approved': False},
+        {'email': 'missing@test.example', 'approved': True}]}),
+    ('main.bulk_revoke_subscriptions', 'POST', '/admin/bulk/revoke-subscriptions', {'user_ids': [1, 2, 99]}),
+    ('main.bulk_add_course_links', 'POST', '/admin/bulk/course_links', {'items': [
+        {'subscription_id': 1, 'name': 'Lecture 3', 'url': 'https://example.com/3'},
+        {'subscription_id': 99, 'name': 'Lecture 4', 'url': 'https://example.com/4'}]}),
+    ('main.bulk_delete_course_links', 'POST', '/admin/bulk/course_links/delete', {'ids': [1, 2, 99]}),
+    ('main.user_detail', 'GET', '/user_profile/1', None),
+    ('main.user_detail', 'PUT', '/user_profile/1', {'city': 'Nashik'}),
+    ('main.get_resources', 'GET', '/get-resources/1/plan1', None),
+    ('main.forgot_password', 'POST', '/forgot-password', {'email': 'premium@test.example'}),
+    ('main.get_mail_queue_stats', 'GET', '/admin/mail_queue', None),
+    ('main.reset_password', 'POST', '/reset-password/reset-token', {'new_password': PASSWORD}),
+]
+
+
+@pytest.fixture(scope='module', params=['write', 'read'])
+def app(request, tmp_path_factory):
+    with mock.patch.dict(os.environ, {'APP_ENV': 'testing'}):
+        app = create_app({
+            'QUERY_BUDGET_MODE': 'raise',
+            'DATABASE_REPLICA_URL': None,  # Only the primary is seeded; test_replicas.py covers routing
+            'NOTIFICATION_FANOUT_MODE': request.param,
+            'NOTIFICATION_BUS': 'postgres',
+            'UPLOAD_FOLDER': str(tmp_path_factory.mktemp('uploads')),
+        })
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all(bind_key=None)
+
+
+def seed(app):
+    db.drop_all(bind_key=None)
+    db.create_all(bind_key=None)
+    password = generate_password_hash(PASSWORD, method=app.config['PASSWORD_HASH_METHOD'])
+    plans = [Subscription(heading=f'Plan {n}', title=f'plan{n}', validity='1 year', price=100 * n,
+                          course_offered=f'Course {n}') for n in (1, 2)]
+    db.session.add_all(plans)
+    db.session.flush()
+
+    def user(number, email, **values):
+        return User(fname='Test', lastname=str(number), email=email, mobile_number=f'900000000{number}',
+                    password=password, city='Pune', state='MH', **values)
+
+    db.session.add_all([
+        user(1, 'premium@test.example', role='premium', subscription_id=plans[0].id),
+        user(2, 'pending@test.example', role='user', subscription_id=plans[0].id, transaction_id='TXN2'),
+        user(3, 'free@test.example', role='user', reset_token='reset-token'),
+    ])
+    db.session.flush()
+    db.session.add_all([CourseLink(subscription_id=plans[0].id, name=f'Lecture {n}', url=f'https://example.com/{n}')
+                        for n in (1, 2)])
+    db.session.add_all([Notification(user_id=1, subscription_id=plans[0].id, notification_type='plan1',
+                                     message=f'Message {n}') for n in (1, 2, 3)])
+    db.session.add(Broadcast(subscription_id=plans[0].id, notification_type='plan1', message='Broadcast'))
+    db.session.add(NotificationJob(subscription_id=plans[0].id, message='Job', status='done', total=1, processed=1))
+    db.session.add(OutboundEmail(recipient='premium@test.example', subject='Subject', body='Body'))
+
+    for relative in ('plan1/notes.pdf', 'plan1/intro.mp4'):
+        path = os.path.join(app.config['UPLOAD_FOLDER'], relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'%PDF-1.4 test' if relative.endswith('.pdf') else b'\x00' * 1024)
+    db.session.add(PDF(pdf_type='notes', file_path='plan1/notes.pdf', filename='notes.pdf', subscription_id=plans[0].id))
+    db.session.add(Video(file_path='plan1/intro.mp4', filename='intro.mp4', subscription_id=plans[0].id))
+    db.session.commit()
+    get_dashboard_counts(refresh=True)
+    db.session.remove()
+
+
+def test_every_budgeted_endpoint_has_a_case(app):
+    assert {endpoint for endpoint, *_ in CASES} == set(endpoint_budgets(app))
+
+
+@pytest.mark.parametrize('endpoint, method, url, body', CASES, ids=[f'{case[0]} {case[1]} {case[2]}' for case in CASES])
+def test_endpoint_stays_within_budget(app, endpoint, method, url, body):
+    assert app.url_map.bind('localhost').match(url.split('?')[0], method=method)[0] == endpoint
+    with app.app_context():
+        seed(app)
+    catalog.reset()
+
+    # QueryBudgetExceeded propagates out of the test client and fails the test with the statements
+    response = app.test_client().open(url, method=method, json=body)
+
+    assert response.status_code < 400, response.get_data(as_text=True)
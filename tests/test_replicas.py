@@ -0,0 +1,127 @@
+"""Read/write routing between the primary and the replica bind.
+
+Needs two scratch databases: TEST_DATABASE_URL for the primary and TEST_DATABASE_REPLICA_URL
+standing in for the replica (both have their tables dropped and recreated); skipped without
+them. Every statement is attributed to the engine that ran it.
+
+    export TEST_DATABASE_URL=postgresql://localhost/admissionfirst_test
+    export TEST_DATABASE_REPLICA_URL=postgresql://localhost/admissionfirst_test_replica
+    python -m pytest tests
+"""
+import os
+import sys
+from unittest import mock
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+if not (os.getenv('TEST_DATABASE_URL') and os.getenv('TEST_DATABASE_REPLICA_URL')):
+    pytest.skip('TEST_DATABASE_URL and TEST_DATABASE_REPLICA_URL are not both set', allow_module_level=True)
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app import create_app, db
+from app.counters import get_dashboard_counts
+from app.models import Notification, Subscription, User
+from app.replicas import REPLICA_BIND, use_replica
+
+
+def populate(session):
+    # The same rows on both sides, as replication would leave them
+    plan = Subscription(heading='Plan 1', title='plan1', validity='1 year', price=100, course_offered='Course 1')
+    session.add(plan)
+    session.flush()
+    session.add_all([
+        User(fname='Test', lastname=str(number), email=f'user{number}@test.example', mobile_number=f'90000000{number}',
+             password='x', city='Pune', state='MH', role=role, subscription_id=plan.id, transaction_id=transaction)
+        for number, role, transaction in ((1, 'premium', None), (2, 'user', 'TXN2'))
+    ])
+    session.commit()
+
+
+@pytest.fixture
+def app():
+    with mock.patch.dict(os.environ, {'APP_ENV': 'testing'}):
+        app = create_app({'DATABASE_REPLICA_URL': os.environ['TEST_DATABASE_REPLICA_URL']})
+    with app.app_context():
+        for engine in db.engines.values():
+            db.metadata.drop_all(engine)
+            db.metadata.create_all(engine)
+        populate(db.session)
+        get_dashboard_counts()
+        db.session.remove()
+        with Session(db.engines[REPLICA_BIND]) as replica:
+            populate(replica)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            db.metadata.drop_all(engine)
+
+
+@pytest.fixture
+def statements(app):
+    # {'primary': [...], 'replica': [...]} of the SQL each engine ran
+    ran = {'primary': [], 'replica': []}
+    with app.app_context():
+        engines = {'primary': db.engines[None], 'replica': db.engines[REPLICA_BIND]}
+    listeners = []
+    for name, engine in engines.items():
+        def record(conn, cursor, statement, parameters, context, executemany, name=name):
+            ran[name].append(statement)
+        event.listen(engine, 'before_cursor_execute', record)
+        listeners.append((engine, record))
+    yield ran
+    for engine, record in listeners:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def test_get_users_reads_from_the_replica(app, statements):
+    response = app.test_client().get('/users?status=all&include_total=true')
+
+    assert response.status_code == 200
+    assert len(response.json['users']) == 2
+    assert statements['replica'] and not statements['primary']
+
+
+def test_exports_read_from_the_replica(app, statements):
+    response = app.test_client().get('/admin/export/users?format=csv')
+
+    assert response.status_code == 200
+    assert len(response.get_data(as_text=True).splitlines()) == 3  # header and two users
+    assert statements['replica'] and not statements['primary']
+
+
+def test_dashboard_stays_on_the_primary(app, statements):
+    # The counter cache is written on refresh and pending approvals must not lag, so no replica
+    for url in ('/admin_dashboard', '/admin_dashboard?refresh=true'):
+        response = app.test_client().get(url)
+        assert response.status_code == 200
+        assert response.json['total_pending_requests'] == 1
+    assert statements['primary'] and not statements['replica']
+
+
+def test_writes_go_to_the_primary(app, statements):
+    response = app.test_client().post('/revoke_subscription', json={'user_id': 1})
+
+    assert response.status_code == 200
+    assert any(statement.startswith('UPDATE') for statement in statements['primary'])
+    assert not statements['replica']
+
+
+def test_flushes_inside_use_replica_go_to_the_primary(app, statements):
+    with app.app_context():
+        with use_replica():
+            user_id = db.session.execute(select(User.id).where(User.email == 'user1@test.example')).scalar()
+            db.session.add(Notification(user_id=user_id, notification_type='plan1', message='Hello'))
+            db.session.commit()
+        db.session.remove()
+
+        assert [statement for statement in statements['replica'] if statement.startswith('SELECT')]
+        assert [statement for statement in statements['primary'] if statement.startswith('INSERT')]
+        assert not [statement for statement in statements['replica'] if not statement.startswith('SELECT')]
+        assert db.session.query(Notification).count() == 1
+        with Session(db.engines[REPLICA_BIND]) as replica:
+            assert replica.query(Notification).count() == 0
@@ -0,0 +1,143 @@
+"""STORAGE_BACKEND='s3' against a moto-mocked bucket: uploads land in the bucket and downloads
+are presigned URLs.
+
+Needs a scratch database in TEST_DATABASE_URL (its tables are dropped and recreated) and moto
+(requirements-dev.txt); skipped without either.
+"""
+import hashlib
+import io
+import os
+import sys
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+if not os.getenv('TEST_DATABASE_URL'):
+    pytest.skip('TEST_DATABASE_URL is not set', allow_module_level=True)
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db
+from app.blobstore import blob_key
+from app.catalog import catalog
+from app.models import PDF, Subscription, User, Video
+
+BUCKET = 'test-media'
+PREFIX = 'media/'
+PDF_BYTES = b'%PDF-1.4 ' + b'x' * 4096
+VIDEO_BYTES = b'\x00\x01' * 8192
+
+
+@pytest.fixture
+def app(tmp_path):
+    with moto.mock_aws(), mock.patch.dict(os.environ, {'APP_ENV': 'testing'}):
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=BUCKET)
+        app = create_app({
+            'DATABASE_REPLICA_URL': None,
+            'STORAGE_BACKEND': 's3',
+            'S3_BUCKET': BUCKET,
+            'S3_PREFIX': PREFIX,
+            'S3_REGION': 'us-east-1',
+            'S3_ACCESS_KEY_ID': 'testing',
+            'S3_SECRET_ACCESS_KEY': 'testing',
+            'UPLOAD_FOLDER': str(tmp_path / 'spool'),
+            'UPLOAD_PARTS_FOLDER': str(tmp_path / 'parts'),
+        })
+        with app.app_context():
+            db.drop_all(bind_key=None)
+            db.create_all(bind_key=None)
+            subscription = Subscription(heading='Plan 1', title='plan1', validity='1 year', price=100,
+                                        course_offered='Course 1')
+            db.session.add(subscription)
+            db.session.flush()
+            db.session.add(User(fname='Test', lastname='User', email='premium@test.example',
+                                mobile_number='9000000001', role='premium', city='Pune', state='MH',
+                                password=generate_password_hash('x', method=app.config['PASSWORD_HASH_METHOD']),
+                                subscription_id=subscription.id))
+            db.session.commit()
+            db.session.remove()
+        catalog.reset()
+        yield app
+        with app.app_context():
+            db.session.remove()
+            db.drop_all(bind_key=None)
+
+
+def stored_object(digest):
+    return boto3.client('s3', region_name='us-east-1').get_object(
+        Bucket=BUCKET, Key=PREFIX + blob_key(digest))['Body'].read()
+
+
+def upload_document(client):
+    return client.post('/admin/add_documents/plan1', data={
+        'file_type': 'notes', 'file': (io.BytesIO(PDF_BYTES), 'notes.pdf')
+    }, content_type='multipart/form-data')
+
+
+def upload_video(client):
+    # Through the resumable upload API, in two parts
+    upload_id = client.post('/admin/uploads', json={'subscription': 'plan1', 'filename': 'intro.mp4'}).json['upload_id']
+    half = len(VIDEO_BYTES) // 2
+    for number, part in enumerate((VIDEO_BYTES[:half], VIDEO_BYTES[half:]), 1):
+        assert client.put(f'/admin/uploads/{upload_id}/parts/{number}', data=part).status_code == 200
+    return client.post(f'/admin/uploads/{upload_id}/complete',
+                       json={'sha256': hashlib.sha256(VIDEO_BYTES).hexdigest()})
+
+
+def assert_presigned(url, download_name, disposition, content):
+    # A signed link to the object itself, which moto answers like the real bucket would
+    parts = urlsplit(url)
+    assert BUCKET in parts.netloc + parts.path
+    assert parts.path.endswith(PREFIX + blob_key(hashlib.sha256(content).hexdigest()))
+    assert {'Signature', 'X-Amz-Signature'} & set(parse_qs(parts.query))
+    response = requests.get(url)
+    assert response.status_code == 200
+    assert response.content == content
+    assert response.headers['Content-Disposition'] == f'{disposition}; filename="{download_name}"'
+
+
+def test_uploads_are_stored_in_the_bucket(app):
+    client = app.test_client()
+    assert upload_document(client).status_code == 201
+    assert upload_video(client).status_code == 201
+
+    assert stored_object(hashlib.sha256(PDF_BYTES).hexdigest()) == PDF_BYTES
+    assert stored_object(hashlib.sha256(VIDEO_BYTES).hexdigest()) == VIDEO_BYTES
+    with app.app_context():
+        assert PDF.query.one().file_path == blob_key(hashlib.sha256(PDF_BYTES).hexdigest())
+        assert Video.query.one().file_path == blob_key(hashlib.sha256(VIDEO_BYTES).hexdigest())
+    # Nothing is left in the local spool or parts folders
+    for folder in (app.config['UPLOAD_FOLDER'], app.config['UPLOAD_PARTS_FOLDER']):
+        assert [files for _, _, files in os.walk(folder) if files] == []
+
+
+def test_get_docs_redirects_to_a_presigned_url(app):
+    client = app.test_client()
+    assert upload_document(client).status_code == 201
+
+    response = client.get('/get_documents/notes/1')
+
+    assert response.status_code == 302
+    assert 'no-store' in response.headers['Cache-Control']
+    assert_presigned(response.headers['Location'], 'notes.pdf', 'attachment', PDF_BYTES)
+
+
+def test_get_resources_lists_presigned_urls(app):
+    client = app.test_client()
+    assert upload_document(client).status_code == 201
+    assert upload_video(client).status_code == 201
+
+    response = client.get('/get-resources/1/plan1')
+
+    assert response.status_code == 200
+    pdfs, videos = response.json['pdfs'], response.json['videos']
+    assert len(pdfs) == len(videos) == 1
+    assert_presigned(pdfs[0]['url'], 'notes.pdf', 'attachment', PDF_BYTES)
+    assert_presigned(videos[0]['url'], 'intro.mp4', 'inline', VIDEO_BYTES)